@@ -1,122 +1,17 @@
 import streamlit as st
-from PIL import Image, ImageDraw, ImageFont
-import arabic_reshaper
+from PIL import Image
 import os
 import traceback
-import base64
 from auth import init_auth, logout
-import shutil
-import glob
-import json
-
-# تابع کمکی برای شکستن متن به چند خط
-def wrap_text_to_lines(draw, text, font, max_width):
-    """
-    متن را فقط بر اساس خطوط جدید (اینتر) جدا می‌کند
-    و هیچ شکستن خط خودکاری انجام نمی‌دهد
-    """
-    # فقط متن را بر اساس خطوط جدید (اینتر) جدا می‌کنیم
-    return text.split('\n')
-
-# تابع پردازش متن فارسی با مدیریت خطا برای سرور
-def process_persian_text(text):
-    """
-    پردازش متن فارسی با مدیریت خطا برای سرورها
-    استراتژی‌های مختلف fallback برای نمایش صحیح متن
-    """
-    if not text:
-        return ""
-    
-    # بررسی تنظیم دستی کاربر
-    strategy = st.session_state.get('text_processing_strategy', 'auto')
-    
-    # اگر کاربر "متن اصلی" را انتخاب کرده، بدون تغییر برگردان
-    if strategy == "original":
-        return text
-    
-    # اگر کاربر "اجباری معکوس" را انتخاب کرده
-    if strategy == "force_reverse":
-        try:
-            lines = text.split('\n')
-            processed_lines = []
-            for line in lines:
-                # معکوس کردن هر خط به صورت character-level
-                reversed_line = line[::-1]
-                processed_lines.append(reversed_line)
-            return '\n'.join(processed_lines)
-        except:
-            return text
-    
-    # حالت خودکار (auto) - استراتژی‌های پیشین
-    # استراتژی 1: فقط از arabic_reshaper استفاده کنیم (بدون bidi)
-    try:
-        reshaped_text = arabic_reshaper.reshape(text)
-        # حذف get_display و استفاده مستقیم از reshaped_text
-        if reshaped_text and len(reshaped_text) >= len(text):
-            return reshaped_text
-    except Exception as e:
-        print(f"استراتژی 1 ناموفق: {str(e)}")
-    
-    # استراتژی 2: پردازش دستی با تشخیص حروف فارسی
-    try:
-        # تشخیص حروف فارسی/عربی
-        persian_chars = 'آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی'
-        has_persian = any(char in persian_chars for char in text)
-        
-        if has_persian:
-            # برای متن فارسی: معکوس کردن کل متن
-            lines = text.split('\n')
-            processed_lines = []
-            for line in lines:
-                # معکوس کردن هر خط به صورت character-level
-                reversed_line = line[::-1]
-                processed_lines.append(reversed_line)
-            return '\n'.join(processed_lines)
-        else:
-            # برای متن انگلیسی: بدون تغییر
-            return text
-    except Exception as e:
-        print(f"استراتژی 2 ناموفق: {str(e)}")
-    
-    # استراتژی 3: معکوس کردن کلمات (fallback ساده)
-    try:
-        lines = text.split('\n')
-        processed_lines = []
-        for line in lines:
-            words = line.split()
-            if len(words) > 1:
-                # معکوس کردن ترتیب کلمات در هر خط
-                reversed_words = words[::-1]
-                processed_lines.append(' '.join(reversed_words))
-            else:
-                # اگر فقط یک کلمه است، کل خط را معکوس کن
-                processed_lines.append(line[::-1])
-        return '\n'.join(processed_lines)
-    except Exception as e:
-        print(f"استراتژی 3 ناموفق: {str(e)}")
-    
-    # استراتژی 4: در نهایت متن اصلی (worst case)
-    print("همه استراتژی‌ها ناموفق، بازگشت به متن اصلی")
-    return text
-
-# تابع بررسی وضعیت کتابخانه‌های RTL
-def check_rtl_libraries():
-    """
-    بررسی وضعیت کتابخانه‌های پردازش متن راست به چپ
-    """
-    try:
-        # تست کتابخانه‌ها با متن نمونه
-        test_text = "تست متن فارسی"
-        reshaped = arabic_reshaper.reshape(test_text)
-        # حذف get_display از تست
-        if reshaped and len(reshaped) > 0:
-            return True, "کتابخانه arabic_reshaper به درستی کار می‌کند"
-        else:
-            return False, "مشکل در خروجی arabic_reshaper"
-    except ImportError as e:
-        return False, f"کتابخانه‌های RTL نصب نیستند: {str(e)}"
-    except Exception as e:
-        return False, f"خطا در کتابخانه‌های RTL: {str(e)}"
+from render_engine import Layer, RenderCache, process_persian_text, check_rtl_libraries, render_image, PREVIEW_WIDTH
+from template_cache import template_cache, get_template
+from template_library import get_library, settings_key
+from settings_store import get_store
+from batch import parse_batch_rows, build_batch_specs, DEFAULT_WORKERS
+from image_export import EXPORT_FORMATS, DEFAULT_EXPORT_OPTIONS
+from jobs import get_job_manager, JOB_DONE, JOB_FAILED, JOB_STATUS_LABELS
+from timing import span, start_timeline, finish_timeline, summarize_log
+from font_registry import font_choices, font_label, font_settings, resolve_font, preload_fonts
 
 # تنظیمات اولیه صفحه
 st.set_page_config(
@@ -126,9 +21,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# تنظیم مسیر فونت‌ها و تمپلیت‌ها
-FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "Vazirmatn-Regular.ttf")
-FONT_BOLD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "Vazirmatn-Bold.ttf")
+# ثبت زمان مراحل این rerun (نتیجه در پایان صفحه در فایل JSONL ذخیره می‌شود)
+rerun_timeline = start_timeline("rerun")
+
+# نمایش پنل زمان‌بندی فقط با DEBUG_TIMING=1 یا برای کاربران ADMIN_USERS (جدا شده با کاما)
+DEBUG_TIMING = os.environ.get("DEBUG_TIMING") == "1"
+ADMIN_USERS = {name.strip() for name in os.environ.get("ADMIN_USERS", "").split(",") if name.strip()}
+
+# بارگذاری فونت‌ها در حافظه (فقط یک بار برای هر پروسه)
+preload_fonts()
 
 # استفاده از مسیر tmp برای پوشه‌های قابل نوشتن
 TEMPLATES_DIR = os.path.join("/tmp", "templates")
@@ -140,25 +41,57 @@ if not os.path.exists(TEMPLATES_DIR):
 if not os.path.exists(SETTINGS_DIR):
     os.makedirs(SETTINGS_DIR)
 
-# تبدیل مسیر فایل‌ها به URL
-FONT_URL = f"data:font/ttf;base64,{base64.b64encode(open(FONT_PATH, 'rb').read()).decode()}"
-FONT_BOLD_URL = f"data:font/ttf;base64,{base64.b64encode(open(FONT_BOLD_PATH, 'rb').read()).decode()}"
+# مسیر فایل قدیمی رنگ‌ها (فقط برای انتقال به دیتابیس خوانده می‌شود)
+COLORS_DB_PATH = os.path.join("/tmp", "colors.json")
+
+# دیتابیس تنظیمات (تمپلیت‌ها، تنظیمات پیش‌فرض و رنگ‌ها) مشترک برای کل پروسه
+settings_store = get_store()
+
+# انتقال یک باره فایل‌های JSON قبلی به دیتابیس (داده موجود در دیتابیس بازنویسی نمی‌شود)
+@st.cache_resource
+def migrate_legacy_settings():
+    return settings_store.migrate_json(
+        settings_dir=SETTINGS_DIR,
+        colors_path=COLORS_DB_PATH,
+        legacy_settings_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "template_settings.json")
+    )
+
+migrate_legacy_settings()
+
+# فهرست تمپلیت‌ها (مشترک برای کل پروسه، فقط هنگام آپلود و حذف تغییر می‌کند)
+template_library = get_library(TEMPLATES_DIR, settings_store)
+
+# تعداد تمپلیت‌های هر صفحه گالری و تعداد ستون‌ها
+GALLERY_PAGE_SIZE = 8
+GALLERY_COLUMNS = 4
+
+# کارهای ساخت پس‌زمینه (مشترک برای کل پروسه) و فاصله به‌روزرسانی وضعیت آنها (ثانیه)
+job_manager = get_job_manager()
+JOB_POLL_SECONDS = 1
+
+# فونت‌های رابط کاربری به صورت فایل ایستا (WOFF2 کم‌حجم) سرو می‌شوند تا مرورگر
+# فقط یک بار دانلود و کش کند (پوشه static و تنظیم enableStaticServing در .streamlit/config.toml)
+# برای ساخت دوباره: python build_static_fonts.py
+FONT_URL = "app/static/fonts/Vazirmatn-Regular.woff2"
+FONT_BOLD_URL = "app/static/fonts/Vazirmatn-Bold.woff2"
 
 # تنظیمات استایل
 st.markdown(f"""
     <style>
     @font-face {{
         font-family: 'Vazir';
-        src: url('{FONT_URL}') format('truetype');
+        src: url('{FONT_URL}') format('woff2');
         font-weight: normal;
         font-style: normal;
+        font-display: swap;
     }}
     
     @font-face {{
         font-family: 'Vazir';
-        src: url('{FONT_BOLD_URL}') format('truetype');
+        src: url('{FONT_BOLD_URL}') format('woff2');
         font-weight: bold;
         font-style: normal;
+        font-display: swap;
     }}
     
     html, body, [class*="st-"] {{
@@ -333,11 +266,15 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # بررسی احراز هویت
-if not init_auth():
+with span("page.init_auth"):
+    authenticated = init_auth()
+if not authenticated:
+    finish_timeline(rerun_timeline, page="login")
     st.stop()
 
 # بررسی وضعیت کتابخانه‌های RTL
-rtl_status, rtl_message = check_rtl_libraries()
+with span("page.check_rtl"):
+    rtl_status, rtl_message = check_rtl_libraries()
 if not rtl_status:
     # نمایش هشدار در expander تا کمتر مزاحم باشد
     with st.expander("⚠️ هشدار: مشکل در نمایش متن فارسی"):
@@ -347,28 +284,18 @@ if not rtl_status:
         st.warning("🔧 در حال حاضر از حالت جایگزین استفاده می‌شود.")
 # اگر همه چیز درست است، پیغام موفقیت نمایش نده که صفحه شلوغ نشود
 
-# مسیر فایل دیتابیس رنگ‌ها
-COLORS_DB_PATH = os.path.join("/tmp", "colors.json")
-
-# اطمینان از وجود پوشه data
-if not os.path.exists(os.path.dirname(COLORS_DB_PATH)):
-    os.makedirs(os.path.dirname(COLORS_DB_PATH))
-
-# تابع بارگذاری رنگ‌ها از فایل
+# تابع بارگذاری رنگ‌ها از دیتابیس
 def load_colors():
-    if os.path.exists(COLORS_DB_PATH):
-        try:
-            with open(COLORS_DB_PATH, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        except Exception as e:
-            print(f"خطا در بارگذاری رنگ‌ها: {str(e)}")
+    try:
+        return settings_store.colors()
+    except Exception as e:
+        print(f"خطا در بارگذاری رنگ‌ها: {str(e)}")
     return []
 
-# تابع ذخیره رنگ‌ها در فایل
+# تابع ذخیره رنگ‌ها در دیتابیس
 def save_colors(colors):
     try:
-        with open(COLORS_DB_PATH, 'w', encoding='utf-8') as file:
-            json.dump(colors, file, ensure_ascii=False, indent=2)
+        settings_store.set_colors(colors)
         return True
     except Exception as e:
         print(f"خطا در ذخیره رنگ‌ها: {str(e)}")
@@ -377,9 +304,7 @@ def save_colors(colors):
 # تابع ذخیره تنظیمات پیش‌فرض تمپلیت
 def save_template_settings(template_name, settings):
     try:
-        settings_path = os.path.join(SETTINGS_DIR, f"{template_name}.json")
-        with open(settings_path, 'w', encoding='utf-8') as file:
-            json.dump(settings, file, ensure_ascii=False, indent=2)
+        settings_store.set_settings(settings_key(template_name), settings)
         return True
     except Exception as e:
         print(f"خطا در ذخیره تنظیمات تمپلیت: {str(e)}")
@@ -387,36 +312,103 @@ def save_template_settings(template_name, settings):
 
 # تابع بارگذاری تنظیمات پیش‌فرض تمپلیت
 def load_template_settings(template_name):
-    settings_path = os.path.join(SETTINGS_DIR, f"{template_name}.json")
-    if os.path.exists(settings_path):
-        try:
-            with open(settings_path, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        except Exception as e:
-            print(f"خطا در بارگذاری تنظیمات تمپلیت: {str(e)}")
+    try:
+        return settings_store.get_settings(settings_key(template_name))
+    except Exception as e:
+        print(f"خطا در بارگذاری تنظیمات تمپلیت: {str(e)}")
     return None
 
-# تابع بررسی وجود تنظیمات پیش‌فرض برای تمپلیت
-def has_template_settings(template_name):
-    settings_path = os.path.join(SETTINGS_DIR, f"{template_name}.json")
-    return os.path.exists(settings_path)
+# بخش وضعیت کارهای ساخت کاربر (فقط همین بخش هنگام به‌روزرسانی وضعیت اجرا می‌شود)
+def jobs_fragment():
+    jobs = job_manager.jobs(st.session_state.username)
+    # وقتی آخرین کار فعال تمام شد، کل صفحه یک بار اجرا می‌شود تا به‌روزرسانی خودکار متوقف شود
+    if st.session_state.get('jobs_polling') and not any(job.active for job in jobs):
+        st.session_state.jobs_polling = False
+        st.rerun()
+    if not jobs:
+        return
 
-# کلاس برای مدیریت لایه‌ها
-class Layer:
-    def __init__(self, name, image=None):
-        self.name = name
-        self.image = image
-        self.x_percent = 50
-        self.y_percent = 0
-        self.size_percent = 100
-        self.opacity = 100
-        self.visible = True
-        self.image_key = None  # کلید یکتا برای هر تصویر
+    st.markdown('<p class="upload-header">🗂️ کارهای ساخت</p>', unsafe_allow_html=True)
+    for job in reversed(jobs):
+        st.write(f"**{job.label}** — {JOB_STATUS_LABELS[job.status]}")
+        if job.active:
+            st.progress(job.progress(), text=f"{job.done} از {job.total}")
+        elif job.status == JOB_FAILED:
+            st.error(f"❌ خطا در ساخت: {job.error}")
+            st.button("🗑️ حذف", key=f"job_discard_{job.id}", on_click=job_manager.discard, args=(job.id,))
+        elif job.status == JOB_DONE:
+            if job.mime.startswith("image/"):
+                st.image(job.data, width=300)
+            for error in job.errors:
+                st.warning(f"⚠️ {error}")
+            # نتیجه تا دانلود نگه داشته می‌شود و بعد از دانلود از حافظه حذف می‌شود
+            st.download_button(
+                label=f"⬇️ دانلود ({len(job.data) / 1024:.0f} کیلوبایت)",
+                data=job.data,
+                file_name=job.file_name,
+                mime=job.mime,
+                key=f"job_download_{job.id}",
+                on_click=job_manager.discard,
+                args=(job.id,)
+            )
+
+# تابع نمایش کارهای ساخت؛ تا وقتی کاری در حال اجراست وضعیت هر ثانیه به‌روز می‌شود
+def render_jobs_panel():
+    polling = any(job.active for job in job_manager.jobs(st.session_state.username))
+    st.session_state.jobs_polling = polling
+    st.fragment(jobs_fragment, run_every=JOB_POLL_SECONDS if polling else None)()
+
+# تابع ساخت مشخصات رندر از وضعیت فعلی صفحه
+def build_render_spec(template_path):
+    return {
+        "template": template_path,
+        "title_text": st.session_state.title_text,
+        "text": st.session_state.text,
+        "settings": {
+            "title": {
+                "font_size_pixels": st.session_state.title_font_size_percent,
+                "text_color": st.session_state.title_text_color,
+                **font_settings(st.session_state.title_font),
+                "text_x_percent": st.session_state.title_text_x_percent,
+                "text_y_percent": st.session_state.title_text_y_percent,
+                "max_text_width_percent": st.session_state.title_max_text_width_percent,
+                "line_spacing_percent": st.session_state.title_line_spacing_percent,
+                "auto_fit": st.session_state.title_auto_fit,
+                "max_text_height_percent": st.session_state.title_max_text_height_percent
+            },
+            "text": {
+                "font_size_pixels": st.session_state.font_size_percent,
+                "text_color": st.session_state.text_color,
+                **font_settings(st.session_state.text_font),
+                "text_x_percent": st.session_state.text_x_percent,
+                "text_y_percent": st.session_state.text_y_percent,
+                "max_text_width_percent": st.session_state.max_text_width_percent,
+                "line_spacing_percent": st.session_state.line_spacing_percent,
+                "auto_fit": st.session_state.auto_fit,
+                "max_text_height_percent": st.session_state.max_text_height_percent
+            }
+        },
+        "layers": list(st.session_state.layers),
+        "strategy": st.session_state.text_processing_strategy,
+        "export": {
+            "format": st.session_state.export_format,
+            "quality": st.session_state.export_quality,
+            "compress_level": st.session_state.export_compress_level
+        }
+    }
 
 # مدیریت لایه‌ها در session state
 if 'layers' not in st.session_state:
     st.session_state.layers = []
 
+# برای نگهداری نتایج میانی رندر پیش‌نمایش در این نشست
+if 'render_cache' not in st.session_state:
+    st.session_state.render_cache = RenderCache()
+
+# صفحه فعلی گالری تمپلیت‌ها
+if 'gallery_page' not in st.session_state:
+    st.session_state.gallery_page = 0
+
 # برای ذخیره نام تمپلیت انتخاب شده
 if 'selected_template_name' not in st.session_state:
     st.session_state.selected_template_name = None
@@ -442,8 +434,8 @@ if 'font_size_percent' not in st.session_state:
     st.session_state.font_size_percent = 40
 if 'text_color' not in st.session_state:
     st.session_state.text_color = "#000000"
-if 'is_bold' not in st.session_state:
-    st.session_state.is_bold = False
+if 'text_font' not in st.session_state:
+    st.session_state.text_font = resolve_font({"is_bold": False})
 if 'text_x_percent' not in st.session_state:
     st.session_state.text_x_percent = 50
 if 'text_y_percent' not in st.session_state:
@@ -452,14 +444,18 @@ if 'max_text_width_percent' not in st.session_state:
     st.session_state.max_text_width_percent = 80
 if 'line_spacing_percent' not in st.session_state:
     st.session_state.line_spacing_percent = 120
+if 'auto_fit' not in st.session_state:
+    st.session_state.auto_fit = False
+if 'max_text_height_percent' not in st.session_state:
+    st.session_state.max_text_height_percent = 30
 
 # برای ذخیره تنظیمات عنوان
 if 'title_font_size_percent' not in st.session_state:
     st.session_state.title_font_size_percent = 60
 if 'title_text_color' not in st.session_state:
     st.session_state.title_text_color = "#000000"
-if 'title_is_bold' not in st.session_state:
-    st.session_state.title_is_bold = True
+if 'title_font' not in st.session_state:
+    st.session_state.title_font = resolve_font({"is_bold": True})
 if 'title_text_x_percent' not in st.session_state:
     st.session_state.title_text_x_percent = 50
 if 'title_text_y_percent' not in st.session_state:
@@ -468,6 +464,18 @@ if 'title_max_text_width_percent' not in st.session_state:
     st.session_state.title_max_text_width_percent = 80
 if 'title_line_spacing_percent' not in st.session_state:
     st.session_state.title_line_spacing_percent = 120
+if 'title_auto_fit' not in st.session_state:
+    st.session_state.title_auto_fit = False
+if 'title_max_text_height_percent' not in st.session_state:
+    st.session_state.title_max_text_height_percent = 15
+
+# برای ذخیره تنظیمات فایل خروجی
+if 'export_format' not in st.session_state:
+    st.session_state.export_format = DEFAULT_EXPORT_OPTIONS["format"]
+if 'export_quality' not in st.session_state:
+    st.session_state.export_quality = DEFAULT_EXPORT_OPTIONS["quality"]
+if 'export_compress_level' not in st.session_state:
+    st.session_state.export_compress_level = DEFAULT_EXPORT_OPTIONS["compress_level"]
 
 # برای ذخیره وضعیت صفحه‌ای که کاربر در آن قرار دارد
 if 'current_page' not in st.session_state:
@@ -512,37 +520,34 @@ if st.session_state.current_page == 'settings':
         template_tab1, template_tab2 = st.tabs(["📂 تمپلیت‌های موجود", "⬆️ آپلود تمپلیت جدید"])
         
         with template_tab1:
-            # دریافت لیست تمپلیت‌های موجود
-            template_files = glob.glob(os.path.join(TEMPLATES_DIR, "*.png")) + glob.glob(os.path.join(TEMPLATES_DIR, "*.jpg"))
-            template_files.sort(key=os.path.getmtime, reverse=True)  # مرتب‌سازی بر اساس زمان ایجاد
+            # دریافت لیست تمپلیت‌های موجود از فهرست (جدیدترین اول)
+            template_entries = template_library.entries()
             
-            if template_files:
-                # ساخت لیست نمایشی از تمپلیت‌ها
-                template_names = [os.path.basename(f) for f in template_files]
-                
+            if st.button("🔄 بازسازی فهرست تمپلیت‌ها", key="rebuild_template_manifest", help="اگر فایل تمپلیتی خارج از برنامه اضافه یا حذف شده، فهرست را از روی پوشه دوباره بسازید"):
+                template_library.rebuild()
+                # تمپلیت‌هایی که فایلشان خارج از برنامه حذف شده از کش مشترک هم حذف می‌شوند
+                template_cache.drop_missing()
+                st.rerun()
+            
+            if template_entries:
                 # نمایش لیست تمپلیت‌ها
                 st.markdown("تمپلیت‌های ذخیره شده:")
-                for i, template in enumerate(template_names):
-                    # بررسی آیا تمپلیت دارای تنظیمات پیش‌فرض است
-                    template_basename = os.path.splitext(template)[0]
-                    has_settings = has_template_settings(template_basename)
+                for i, template_entry in enumerate(template_entries):
+                    template = template_entry["name"]
                     
                     col1, col2 = st.columns([4, 1])
                     with col1:
                         # نمایش ستاره برای تمپلیت‌هایی که تنظیمات پیش‌فرض دارند
-                        if has_settings:
-                            st.write(f"{i+1}. ⭐ {template}")
+                        if template_entry["has_settings"]:
+                            st.write(f"{i+1}. ⭐ {template} ({template_entry['width']}x{template_entry['height']})")
                         else:
-                            st.write(f"{i+1}. {template}")
+                            st.write(f"{i+1}. {template} ({template_entry['width']}x{template_entry['height']})")
                     with col2:
                         if st.button("🗑️", key=f"delete_{i}"):
                             try:
-                                os.remove(os.path.join(TEMPLATES_DIR, template))
-                                # حذف فایل تنظیمات اگر وجود داشته باشد
-                                if has_settings:
-                                    settings_path = os.path.join(SETTINGS_DIR, f"{template_basename}.json")
-                                    if os.path.exists(settings_path):
-                                        os.remove(settings_path)
+                                # حذف فایل تمپلیت و تنظیمات آن و خارج کردن از فهرست
+                                template_library.remove(template)
+                                template_cache.invalidate(template_library.path(template))
                                 
                                 # اگر تمپلیت حذف شده با تمپلیت انتخاب شده یکسان است، انتخاب را پاک کن
                                 if st.session_state.selected_template_name == template:
@@ -589,7 +594,7 @@ if st.session_state.current_page == 'settings':
                             default_title_y = st.slider("موقعیت عمودی عنوان (%)", 0, 100, 10, key="default_title_y")
                             default_title_color = st.color_picker("رنگ عنوان", "#000000", key="default_title_color")
                         
-                        default_title_is_bold = st.checkbox("عنوان بولد", value=True, key="default_title_is_bold")
+                        default_title_font = st.selectbox("فونت عنوان", font_choices(), index=font_choices().index(resolve_font({"is_bold": True})), format_func=font_label, key="default_title_font")
                         
                         # تنظیمات اساسی متن
                         st.markdown("**📝 تنظیمات متن:**")
@@ -622,19 +627,59 @@ if st.session_state.current_page == 'settings':
                             st.markdown("**تنظیمات پیشرفته عنوان:**")
                             default_title_max_width = st.slider("عرض عنوان (%)", 10, 100, 80, key="default_title_max_width")
                             default_title_line_spacing = st.slider("فاصله خطوط عنوان (%)", 100, 200, 120, key="default_title_line_spacing")
+                            default_title_auto_fit = st.checkbox("تنظیم خودکار سایز عنوان", value=False, key="default_title_auto_fit")
+                            default_title_max_height = st.slider("ارتفاع عنوان (%)", 5, 100, 15, key="default_title_max_height")
                         with adv_col2:
                             st.markdown("**تنظیمات پیشرفته متن:**")
                             default_max_text_width = st.slider("عرض متن (%)", 10, 100, 80, key="default_max_text_width")
                             default_line_spacing = st.slider("فاصله خطوط متن (%)", 100, 200, 120, key="default_line_spacing")
+                            default_auto_fit = st.checkbox("تنظیم خودکار سایز متن", value=False, key="default_auto_fit")
+                            default_max_text_height = st.slider("ارتفاع متن (%)", 5, 100, 30, key="default_max_text_height")
                         
-                        default_is_bold = st.checkbox("متن بولد", value=False, key="default_is_bold")
+                        default_text_font = st.selectbox("فونت متن", font_choices(), index=font_choices().index(resolve_font({"is_bold": False})), format_func=font_label, key="default_text_font")
                     else:
                         # مقادیر پیش‌فرض
                         default_title_max_width = 80
                         default_title_line_spacing = 120
                         default_max_text_width = 80
                         default_line_spacing = 120
-                        default_is_bold = False
+                        default_title_auto_fit = False
+                        default_title_max_height = 15
+                        default_auto_fit = False
+                        default_max_text_height = 30
+                        default_text_font = resolve_font({"is_bold": False})
+                    
+                    # تنظیمات پیش‌فرض برای تست و ذخیره
+                    template_settings = {
+                        "title": {
+                            "font_size_pixels": default_title_font_size,
+                            "text_color": default_title_color,
+                            **font_settings(default_title_font),
+                            "text_x_percent": default_title_x,
+                            "text_y_percent": default_title_y,
+                            "max_text_width_percent": default_title_max_width,
+                            "line_spacing_percent": default_title_line_spacing,
+                            "auto_fit": default_title_auto_fit,
+                            "max_text_height_percent": default_title_max_height
+                        },
+                        "text": {
+                            "font_size_pixels": default_font_size,
+                            "text_color": default_text_color,
+                            **font_settings(default_text_font),
+                            "text_x_percent": default_text_x,
+                            "text_y_percent": default_text_y,
+                            "max_text_width_percent": default_max_text_width,
+                            "line_spacing_percent": default_line_spacing,
+                            "auto_fit": default_auto_fit,
+                            "max_text_height_percent": default_max_text_height
+                        },
+                        "layer": {
+                            "x_percent": default_layer_x,
+                            "y_percent": default_layer_y,
+                            "size_percent": default_layer_size,
+                            "opacity": default_layer_opacity
+                        }
+                    }
                     
                     # بخش تست و پیش‌نمایش
                     st.markdown("---")
@@ -682,119 +727,25 @@ if st.session_state.current_page == 'settings':
                         
                         # ایجاد پیش‌نمایش تست
                         try:
-                            # محاسبه ابعاد تصویر
                             template_width, template_height = template_preview.size
-                            min_dimension = min(template_width, template_height)
-                            
-                            # ایجاد یک تصویر پایه خالی (سفید)
-                            test_preview_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 255))
                             
                             # اضافه کردن لایه نمونه اگر آپلود شده
+                            test_layers = []
                             if test_layer_file:
-                                try:
-                                    test_layer_image = Image.open(test_layer_file)
-                                    
-                                    # محاسبه سایز تصویر بر اساس درصد کوچکترین بعد تمپلیت
-                                    max_dimension = int(min_dimension * (default_layer_size / 100))
-                                    
-                                    # تغییر سایز تصویر لایه با حفظ نسبت تصویر
-                                    original_width, original_height = test_layer_image.size
-                                    aspect_ratio = original_width / original_height
-                                    
-                                    if aspect_ratio >= 1:
-                                        new_width = max_dimension
-                                        new_height = int(max_dimension / aspect_ratio)
-                                    else:
-                                        new_height = max_dimension
-                                        new_width = int(max_dimension * aspect_ratio)
-                                    
-                                    test_layer_image = test_layer_image.resize((new_width, new_height), Image.LANCZOS)
-                                    
-                                    # تبدیل به RGBA
-                                    if test_layer_image.mode != 'RGBA':
-                                        test_layer_image = test_layer_image.convert('RGBA')
-                                    
-                                    # اعمال شفافیت
-                                    if default_layer_opacity < 100:
-                                        test_layer_image.putalpha(int(255 * default_layer_opacity / 100))
-                                    
-                                    # محاسبه موقعیت
-                                    img_x = int((template_width - new_width) * (default_layer_x / 100))
-                                    img_y = int((template_height - new_height) * (default_layer_y / 100))
-                                    
-                                    # اضافه کردن تصویر به پیش‌نمایش
-                                    test_preview_image.paste(test_layer_image, (img_x, img_y), test_layer_image)
-                                except Exception as e:
-                                    st.warning(f"خطا در پردازش لایه نمونه: {str(e)}")
+                                test_layers.append({"image": Image.open(test_layer_file)})
                             
-                            # اضافه کردن تمپلیت به عنوان لایه بالایی
-                            if template_preview.mode == 'RGBA':
-                                test_preview_image = Image.alpha_composite(test_preview_image, template_preview)
-                            else:
-                                template_rgba = template_preview.convert('RGBA')
-                                test_preview_image = Image.alpha_composite(test_preview_image, template_rgba)
-                            
-                            # اضافه کردن عنوان نمونه
-                            if test_title:
-                                title_bidi_text = process_persian_text(test_title)
-                                title_font_size = default_title_font_size  # استفاده مستقیم از پیکسل
-                                
-                                try:
-                                    title_font_path = FONT_BOLD_PATH if default_title_is_bold else FONT_PATH
-                                    title_font = ImageFont.truetype(title_font_path, title_font_size)
-                                    
-                                    title_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 0))
-                                    title_draw = ImageDraw.Draw(title_image)
-                                    
-                                    title_max_width = template_width * (default_title_max_width / 100)
-                                    title_lines = wrap_text_to_lines(title_draw, title_bidi_text, title_font, title_max_width)
-                                    
-                                    title_line_spacing_factor = default_title_line_spacing / 100
-                                    title_line_height = int(title_font_size * title_line_spacing_factor)
-                                    title_total_text_height = title_line_height * len(title_lines)
-                                    
-                                    title_start_y = int((template_height - title_total_text_height) * (default_title_y / 100))
-                                    
-                                    for i, line in enumerate(title_lines):
-                                        line_width = title_draw.textlength(line, font=title_font)
-                                        line_x = int((template_width - line_width) * (default_title_x / 100))
-                                        line_y = title_start_y + i * title_line_height
-                                        title_draw.text((line_x, line_y), line, font=title_font, fill=default_title_color)
-                                    
-                                    test_preview_image = Image.alpha_composite(test_preview_image, title_image)
-                                except Exception as e:
-                                    st.warning(f"خطا در رندر عنوان: {str(e)}")
-                            
-                            # اضافه کردن متن نمونه
-                            if test_text:
-                                bidi_text = process_persian_text(test_text)
-                                font_size = default_font_size  # استفاده مستقیم از پیکسل
-                                
-                                try:
-                                    font_path = FONT_BOLD_PATH if default_is_bold else FONT_PATH
-                                    font = ImageFont.truetype(font_path, font_size)
-                                    
-                                    text_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 0))
-                                    text_draw = ImageDraw.Draw(text_image)
-                                    
-                                    max_width = template_width * (default_max_text_width / 100)
-                                    lines = wrap_text_to_lines(text_draw, bidi_text, font, max_width)
-                                    
-                                    line_spacing_factor = default_line_spacing / 100
-                                    line_height = int(font_size * line_spacing_factor)
-                                    total_text_height = line_height * len(lines)
-                                    
-                                    start_y = int((template_height - total_text_height) * (default_text_y / 100))
-                                    
-                                    for i, line in enumerate(lines):
-                                        line_width = text_draw.textlength(line, font=font)
-                                        line_x = int((template_width - line_width) * (default_text_x / 100))
-                                        line_y = start_y + i * line_height
-                                        text_draw.text((line_x, line_y), line, font=font, fill=default_text_color)
-                                    
-                                    test_preview_image = Image.alpha_composite(test_preview_image, text_image)
-                                except Exception as e:
-                                    st.warning(f"خطا در رندر متن: {str(e)}")
+                            # خطای لایه، عنوان یا متن فقط همان بخش را رد می‌کند و به صورت هشدار نمایش داده می‌شود
+                            test_render_errors = []
+                            test_preview_image = render_image({
+                                "template": template_preview,
+                                "title_text": test_title,
+                                "text": test_text,
+                                "settings": template_settings,
+                                "layers": test_layers,
+                                "strategy": st.session_state.text_processing_strategy
+                            }, preview_width=PREVIEW_WIDTH, errors=test_render_errors)
+                            for error in test_render_errors:
+                                st.warning(error)
                             
                             # نمایش پیش‌نمایش تست
                             st.image(test_preview_image, caption="پیش‌نمایش تست تنظیمات", width=300)
@@ -817,41 +768,14 @@ if st.session_state.current_page == 'settings':
                         
                         # ذخیره فایل تمپلیت
                         template_extension = os.path.splitext(template_file.name)[1]
-                        template_save_path = os.path.join(TEMPLATES_DIR, f"{final_template_name}{template_extension}")
+                        template_save_name = f"{final_template_name}{template_extension}"
                         
                         try:
-                            with open(template_save_path, "wb") as f:
-                                f.write(template_file.getbuffer())
-                            
-                            # ذخیره تنظیمات پیش‌فرض
-                            template_settings = {
-                                "title": {
-                                    "font_size_pixels": default_title_font_size,
-                                    "text_color": default_title_color,
-                                    "is_bold": default_title_is_bold,
-                                    "text_x_percent": default_title_x,
-                                    "text_y_percent": default_title_y,
-                                    "max_text_width_percent": default_title_max_width,
-                                    "line_spacing_percent": default_title_line_spacing
-                                },
-                                "text": {
-                                    "font_size_pixels": default_font_size,
-                                    "text_color": default_text_color,
-                                    "is_bold": default_is_bold,
-                                    "text_x_percent": default_text_x,
-                                    "text_y_percent": default_text_y,
-                                    "max_text_width_percent": default_max_text_width,
-                                    "line_spacing_percent": default_line_spacing
-                                },
-                                "layer": {
-                                    "x_percent": default_layer_x,
-                                    "y_percent": default_layer_y,
-                                    "size_percent": default_layer_size,
-                                    "opacity": default_layer_opacity
-                                }
-                            }
+                            # تمپلیت یک بار به PNG استاندارد RGBA تبدیل می‌شود (چرخش EXIF، sRGB، بدون metadata)
+                            template_entry = template_library.add(template_save_name, template_file.getvalue())
+                            template_cache.invalidate(template_library.path(template_entry["name"]))
                             
-                            if save_template_settings(final_template_name, template_settings):
+                            if save_template_settings(template_entry["name"], template_settings):
                                 st.success(f"✅ تمپلیت '{final_template_name}' با تنظیمات پیش‌فرض ذخیره شد!")
                                 st.info("🔄 برای استفاده از تمپلیت جدید، به صفحه اصلی بروید.")
                             else:
@@ -1000,7 +924,7 @@ if st.session_state.current_page == 'settings':
                 st.code(debug_result)
                 
                 # نمایش نتیجه نهایی
-                final_result = process_persian_text(test_text)
+                final_result = process_persian_text(test_text, st.session_state.text_processing_strategy)
                 st.success(f"نتیجه نهایی تابع process_persian_text: '{final_result}'")
             else:
                 st.warning("لطفاً ابتدا متنی وارد کنید.")
@@ -1058,7 +982,7 @@ else:
             - از فونت وزیر برای نمایش متن فارسی استفاده می‌شود
             - می‌توانید ترتیب لایه‌ها را تغییر دهید
             - هر لایه را می‌توانید فعال یا غیرفعال کنید
-            - تصویر نهایی در فایل output.png ذخیره می‌شود
+            - تصویر نهایی با فرمت انتخاب شده (PNG، JPEG یا WebP) مستقیماً دانلود می‌شود
             """)
         
         with tab2:
@@ -1074,122 +998,17 @@ else:
             
             if template_path and (st.session_state.layers or st.session_state.text or st.session_state.title_text):
                 try:
-                    # باز کردن تمپلیت
-                    template = Image.open(template_path)
-                    
-                    # محاسبه ابعاد تصویر
-                    template_width, template_height = template.size
-                    min_dimension = min(template_width, template_height)
-                    
-                    # ایجاد یک تصویر پایه خالی (سفید)
-                    preview_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 255))
-                    draw = ImageDraw.Draw(preview_image)
-                    
-                    # اضافه کردن لایه‌ها به زمینه سفید
-                    for layer in st.session_state.layers:
-                        if layer.visible and layer.image:
-                            # محاسبه سایز تصویر بر اساس درصد کوچکترین بعد تمپلیت
-                            max_dimension = int(min_dimension * (layer.size_percent / 100))
-                            
-                            # تغییر سایز تصویر لایه با حفظ نسبت تصویر
-                            original_width, original_height = layer.image.size
-                            aspect_ratio = original_width / original_height
-                            
-                            if aspect_ratio >= 1:  # عرض بزرگتر یا مساوی ارتفاع است
-                                new_width = max_dimension
-                                new_height = int(max_dimension / aspect_ratio)
-                            else:  # ارتفاع بزرگتر از عرض است
-                                new_height = max_dimension
-                                new_width = int(max_dimension * aspect_ratio)
-                            
-                            layer_image = layer.image.resize((new_width, new_height), Image.LANCZOS)
-                            
-                            # تبدیل به RGBA اگر PNG است
-                            if layer_image.mode != 'RGBA':
-                                layer_image = layer_image.convert('RGBA')
-                            
-                            # اعمال شفافیت
-                            if layer.opacity < 100:
-                                layer_image.putalpha(int(255 * layer.opacity / 100))
-                            
-                            # محاسبه موقعیت مرکز تصویر
-                            img_x = int((template_width - new_width) * (layer.x_percent / 100))
-                            img_y = int((template_height - new_height) * (layer.y_percent / 100))
-                            
-                            # اضافه کردن تصویر به پیش‌نمایش
-                            preview_image.paste(layer_image, (img_x, img_y), layer_image)
-                    
-                    # اضافه کردن تمپلیت به عنوان لایه بالایی
-                    if template.mode == 'RGBA':
-                        preview_image = Image.alpha_composite(preview_image, template)
-                    else:
-                        template_rgba = template.convert('RGBA')
-                        preview_image = Image.alpha_composite(preview_image, template_rgba)
-                    
-                    # اضافه کردن عنوان
-                    if st.session_state.title_text:
-                        title_bidi_text = process_persian_text(st.session_state.title_text)
-                        title_font_size = st.session_state.title_font_size_percent  # استفاده مستقیم از پیکسل
-                        
-                        try:
-                            title_font_path = FONT_BOLD_PATH if st.session_state.title_is_bold else FONT_PATH
-                            title_font = ImageFont.truetype(title_font_path, title_font_size)
-                            
-                            title_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 0))
-                            title_draw = ImageDraw.Draw(title_image)
-                            
-                            title_max_width = template_width * (st.session_state.title_max_text_width_percent / 100)
-                            title_lines = wrap_text_to_lines(title_draw, title_bidi_text, title_font, title_max_width)
-                            
-                            title_line_spacing_factor = st.session_state.title_line_spacing_percent / 100
-                            title_line_height = int(title_font_size * title_line_spacing_factor)
-                            title_total_text_height = title_line_height * len(title_lines)
-                            
-                            title_start_y = int((template_height - title_total_text_height) * (st.session_state.title_text_y_percent / 100))
-                            
-                            for i, line in enumerate(title_lines):
-                                line_width = title_draw.textlength(line, font=title_font)
-                                line_x = int((template_width - line_width) * (st.session_state.title_text_x_percent / 100))
-                                line_y = title_start_y + i * title_line_height
-                                title_draw.text((line_x, line_y), line, font=title_font, fill=st.session_state.title_text_color)
-                            
-                            preview_image = Image.alpha_composite(preview_image, title_image)
-                        except Exception as e:
-                            st.error(f"خطا در بارگذاری فونت عنوان: {str(e)}")
-
-                    # اضافه کردن متن
-                    if st.session_state.text:
-                        bidi_text = process_persian_text(st.session_state.text)
-                        font_size = st.session_state.font_size_percent  # استفاده مستقیم از پیکسل
-                        
-                        try:
-                            font_path = FONT_BOLD_PATH if st.session_state.is_bold else FONT_PATH
-                            font = ImageFont.truetype(font_path, font_size)
-                            
-                            text_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 0))
-                            text_draw = ImageDraw.Draw(text_image)
-                            
-                            max_width = template_width * (st.session_state.max_text_width_percent / 100)
-                            lines = wrap_text_to_lines(text_draw, bidi_text, font, max_width)
-                            
-                            line_spacing_factor = st.session_state.line_spacing_percent / 100
-                            line_height = int(font_size * line_spacing_factor)
-                            total_text_height = line_height * len(lines)
-                            
-                            start_y = int((template_height - total_text_height) * (st.session_state.text_y_percent / 100))
-                            
-                            for i, line in enumerate(lines):
-                                line_width = text_draw.textlength(line, font=font)
-                                line_x = int((template_width - line_width) * (st.session_state.text_x_percent / 100))
-                                line_y = start_y + i * line_height
-                                text_draw.text((line_x, line_y), line, font=font, fill=st.session_state.text_color)
-                            
-                            preview_image = Image.alpha_composite(preview_image, text_image)
-                        except Exception as e:
-                            st.error(f"خطا در بارگذاری فونت: {str(e)}")
+                    # پیش‌نمایش در اندازه کوچک رندر می‌شود؛ اندازه اصلی فقط هنگام ساخت تصویر
+                    # خطای لایه، عنوان یا متن فقط همان بخش را رد می‌کند و بقیه پیش‌نمایش ساخته می‌شود
+                    preview_errors = []
+                    with span("page.preview"):
+                        preview_image = render_image(build_render_spec(template_path), preview_width=PREVIEW_WIDTH, cache=st.session_state.render_cache, errors=preview_errors)
+                    template_width, template_height = get_template(template_path).size
                     
                     # نمایش تصویر با سایز محدود شده در placeholder
                     with preview_placeholder.container():
+                        for error in preview_errors:
+                            st.warning(f"⚠️ {error}")
                         st.image(preview_image, caption=f"پیش‌نمایش ({template_width}x{template_height})", width=300)
                         
                         # اضافه کردن دکمه refresh برای بروزرسانی دستی
@@ -1212,45 +1031,46 @@ else:
     # آپلود و مدیریت تمپلیت
     st.markdown('<p class="upload-header">1️⃣ انتخاب تمپلیت</p>', unsafe_allow_html=True)
     
-    # دریافت لیست تمپلیت‌های موجود
-    template_files = glob.glob(os.path.join(TEMPLATES_DIR, "*.png")) + glob.glob(os.path.join(TEMPLATES_DIR, "*.jpg"))
-    template_files.sort(key=os.path.getmtime, reverse=True)  # مرتب‌سازی بر اساس زمان ایجاد
+    # دریافت لیست تمپلیت‌های موجود از فهرست (جدیدترین اول)
+    template_entries = template_library.entries()
     
-    if template_files:
-        # ساخت لیست نمایشی از تمپلیت‌ها
-        template_names = [os.path.basename(f) for f in template_files]
-        
-        # ایجاد لیست نمایشی با ستاره برای تمپلیت‌هایی که تنظیمات پیش‌فرض دارند
-        display_template_names = []
-        for template in template_names:
-            template_basename = os.path.splitext(template)[0]
-            if has_template_settings(template_basename):
-                display_template_names.append(f"⭐ {template}")
-            else:
-                display_template_names.append(template)
+    if template_entries:
+        # گالری صفحه‌بندی شده از thumbnail های آماده (تمپلیت اصلی decode نمی‌شود)
+        page_count = (len(template_entries) + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+        st.session_state.gallery_page = min(st.session_state.gallery_page, page_count - 1)
+        if page_count > 1:
+            prev_col, page_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                if st.button("→ قبلی", key="gallery_prev", disabled=st.session_state.gallery_page == 0):
+                    st.session_state.gallery_page -= 1
+                    st.rerun()
+            with page_col:
+                st.markdown(f"<p style='text-align: center;'>صفحه {st.session_state.gallery_page + 1} از {page_count}</p>", unsafe_allow_html=True)
+            with next_col:
+                if st.button("بعدی ←", key="gallery_next", disabled=st.session_state.gallery_page >= page_count - 1):
+                    st.session_state.gallery_page += 1
+                    st.rerun()
         
-        template_options = ["انتخاب کنید..."] + display_template_names
-        
-        # انتخاب تمپلیت
-        selected_display_template = st.selectbox(
-            "تمپلیت موردنظر را انتخاب کنید",
-            template_options,
-            index=0,
-            help="یک تمپلیت از لیست انتخاب کنید یا از بخش 'تنظیمات' تمپلیت جدید اضافه کنید"
-        )
+        page_start = st.session_state.gallery_page * GALLERY_PAGE_SIZE
+        gallery_cols = st.columns(GALLERY_COLUMNS)
+        for index, template_entry in enumerate(template_entries[page_start:page_start + GALLERY_PAGE_SIZE]):
+            with gallery_cols[index % GALLERY_COLUMNS]:
+                # نمایش ستاره برای تمپلیت‌هایی که تنظیمات پیش‌فرض دارند
+                label = f"⭐ {template_entry['name']}" if template_entry["has_settings"] else template_entry["name"]
+                st.image(template_library.thumbnail_path(template_entry, 160), caption=label, width=160)
+                is_selected = st.session_state.selected_template_name == template_entry["name"]
+                if st.button("✅ انتخاب شده" if is_selected else "انتخاب", key=f"pick_template_{page_start + index}", disabled=is_selected):
+                    st.session_state.selected_template_name = template_entry["name"]
+                    st.session_state.selected_template_path = template_library.path(template_entry["name"])
+                    st.rerun()
         
-        if selected_display_template != "انتخاب کنید...":
-            # حذف ستاره از نام تمپلیت برای پیدا کردن فایل
-            selected_template = selected_display_template.replace("⭐ ", "")
-            selected_template_path = os.path.join(TEMPLATES_DIR, selected_template)
-            
-            # ذخیره انتخاب کاربر
-            st.session_state.selected_template_name = selected_template
-            st.session_state.selected_template_path = selected_template_path
+        selected_entry = template_library.get(st.session_state.selected_template_name) if st.session_state.selected_template_name else None
+        if selected_entry:
+            selected_template = selected_entry["name"]
+            selected_template_path = template_library.path(selected_template)
             
             # بررسی و بارگذاری تنظیمات پیش‌فرض
-            template_basename = os.path.splitext(selected_template)[0]
-            template_settings = load_template_settings(template_basename)
+            template_settings = load_template_settings(selected_template)
             
             # فقط در صورتی تنظیمات پیش‌فرض را اعمال کن که تمپلیت تغییر کرده باشد
             if template_settings and st.session_state.get('last_loaded_template') != selected_template:
@@ -1259,22 +1079,26 @@ else:
                 # پشتیبانی از هر دو فرمت قدیم و جدید
                 st.session_state.font_size_percent = text_settings.get("font_size_pixels", text_settings.get("font_size_percent", 40))
                 st.session_state.text_color = text_settings.get("text_color", "#000000")
-                st.session_state.is_bold = text_settings.get("is_bold", False)
+                st.session_state.text_font = resolve_font(text_settings)
                 st.session_state.text_x_percent = text_settings.get("text_x_percent", 50)
                 st.session_state.text_y_percent = text_settings.get("text_y_percent", 98)
                 st.session_state.max_text_width_percent = text_settings.get("max_text_width_percent", 80)
                 st.session_state.line_spacing_percent = text_settings.get("line_spacing_percent", 120)
+                st.session_state.auto_fit = text_settings.get("auto_fit", False)
+                st.session_state.max_text_height_percent = text_settings.get("max_text_height_percent", 30)
                 
                 # اعمال تنظیمات پیش‌فرض برای عنوان
                 title_settings = template_settings.get("title", {})
                 # پشتیبانی از هر دو فرمت قدیم و جدید
                 st.session_state.title_font_size_percent = title_settings.get("font_size_pixels", title_settings.get("font_size_percent", 60))
                 st.session_state.title_text_color = title_settings.get("text_color", "#000000")
-                st.session_state.title_is_bold = title_settings.get("is_bold", True)
+                st.session_state.title_font = resolve_font({"is_bold": True, **title_settings})
                 st.session_state.title_text_x_percent = title_settings.get("text_x_percent", 50)
                 st.session_state.title_text_y_percent = title_settings.get("text_y_percent", 10)
                 st.session_state.title_max_text_width_percent = title_settings.get("max_text_width_percent", 80)
                 st.session_state.title_line_spacing_percent = title_settings.get("line_spacing_percent", 120)
+                st.session_state.title_auto_fit = title_settings.get("auto_fit", False)
+                st.session_state.title_max_text_height_percent = title_settings.get("max_text_height_percent", 15)
                 
                 # ذخیره نام تمپلیت فعلی
                 st.session_state.last_loaded_template = selected_template
@@ -1285,10 +1109,16 @@ else:
                 
                 st.session_state.default_layer_settings = template_settings.get("layer", {})
             
-            # نمایش پیش‌نمایش تمپلیت
+            # نمایش پیش‌نمایش تمپلیت از thumbnail آماده
             try:
-                template_preview = Image.open(selected_template_path)
-                st.image(template_preview, caption=f"پیش‌نمایش تمپلیت: {selected_template}", width=300)
+                st.image(template_library.thumbnail_path(selected_entry, 300), caption=f"پیش‌نمایش تمپلیت: {selected_template} ({selected_entry['width']}x{selected_entry['height']})", width=300)
+                
+                # نواحی شفاف هنگام ذخیره تمپلیت محاسبه شده‌اند؛ لایه‌ها زیر تمپلیت قرار می‌گیرند
+                if selected_entry.get("opaque"):
+                    st.warning("⚠️ این تمپلیت ناحیه شفاف ندارد؛ لایه‌ها زیر تمپلیت قرار می‌گیرند و دیده نمی‌شوند.")
+                elif selected_entry.get("transparent_bbox"):
+                    left, top, right, bottom = selected_entry["transparent_bbox"]
+                    st.caption(f"لایه‌ها فقط در ناحیه شفاف تمپلیت دیده می‌شوند: از ({left}, {top}) تا ({right}, {bottom}) پیکسل")
                 
                 if template_settings:
                     st.success(f"✅ تمپلیت '{selected_template}' با تنظیمات پیش‌فرض انتخاب شد. حالا می‌توانید لایه‌ها و متن را اضافه کنید.")
@@ -1431,9 +1261,9 @@ else:
             title_color = st.color_picker("رنگ عنوان", st.session_state.title_text_color, key="title_color_picker", help="رنگ عنوان را انتخاب کنید")
             if 'title_color_picker' in st.session_state and st.session_state.title_color_picker != st.session_state.title_text_color:
                 st.session_state.title_text_color = st.session_state.title_color_picker
-            title_is_bold = st.checkbox("عنوان بولد", value=st.session_state.title_is_bold, key="title_is_bold_checkbox", help="نمایش عنوان به صورت بولد")
-            if 'title_is_bold_checkbox' in st.session_state and st.session_state.title_is_bold_checkbox != st.session_state.title_is_bold:
-                st.session_state.title_is_bold = st.session_state.title_is_bold_checkbox
+            title_font = st.selectbox("فونت عنوان", font_choices(), index=font_choices().index(st.session_state.title_font), format_func=font_label, key="title_font_select", help="خانواده و وزن فونت عنوان")
+            if 'title_font_select' in st.session_state and st.session_state.title_font_select != st.session_state.title_font:
+                st.session_state.title_font = st.session_state.title_font_select
 
         with title_col2:
             title_x = st.slider("موقعیت افقی عنوان (%)", 0, 100, st.session_state.title_text_x_percent, key="title_x_slider", help="0: کاملاً چپ تمپلیت، 50: وسط تمپلیت، 100: کاملاً راست تمپلیت")
@@ -1456,6 +1286,12 @@ else:
             if 'title_line_spacing_slider' in st.session_state:
                 st.session_state.title_line_spacing_percent = st.session_state.title_line_spacing_slider
 
+            title_auto_fit = st.checkbox("تنظیم خودکار سایز عنوان", value=st.session_state.title_auto_fit, key="title_auto_fit_checkbox", help="بزرگترین سایزی که عنوان در کادر عرض × ارتفاع جا شود انتخاب می‌شود و خطوط بلند شکسته می‌شوند")
+            st.session_state.title_auto_fit = title_auto_fit
+            if title_auto_fit:
+                title_max_height = st.slider("ارتفاع عنوان (%)", 5, 100, st.session_state.title_max_text_height_percent, key="title_max_height_slider", help="حداکثر ارتفاع عنوان به صورت درصدی از ارتفاع تمپلیت")
+                st.session_state.title_max_text_height_percent = title_max_height
+
         # ورود متن
         st.markdown('<p class="upload-header">4️⃣ وارد کردن متن</p>', unsafe_allow_html=True)
         text_input = st.text_area("متن مورد نظر را وارد کنید", value=st.session_state.text, height=150, key="text_input", help="متن فارسی که می‌خواهید روی تصویر قرار دهید را وارد کنید. هر خط جدید در تصویر نیز به عنوان خط جدید نمایش داده می‌شود.")
@@ -1477,9 +1313,9 @@ else:
             text_color = st.color_picker("رنگ متن", st.session_state.text_color, key="text_color_picker", help="رنگ متن را انتخاب کنید")
             if 'text_color_picker' in st.session_state and st.session_state.text_color_picker != st.session_state.text_color:
                 st.session_state.text_color = st.session_state.text_color_picker
-            is_bold = st.checkbox("متن بولد", value=st.session_state.is_bold, key="is_bold_checkbox", help="نمایش متن به صورت بولد")
-            if 'is_bold_checkbox' in st.session_state and st.session_state.is_bold_checkbox != st.session_state.is_bold:
-                st.session_state.is_bold = st.session_state.is_bold_checkbox
+            text_font = st.selectbox("فونت متن", font_choices(), index=font_choices().index(st.session_state.text_font), format_func=font_label, key="text_font_select", help="خانواده و وزن فونت متن")
+            if 'text_font_select' in st.session_state and st.session_state.text_font_select != st.session_state.text_font:
+                st.session_state.text_font = st.session_state.text_font_select
 
         with text_col2:
             text_x = st.slider("موقعیت افقی متن (%)", 0, 100, st.session_state.text_x_percent, key="text_x_slider", help="0: کاملاً چپ تمپلیت، 50: وسط تمپلیت، 100: کاملاً راست تمپلیت")
@@ -1502,8 +1338,39 @@ else:
             if 'line_spacing_slider' in st.session_state:
                 st.session_state.line_spacing_percent = st.session_state.line_spacing_slider
 
-        # دکمه ساخت تصویر
+            auto_fit = st.checkbox("تنظیم خودکار سایز متن", value=st.session_state.auto_fit, key="auto_fit_checkbox", help="بزرگترین سایزی که متن در کادر عرض × ارتفاع جا شود انتخاب می‌شود و خطوط بلند شکسته می‌شوند")
+            st.session_state.auto_fit = auto_fit
+            if auto_fit:
+                max_text_height = st.slider("ارتفاع متن (%)", 5, 100, st.session_state.max_text_height_percent, key="max_text_height_slider", help="حداکثر ارتفاع متن به صورت درصدی از ارتفاع تمپلیت")
+                st.session_state.max_text_height_percent = max_text_height
+
+        # تنظیمات فایل خروجی
         st.markdown("---")
+        format_col, option_col = st.columns(2)
+        with format_col:
+            export_options = list(EXPORT_FORMATS)
+            st.session_state.export_format = st.selectbox(
+                "فرمت خروجی",
+                export_options,
+                index=export_options.index(st.session_state.export_format),
+                format_func=lambda image_format: EXPORT_FORMATS[image_format]["label"],
+                key="export_format_select"
+            )
+        with option_col:
+            if st.session_state.export_format == "PNG":
+                st.session_state.export_compress_level = st.slider(
+                    "سطح فشرده‌سازی PNG", 0, 9, st.session_state.export_compress_level,
+                    key="export_compress_level_slider",
+                    help="اعداد کمتر سریع‌تر ذخیره می‌شوند و اعداد بیشتر فایل کوچک‌تری می‌سازند (کیفیت تغییر نمی‌کند)"
+                )
+            else:
+                st.session_state.export_quality = st.slider(
+                    "کیفیت", 1, 100, st.session_state.export_quality,
+                    key="export_quality_slider",
+                    help="کیفیت بیشتر یعنی فایل بزرگ‌تر"
+                )
+
+        # دکمه ساخت تصویر
         if st.button("🎨 ساخت تصویر"):
             # بررسی وجود تمپلیت (از فایل آپلود شده یا انتخاب شده)
             template_path = None
@@ -1514,141 +1381,9 @@ else:
             
             if template_path and (st.session_state.layers or st.session_state.text or st.session_state.title_text):
                 try:
-                    # باز کردن تمپلیت
-                    template = Image.open(template_path)
-                    
-                    # محاسبه ابعاد تصویر
-                    template_width, template_height = template.size
-                    min_dimension = min(template_width, template_height)
-                    
-                    # ایجاد یک تصویر پایه خالی (سفید)
-                    preview_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 255))
-                    draw = ImageDraw.Draw(preview_image)
-                    
-                    # اضافه کردن لایه‌ها به زمینه سفید
-                    for layer in st.session_state.layers:
-                        if layer.visible and layer.image:
-                            # محاسبه سایز تصویر بر اساس درصد کوچکترین بعد تمپلیت
-                            max_dimension = int(min_dimension * (layer.size_percent / 100))
-                            
-                            # تغییر سایز تصویر لایه با حفظ نسبت تصویر
-                            original_width, original_height = layer.image.size
-                            aspect_ratio = original_width / original_height
-                            
-                            if aspect_ratio >= 1:  # عرض بزرگتر یا مساوی ارتفاع است
-                                new_width = max_dimension
-                                new_height = int(max_dimension / aspect_ratio)
-                            else:  # ارتفاع بزرگتر از عرض است
-                                new_height = max_dimension
-                                new_width = int(max_dimension * aspect_ratio)
-                            
-                            layer_image = layer.image.resize((new_width, new_height), Image.LANCZOS)
-                            
-                            # تبدیل به RGBA اگر PNG است
-                            if layer_image.mode != 'RGBA':
-                                layer_image = layer_image.convert('RGBA')
-                            
-                            # اعمال شفافیت
-                            if layer.opacity < 100:
-                                layer_image.putalpha(int(255 * layer.opacity / 100))
-                            
-                            # محاسبه موقعیت مرکز تصویر
-                            img_x = int((template_width - new_width) * (layer.x_percent / 100))
-                            img_y = int((template_height - new_height) * (layer.y_percent / 100))
-                            
-                            # اضافه کردن تصویر به پیش‌نمایش
-                            preview_image.paste(layer_image, (img_x, img_y), layer_image)
-                    
-                    # اضافه کردن تمپلیت به عنوان لایه بالایی
-                    if template.mode == 'RGBA':
-                        preview_image = Image.alpha_composite(preview_image, template)
-                    else:
-                        template_rgba = template.convert('RGBA')
-                        preview_image = Image.alpha_composite(preview_image, template_rgba)
-                    
-                    # اضافه کردن عنوان
-                    if st.session_state.title_text:
-                        title_bidi_text = process_persian_text(st.session_state.title_text)
-                        title_font_size = st.session_state.title_font_size_percent  # استفاده مستقیم از پیکسل
-                        
-                        try:
-                            title_font_path = FONT_BOLD_PATH if st.session_state.title_is_bold else FONT_PATH
-                            title_font = ImageFont.truetype(title_font_path, title_font_size)
-                            
-                            title_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 0))
-                            title_draw = ImageDraw.Draw(title_image)
-                            
-                            title_max_width = template_width * (st.session_state.title_max_text_width_percent / 100)
-                            title_lines = wrap_text_to_lines(title_draw, title_bidi_text, title_font, title_max_width)
-                            
-                            title_line_spacing_factor = st.session_state.title_line_spacing_percent / 100
-                            title_line_height = int(title_font_size * title_line_spacing_factor)
-                            title_total_text_height = title_line_height * len(title_lines)
-                            
-                            title_start_y = int((template_height - title_total_text_height) * (st.session_state.title_text_y_percent / 100))
-                            
-                            for i, line in enumerate(title_lines):
-                                line_width = title_draw.textlength(line, font=title_font)
-                                line_x = int((template_width - line_width) * (st.session_state.title_text_x_percent / 100))
-                                line_y = title_start_y + i * title_line_height
-                                title_draw.text((line_x, line_y), line, font=title_font, fill=st.session_state.title_text_color)
-                            
-                            preview_image = Image.alpha_composite(preview_image, title_image)
-                        except Exception as e:
-                            st.error(f"خطا در بارگذاری فونت عنوان: {str(e)}")
-
-                    # اضافه کردن متن
-                    if st.session_state.text:
-                        bidi_text = process_persian_text(st.session_state.text)
-                        font_size = st.session_state.font_size_percent  # استفاده مستقیم از پیکسل
-                        
-                        try:
-                            font_path = FONT_BOLD_PATH if st.session_state.is_bold else FONT_PATH
-                            font = ImageFont.truetype(font_path, font_size)
-                            
-                            text_image = Image.new('RGBA', (template_width, template_height), (255, 255, 255, 0))
-                            text_draw = ImageDraw.Draw(text_image)
-                            
-                            max_width = template_width * (st.session_state.max_text_width_percent / 100)
-                            lines = wrap_text_to_lines(text_draw, bidi_text, font, max_width)
-                            
-                            line_spacing_factor = st.session_state.line_spacing_percent / 100
-                            line_height = int(font_size * line_spacing_factor)
-                            total_text_height = line_height * len(lines)
-                            
-                            start_y = int((template_height - total_text_height) * (st.session_state.text_y_percent / 100))
-                            
-                            for i, line in enumerate(lines):
-                                line_width = text_draw.textlength(line, font=font)
-                                line_x = int((template_width - line_width) * (st.session_state.text_x_percent / 100))
-                                line_y = start_y + i * line_height
-                                text_draw.text((line_x, line_y), line, font=font, fill=st.session_state.text_color)
-                            
-                            preview_image = Image.alpha_composite(preview_image, text_image)
-                        except Exception as e:
-                            st.error(f"خطا در بارگذاری فونت: {str(e)}")
-                    
-                    # نمایش تصویر با سایز محدود شده
-                    st.image(preview_image, caption=f"پیش‌نمایش ({template_width}x{template_height})", width=300)
-                    
-                    final_image = preview_image.copy()
-                    final_image.save("output.png", quality=100)
-                    
-                    with open("output.png", "rb") as file:
-                        btn = st.download_button(
-                            label="⬇️ دانلود تصویر",
-                            data=file,
-                            file_name="output.png",
-                            mime="image/png",
-                            key="main_download_btn"
-                        )
-                    
-                    st.success(f"✅ تصویر با موفقیت ساخته شد! (سایز: {template_width}x{template_height})")
-                    
-                    # ذخیره تصویر با سایز اصلی
-                    final_image = preview_image.copy()
-                    final_image.save("output.png", quality=100)
-                    
+                    # رندر در پس‌زمینه انجام می‌شود و صفحه در این مدت قابل ویرایش می‌ماند
+                    job_manager.submit_image(st.session_state.username, f"تصویر ({st.session_state.selected_template_name})", build_render_spec(template_path))
+                    st.toast("🎨 ساخت تصویر شروع شد؛ نتیجه در بخش کارهای ساخت نمایش داده می‌شود")
                 except Exception as e:
                     st.error(f"❌ خطا در ساخت تصویر: {str(e)}")
                     st.error("جزئیات خطا:")
@@ -1657,6 +1392,67 @@ else:
                 st.error("❌ لطفاً ابتدا یک تمپلیت انتخاب کنید و حداقل یک لایه، عنوان یا متن وارد کنید!")
         else:
             st.warning("⚠️ لطفاً ابتدا یک تمپلیت انتخاب کنید یا یک تمپلیت جدید آپلود کنید.")
+        
+        # ساخت دسته‌ای از فایل CSV یا JSONL
+        st.markdown("---")
+        st.markdown('<p class="upload-header">5️⃣ ساخت دسته‌ای</p>', unsafe_allow_html=True)
+        with st.expander("📦 ساخت چند تصویر از فایل CSV یا JSONL"):
+            st.info("هر ردیف فایل یک تصویر می‌سازد. ستون‌های title_text و text عنوان و متن هر تصویر هستند. "
+                    "با ستون‌هایی مثل title.text_color یا text.font_size_pixels می‌توانید تنظیمات همان ردیف را تغییر دهید. "
+                    "بقیه تنظیمات، لایه‌ها و تمپلیت از وضعیت فعلی صفحه گرفته می‌شوند.")
+            batch_file = st.file_uploader("فایل ردیف‌ها را انتخاب کنید", type=["csv", "jsonl"], key="batch_upload")
+            
+            if batch_file:
+                try:
+                    batch_rows = parse_batch_rows(batch_file.getvalue(), batch_file.name)
+                    st.write(f"📄 تعداد ردیف‌ها: {len(batch_rows)}")
+                    batch_workers = st.number_input(
+                        "تعداد پردازش‌های موازی",
+                        min_value=1, max_value=max(os.cpu_count() or 1, DEFAULT_WORKERS), value=DEFAULT_WORKERS,
+                        key="batch_workers",
+                        help="ردیف‌ها بین این تعداد پردازش تقسیم می‌شوند؛ تمپلیت و تصاویر لایه‌ها فقط یک بار به هر پردازش داده می‌شوند"
+                    )
+                    
+                    if st.button("📦 ساخت دسته‌ای", key="batch_build_btn"):
+                        batch_specs = build_batch_specs(batch_rows, build_render_spec(st.session_state.selected_template_path))
+                        job_manager.submit_batch(
+                            st.session_state.username, f"دسته‌ای ({len(batch_specs)} تصویر)", batch_specs, workers=int(batch_workers)
+                        )
+                        st.toast("📦 ساخت دسته‌ای شروع شد؛ نتیجه در بخش کارهای ساخت نمایش داده می‌شود")
+                except Exception as e:
+                    st.error(f"❌ خطا در ساخت دسته‌ای: {str(e)}")
+
+        # وضعیت کارهای ساخت پس‌زمینه
+        st.markdown("---")
+        render_jobs_panel()
+
+# پایان ثبت زمان‌های این rerun و نمایش پنل زمان‌بندی
+timing_record = finish_timeline(rerun_timeline, page=st.session_state.current_page)
+if DEBUG_TIMING or st.session_state.get("username") in ADMIN_USERS:
+    with st.sidebar.expander("⏱️ زمان‌بندی مراحل"):
+        st.caption(f"این rerun: {timing_record['total_ms']:.0f} میلی‌ثانیه")
+        cache_stats = template_cache.stats()
+        st.caption(
+            f"کش تمپلیت‌ها: {cache_stats['entries']} مورد، "
+            f"{cache_stats['total_bytes'] / (1024 * 1024):.0f} از {cache_stats['budget_bytes'] / (1024 * 1024):.0f} مگابایت"
+        )
+        st.table([
+            {"مرحله": name, "تعداد": entry["count"], "میلی‌ثانیه": round(entry["ms"], 1)}
+            for name, entry in timing_record["spans"].items()
+        ])
+        # خلاصه فایل زمان‌بندی فقط با درخواست محاسبه می‌شود تا خواندن فایل به زمان هر rerun اضافه نشود
+        # (هر rerun یک خط به فایل اضافه می‌کند، پس کش بر اساس زمان تغییر فایل فایده‌ای ندارد)
+        timing_summary = None
+        if st.button("📊 محاسبه p50/p95", key="timing_summary_btn"):
+            timing_summary = summarize_log(last=500, timeline="rerun")
+            if not timing_summary:
+                st.caption("هنوز زمان‌بندی ثبت نشده است.")
+        if timing_summary:
+            st.caption("۵۰۰ rerun آخر")
+            st.table([
+                {"مرحله": name, "تعداد": entry["count"], "p50": entry["p50_ms"], "p95": entry["p95_ms"]}
+                for name, entry in sorted(timing_summary.items(), key=lambda item: -item[1]["p95_ms"])
+            ])
 
 # تابع تست و debug برای متن فارسی
 def debug_persian_text(text):
@@ -1,106 +1,193 @@
 import sqlite3
 import bcrypt
 import streamlit as st
+import streamlit.components.v1 as components
+from jose import jwt, JWTError
 from datetime import datetime, timedelta
 import os
 import json
-from pathlib import Path
+import queue
+import secrets
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # تنظیمات دیتابیس
-DB_PATH = "users.db"
-COOKIE_FILE = "auth_cookie.json"
+DB_PATH = os.environ.get("AUTH_DB_PATH", "users.db")
+
+# تنظیمات توکن ورود (در کوکی مرورگر هر کاربر نگه داشته می‌شود)
+AUTH_COOKIE_NAME = "image_gen_auth"
+AUTH_TOKEN_DAYS = int(os.environ.get("AUTH_TOKEN_DAYS", "7"))
+AUTH_TOKEN_ALGORITHM = "HS256"
+
+# کلید امضای توکن‌ها؛ اگر AUTH_SECRET_KEY داده نشود یک بار ساخته و در این فایل نگه داشته می‌شود
+AUTH_SECRET_FILE = os.environ.get("AUTH_SECRET_FILE", "auth_secret.key")
+
+# هزینه bcrypt برای رمزهای جدید (هش‌های قبلی با هزینه خودشان بررسی می‌شوند)
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+# حداکثر تعداد هش bcrypt همزمان؛ بقیه ورودها در صف منتظر می‌مانند تا CPU برای rerun بقیه نشست‌ها بماند
+AUTH_HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", "2"))
+
+# حداکثر تعداد اتصال‌های باز نگه داشته شده به دیتابیس کاربران
+AUTH_DB_POOL_SIZE = int(os.environ.get("AUTH_DB_POOL_SIZE", "4"))
+
+# bcrypt در حین هش GIL را آزاد می‌کند، پس اجرای آن در این pool بقیه threadها را متوقف نمی‌کند
+_hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="auth-hash")
+_connection_pool = queue.LifoQueue(maxsize=AUTH_DB_POOL_SIZE)
+_db_lock = threading.Lock()
+_db_ready = False
+
+def _new_connection():
+    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+@contextmanager
+def get_connection():
+    """گرفتن یک اتصال از pool و برگرداندن آن بعد از استفاده"""
+    try:
+        conn = _connection_pool.get_nowait()
+    except queue.Empty:
+        conn = _new_connection()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # اتصال در هر حالت (حتی بعد از خطا) به pool برمی‌گردد یا بسته می‌شود
+        try:
+            _connection_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
 def init_db():
-    """ایجاد دیتابیس و جدول کاربران"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """ایجاد دیتابیس و جدول کاربران (فقط یک بار در هر پروسه)"""
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if _db_ready:
+            return
+        with get_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP
+                )
+            ''')
+            conn.commit()
+        _db_ready = True
 
 def hash_password(password):
-    """هش کردن پسورد"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    """هش کردن پسورد (در pool هش)"""
+    return _hash_executor.submit(
+        lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+    ).result()
 
 def verify_password(password, hashed):
-    """تایید پسورد"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+    """تایید پسورد (در pool هش)"""
+    return _hash_executor.submit(bcrypt.checkpw, password.encode('utf-8'), hashed).result()
 
 def register_user(username, password, email):
     """ثبت نام کاربر جدید"""
+    init_db()
+    # هش قبل از گرفتن اتصال انجام می‌شود تا اتصال در طول هش آزاد بماند
+    hashed_password = hash_password(password)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        hashed_password = hash_password(password)
-        c.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
-                 (username, hashed_password, email))
-        conn.commit()
+        with get_connection() as conn:
+            conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
+                         (username, hashed_password, email))
+            conn.commit()
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def login_user(username, password):
     """ورود کاربر"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT password FROM users WHERE username = ?', (username,))
-    result = c.fetchone()
-    
+    init_db()
+    with get_connection() as conn:
+        result = conn.execute('SELECT password FROM users WHERE username = ?', (username,)).fetchone()
+
     if result and verify_password(password, result[0]):
         # بروزرسانی آخرین زمان ورود
-        c.execute('UPDATE users SET last_login = ? WHERE username = ?',
-                 (datetime.now(), username))
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            conn.execute('UPDATE users SET last_login = ? WHERE username = ?',
+                         (datetime.now(), username))
+            conn.commit()
         return True
-    conn.close()
     return False
 
-def save_auth_cookie(username):
-    """ذخیره کوکی احراز هویت"""
-    cookie_data = {
-        "username": username,
-        "expires": (datetime.now() + timedelta(days=7)).isoformat()
+def _load_secret_key():
+    secret_key = os.environ.get("AUTH_SECRET_KEY")
+    if secret_key:
+        return secret_key
+    if os.path.exists(AUTH_SECRET_FILE):
+        with open(AUTH_SECRET_FILE, 'r') as f:
+            return f.read().strip()
+    secret_key = secrets.token_urlsafe(32)
+    # فایل فقط برای کاربر سرور قابل خواندن است
+    fd = os.open(AUTH_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(secret_key)
+    return secret_key
+
+# کلید فقط یک بار در هر پروسه خوانده می‌شود
+SECRET_KEY = _load_secret_key()
+
+def create_auth_token(username):
+    """ساخت توکن امضا شده با تاریخ انقضا"""
+    claims = {
+        "sub": username,
+        "exp": datetime.utcnow() + timedelta(days=AUTH_TOKEN_DAYS)
     }
-    with open(COOKIE_FILE, 'w') as f:
-        json.dump(cookie_data, f)
+    return jwt.encode(claims, SECRET_KEY, algorithm=AUTH_TOKEN_ALGORITHM)
 
-def load_auth_cookie():
-    """بارگذاری کوکی احراز هویت"""
-    if not os.path.exists(COOKIE_FILE):
-        return None
-    
+def verify_auth_token(token):
+    """بررسی امضا و انقضای توکن در حافظه؛ خروجی نام کاربری یا None"""
     try:
-        with open(COOKIE_FILE, 'r') as f:
-            cookie_data = json.load(f)
-        
-        # بررسی تاریخ انقضا
-        expires = datetime.fromisoformat(cookie_data["expires"])
-        if datetime.now() > expires:
-            os.remove(COOKIE_FILE)
-            return None
-        
-        return cookie_data["username"]
-    except:
+        return jwt.decode(token, SECRET_KEY, algorithms=[AUTH_TOKEN_ALGORITHM]).get("sub")
+    except JWTError:
         return None
 
+def _write_cookie(value, max_age):
+    """
+    تنظیم کوکی در مرورگر با JavaScript (Streamlit خودش امکان تنظیم کوکی ندارد)
+    iframe کامپوننت هم‌مبدأ صفحه است، پس کوکی برای کل برنامه تنظیم می‌شود
+    """
+    components.html(
+        f"""<script>
+        window.parent.document.cookie = {json.dumps(f"{AUTH_COOKIE_NAME}={value}")}
+            + "; path=/; max-age={max_age}; SameSite=Strict"
+            + (window.parent.location.protocol === "https:" ? "; Secure" : "");
+        </script>""",
+        height=0
+    )
+
+def save_auth_cookie(username):
+    """ساخت توکن و تنظیم کوکی آن در rerun بعدی (بعد از st.rerun)"""
+    st.session_state.auth_cookie_pending = create_auth_token(username)
+
+def load_auth_cookie():
+    """خواندن توکن از کوکی‌های همین مرورگر (بدون خواندن فایل)"""
+    token = st.context.cookies.get(AUTH_COOKIE_NAME)
+    if not token:
+        return None
+    return verify_auth_token(token)
+
 def check_authentication():
     """بررسی وضعیت احراز هویت کاربر"""
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
     
-    if not st.session_state.authenticated:
+    # کوکی‌های st.context مربوط به زمان اتصال مرورگر است؛ بعد از خروج دوباره استفاده نمی‌شود
+    if not st.session_state.authenticated and not st.session_state.get('logged_out'):
         # بررسی کوکی
         username = load_auth_cookie()
         if username:
@@ -123,6 +210,7 @@ def login_page():
             if login_user(username, password):
                 st.session_state.authenticated = True
                 st.session_state.username = username
+                st.session_state.logged_out = False
                 save_auth_cookie(username)
                 st.success("✅ ورود موفقیت‌آمیز!")
                 st.rerun()
@@ -154,14 +242,19 @@ def logout():
     """خروج از سیستم"""
     st.session_state.authenticated = False
     st.session_state.username = None
-    if os.path.exists(COOKIE_FILE):
-        os.remove(COOKIE_FILE)
+    st.session_state.logged_out = True
+    st.session_state.auth_cookie_pending = ""
     st.rerun()
 
 def init_auth():
     """راه‌اندازی اولیه سیستم احراز هویت"""
     init_db()
     
+    # تنظیم یا پاک کردن کوکی بعد از ورود یا خروج
+    token = st.session_state.pop('auth_cookie_pending', None)
+    if token is not None:
+        _write_cookie(token, AUTH_TOKEN_DAYS * 24 * 3600 if token else 0)
+    
     if not check_authentication():
         tab1, tab2 = st.tabs(["ورود", "ثبت نام"])
         with tab1:
@@ -0,0 +1,285 @@
+import os
+import io
+import csv
+import json
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from PIL import Image
+from render_engine import (
+    Layer, render_image, load_template, layer_from_spec,
+    DEFAULT_TITLE_SETTINGS, DEFAULT_TEXT_SETTINGS, DEFAULT_LAYER_SETTINGS
+)
+from image_export import DEFAULT_EXPORT_OPTIONS, encode_image, output_file_name
+
+# تعداد پیش‌فرض پردازش‌های موازی برای ساخت دسته‌ای
+DEFAULT_WORKERS = int(os.environ.get("BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+# حالت‌هایی که می‌توان پیکسل‌هایشان را مستقیماً از حافظه مشترک خواند
+SHARED_MODES = ("L", "RGB", "RGBA")
+
+# بخش‌های تنظیمات که هر ردیف می‌تواند تغییر دهد (همان ساختار تنظیمات تمپلیت)
+SETTINGS_SECTIONS = {
+    "title": DEFAULT_TITLE_SETTINGS,
+    "text": DEFAULT_TEXT_SETTINGS,
+    "layer": DEFAULT_LAYER_SETTINGS
+}
+
+# تابع تبدیل مقدار متنی CSV به نوع مقدار پیش‌فرض
+def _coerce_value(value, default):
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "y", "بله")
+    if isinstance(default, int):
+        return int(float(value))
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+# تابع خواندن ردیف‌های فایل CSV یا JSONL
+def parse_batch_rows(data, file_name):
+    """
+    ردیف‌های فایل آپلود شده را به لیست dict تبدیل می‌کند
+    فرمت از روی پسوند فایل تشخیص داده می‌شود
+    """
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    extension = os.path.splitext(file_name)[1].lower()
+
+    if extension in (".jsonl", ".json"):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if extension == ".csv":
+        reader = csv.DictReader(io.StringIO(text))
+        # ستون‌های خالی CSV نادیده گرفته می‌شوند
+        return [{k: v for k, v in row.items() if k and v not in (None, "")} for row in reader]
+    raise ValueError(f"فرمت فایل پشتیبانی نمی‌شود: {extension}")
+
+# تابع استخراج تغییرات تنظیمات از یک ردیف
+def row_overrides(row):
+    """
+    تغییرات هر بخش را هم به صورت تو در تو ({"title": {...}})
+    و هم به صورت ستون نقطه‌دار (title.text_color) می‌پذیرد
+    """
+    overrides = {}
+    for section, defaults in SETTINGS_SECTIONS.items():
+        values = {}
+        if isinstance(row.get(section), dict):
+            values.update(row[section])
+        prefix = f"{section}."
+        for key, value in row.items():
+            if key.startswith(prefix):
+                values[key[len(prefix):]] = value
+        if values:
+            overrides[section] = {key: _coerce_value(value, defaults.get(key)) for key, value in values.items()}
+    return overrides
+
+# تابع ساخت مشخصات رندر هر ردیف بر اساس مشخصات پایه
+def build_batch_specs(rows, base_spec):
+    """
+    برای هر ردیف یک مشخصات رندر می‌سازد: عنوان و متن از ردیف،
+    بقیه از مشخصات پایه (تمپلیت، لایه‌ها و تنظیمات فعلی)
+    """
+    base_settings = base_spec.get("settings") or {}
+    base_layers = base_spec.get("layers") or []
+    image_format = (base_spec.get("export") or DEFAULT_EXPORT_OPTIONS).get("format", DEFAULT_EXPORT_OPTIONS["format"])
+    # لایه‌هایی با تغییرات یکسان بین ردیف‌ها مشترک هستند تا resize تکرار نشود
+    shared_layers = {}
+
+    specs = []
+    for index, row in enumerate(rows):
+        overrides = row_overrides(row)
+        settings = {
+            section: {**(base_settings.get(section) or {}), **overrides.get(section, {})}
+            for section in set(base_settings) | set(overrides)
+        }
+
+        layer_overrides = overrides.get("layer")
+        layers = base_layers
+        if layer_overrides:
+            key = tuple(sorted(layer_overrides.items()))
+            if key not in shared_layers:
+                shared_layers[key] = [_apply_layer_overrides(layer, layer_overrides) for layer in base_layers]
+            layers = shared_layers[key]
+
+        specs.append({
+            **base_spec,
+            "title_text": str(row.get("title_text", "")),
+            "text": str(row.get("text", "")).replace("\\n", "\n"),
+            "settings": settings,
+            "layers": layers,
+            "output": _output_name(row.get("output"), index, image_format)
+        })
+    return specs
+
+# تابع تعیین نام فایل خروجی هر ردیف داخل ZIP (پسوند مطابق فرمت خروجی)
+def _output_name(name, index, image_format=DEFAULT_EXPORT_OPTIONS["format"]):
+    if not name:
+        name = f"{index + 1:04d}"
+    return output_file_name(os.path.basename(str(name)), image_format)
+
+# تابع ساخت نسخه جدید لایه با تغییرات یک ردیف
+def _apply_layer_overrides(layer, overrides):
+    if isinstance(layer, dict):
+        return {**layer, **overrides}
+    new_layer = Layer(layer.name, layer.image)
+    new_layer.x_percent = overrides.get("x_percent", layer.x_percent)
+    new_layer.y_percent = overrides.get("y_percent", layer.y_percent)
+    new_layer.size_percent = overrides.get("size_percent", layer.size_percent)
+    new_layer.opacity = overrides.get("opacity", layer.opacity)
+    new_layer.visible = overrides.get("visible", layer.visible)
+    return new_layer
+
+# تابع رندر یک مشخصات و تبدیل آن به بایت‌های فایل با فرمت خروجی مشخصات
+def render_encoded(spec):
+    image_data, _, _ = encode_image(render_image(spec), spec.get("export"))
+    return image_data
+
+# تابع رندر همه ردیف‌ها و ساخت فایل ZIP در حافظه
+def render_batch_zip(specs, progress_callback=None, workers=1):
+    """
+    همه مشخصات را رندر و در یک فایل ZIP قرار می‌دهد
+    با workers بیشتر از 1 رندر بین چند پردازش تقسیم می‌شود
+    خروجی: (محتوای ZIP، لیست خطاها)
+    """
+    if workers > 1 and len(specs) > 1:
+        results = _render_parallel(specs, progress_callback, workers)
+    else:
+        results = []
+        for index, spec in enumerate(specs):
+            try:
+                results.append((render_encoded(spec), None))
+            except Exception as e:
+                results.append((None, str(e)))
+            if progress_callback:
+                progress_callback(index + 1, len(specs))
+
+    buffer = io.BytesIO()
+    errors = []
+    # فرمت‌های خروجی خودشان فشرده هستند، پس ZIP بدون فشرده‌سازی مجدد ساخته می‌شود
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for index, (spec, (image_data, error)) in enumerate(zip(specs, results)):
+            if error is not None:
+                errors.append(f"ردیف {index + 1}: {error}")
+            else:
+                archive.writestr(spec["output"], image_data)
+    return buffer.getvalue(), errors
+
+# تصاویر مشترک و لایه‌های ساخته شده در هر پردازش موازی
+_worker_images = []
+_worker_memories = []
+_worker_layers = {}
+
+# تابع آماده‌سازی هر پردازش: اتصال به تصاویر مشترک (فقط یک بار برای هر پردازش)
+def _init_worker(descriptors):
+    global _worker_images, _worker_memories
+    _worker_images = []
+    _worker_memories = []
+    for descriptor in descriptors:
+        if descriptor["kind"] == "shm":
+            memory = shared_memory.SharedMemory(name=descriptor["name"])
+            # تصویر مستقیماً روی حافظه مشترک ساخته می‌شود و کپی نمی‌شود
+            image = Image.frombuffer(descriptor["mode"], descriptor["size"], memory.buf, "raw", descriptor["mode"], 0, 1)
+            _worker_memories.append(memory)
+            _worker_images.append(image)
+        else:
+            _worker_images.append(descriptor["image"])
+
+# تابع رندر یک ردیف در پردازش موازی
+def _render_task(task):
+    spec = dict(task)
+    spec["template"] = _worker_images[task["template"]]
+
+    layers = []
+    for position, layer_spec in enumerate(task["layers"]):
+        # شیء Layer هر تصویر در این پردازش نگه داشته می‌شود تا resize آن تکرار نشود
+        key = (position, layer_spec["image"])
+        layer = _worker_layers.get(key)
+        if layer is None:
+            layer = Layer("", _worker_images[layer_spec["image"]])
+            _worker_layers[key] = layer
+        layer.x_percent = layer_spec["x_percent"]
+        layer.y_percent = layer_spec["y_percent"]
+        layer.size_percent = layer_spec["size_percent"]
+        layer.opacity = layer_spec["opacity"]
+        layer.visible = layer_spec["visible"]
+        layers.append(layer)
+    spec["layers"] = layers
+    return render_encoded(spec)
+
+# تابع قرار دادن تصاویر مشترک در حافظه مشترک
+def _share_images(specs):
+    """
+    تمپلیت و تصاویر لایه‌ها فقط یک بار به حافظه مشترک منتقل می‌شوند
+    و در مشخصات هر ردیف فقط شماره تصویر فرستاده می‌شود
+    """
+    descriptors = []
+    memories = []
+    indexes = {}
+
+    def share(image):
+        if id(image) in indexes:
+            return indexes[id(image)]
+        if image.mode in SHARED_MODES:
+            data = image.tobytes()
+            memory = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+            memory.buf[:len(data)] = data
+            memories.append(memory)
+            descriptors.append({"kind": "shm", "name": memory.name, "mode": image.mode, "size": image.size})
+        else:
+            # حالت‌های دیگر (مثل P) یک بار همراه با آماده‌سازی پردازش فرستاده می‌شوند
+            descriptors.append({"kind": "image", "image": image})
+        indexes[id(image)] = len(descriptors) - 1
+        return indexes[id(image)]
+
+    # تصاویر تا پایان کار نگه داشته می‌شوند تا id آنها تکراری نشود
+    images = []
+    tasks = []
+    for spec in specs:
+        settings = spec.get("settings") or {}
+        template = load_template(spec["template"])
+        images.append(template)
+        task = {key: value for key, value in spec.items() if key not in ("template", "layers")}
+        task["template"] = share(template)
+        task["layers"] = []
+        for layer in spec.get("layers") or []:
+            if not isinstance(layer, Layer):
+                layer = layer_from_spec(layer, settings.get("layer"))
+            if layer.image is None:
+                continue
+            images.append(layer.image)
+            task["layers"].append({
+                "image": share(layer.image),
+                "x_percent": layer.x_percent,
+                "y_percent": layer.y_percent,
+                "size_percent": layer.size_percent,
+                "opacity": layer.opacity,
+                "visible": layer.visible
+            })
+        tasks.append(task)
+    return tasks, descriptors, memories
+
+# تابع رندر موازی مشخصات با ProcessPoolExecutor
+def _render_parallel(specs, progress_callback, workers):
+    tasks, descriptors, memories = _share_images(specs)
+    results = [None] * len(specs)
+    try:
+        # از spawn استفاده می‌شود تا پردازش‌ها وضعیت thread های Streamlit را به ارث نبرند
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(specs)), mp_context=context,
+                                 initializer=_init_worker, initargs=(descriptors,)) as executor:
+            futures = {executor.submit(_render_task, task): index for index, task in enumerate(tasks)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                try:
+                    results[index] = (future.result(), None)
+                except Exception as e:
+                    results[index] = (None, str(e))
+                if progress_callback:
+                    progress_callback(done, len(specs))
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+    return results
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import glob
+import hashlib
+import argparse
+import resource
+import subprocess
+import statistics
+import tracemalloc
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from render_engine import Layer, render_image
+
+# پوشه تمپلیت‌های همراه برنامه و مسیر پیش‌فرض فایل مبنا
+TEMPLATES_DIR = os.path.join(ROOT_DIR, "templates")
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# درصد کندی یا افزایش حافظه مجاز نسبت به مبنا
+DEFAULT_TOLERANCE = 20.0
+
+SHORT_TITLE = "عنوان کوتاه"
+SHORT_TEXT = "یک متن کوتاه فارسی"
+LONG_TITLE = "عنوان بلند آزمایشی برای اندازه‌گیری سرعت رندر\nبا دو خط و کلمات English"
+LONG_TEXT = "\n".join(
+    "زبان فارسی یکی از زبان‌های هندواروپایی است که در ایران، افغانستان و تاجیکستان به آن سخن می‌گویند"
+    for _ in range(12)
+)
+
+# لایه‌های مصنوعی: (اندازه تصویر، حالت، اندازه درصدی، شفافیت)
+SYNTHETIC_LAYERS = (
+    ((1200, 900), "RGBA", 80, 60),
+    ((640, 640), "RGB", 40, 100)
+)
+
+# سناریوهای هر تمپلیت: (عنوان، متن، با لایه، تنظیم خودکار سایز)
+SCENARIOS = {
+    "short": (SHORT_TITLE, SHORT_TEXT, False, False),
+    "long": (LONG_TITLE, LONG_TEXT, False, False),
+    "layers": (SHORT_TITLE, SHORT_TEXT, True, False),
+    "full": (LONG_TITLE, LONG_TEXT, True, True)
+}
+
+# تابع پیدا کردن تمپلیت‌ها (تمپلیت‌های با محتوای یکسان فقط یک بار)
+def find_templates():
+    templates = {}
+    paths = sorted(glob.glob(os.path.join(TEMPLATES_DIR, "*.png")) + glob.glob(os.path.join(TEMPLATES_DIR, "*.jpg")))
+    for path in paths:
+        with open(path, 'rb') as file:
+            content_hash = hashlib.sha1(file.read()).hexdigest()
+        templates.setdefault(content_hash, path)
+    return {os.path.splitext(os.path.basename(path))[0].strip(): path for path in templates.values()}
+
+# تابع ساخت تصویر مصنوعی قابل تکرار برای لایه
+def synthetic_image(size, mode):
+    gradient = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    bands = (gradient, gradient.transpose(Image.ROTATE_90).resize(size), radial)
+    if mode == "RGBA":
+        bands += (Image.eval(radial, lambda value: 255 - value),)
+    return Image.merge(mode, bands)
+
+# تابع ساخت مشخصات رندر یک سناریو
+def build_spec(template_path, scenario):
+    title_text, text, with_layers, auto_fit = SCENARIOS[scenario]
+    layers = []
+    if with_layers:
+        for index, (size, mode, size_percent, opacity) in enumerate(SYNTHETIC_LAYERS):
+            layer = Layer(f"layer-{index}", synthetic_image(size, mode))
+            layer.size_percent = size_percent
+            layer.opacity = opacity
+            layer.y_percent = 30 + index * 30
+            layers.append(layer)
+    return {
+        "template": template_path,
+        "title_text": title_text,
+        "text": text,
+        "settings": {
+            "title": {"auto_fit": auto_fit},
+            "text": {"auto_fit": auto_fit, "text_y_percent": 60}
+        },
+        "layers": layers
+    }
+
+# تابع اجرای یک سناریو در همین پروسه (در پروسه جدا صدا زده می‌شود)
+def run_scenario(template_path, scenario, repeat):
+    """
+    اولین رندر با کش‌های خالی (cold) و بقیه با کش‌های گرم اندازه‌گیری می‌شوند؛
+    یک رندر جدا هم با tracemalloc برای اوج حافظه تخصیص داده شده پایتون اجرا می‌شود
+    (بافرهای تصویر Pillow در tracemalloc دیده نمی‌شوند و در اوج RSS آمده‌اند)
+    """
+    spec = build_spec(template_path, scenario)
+
+    start = time.perf_counter()
+    render_image(spec)
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_image(spec)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    render_image(spec)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "cold_ms": round(cold_ms, 2),
+        "warm_ms": round(statistics.median(timings), 2),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_traced_kb": peak_traced // 1024
+    }
+
+# تابع اجرای یک سناریو در پروسه جدا تا RSS و کش‌ها مستقل باشند
+def run_isolated(template_path, scenario, repeat):
+    command = [sys.executable, os.path.abspath(__file__), "--run-scenario", template_path, scenario, "--repeat", str(repeat)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+# تابع مقایسه نتیجه با مبنا
+def compare(results, baseline, tolerance):
+    """
+    خروجی: لیست پیام‌های کندی یا افزایش حافظه بیشتر از حد مجاز
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ("cold_ms", "warm_ms", "peak_rss_kb", "peak_traced_kb"):
+            if base.get(metric) and result[metric] > base[metric] * (1 + tolerance / 100):
+                change = (result[metric] / base[metric] - 1) * 100
+                regressions.append(f"{name} {metric}: {base[metric]} -> {result[metric]} (+{change:.0f}%)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="بنچمارک رندر روی تمپلیت‌های همراه برنامه (بدون Streamlit)")
+    parser.add_argument("--repeat", type=int, default=5, help="تعداد رندرهای گرم هر سناریو")
+    parser.add_argument("--only", default=None, help="فقط سناریوهایی که نامشان شامل این متن است")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="فایل JSON مبنا")
+    parser.add_argument("--save-baseline", action="store_true", help="نتیجه این اجرا به عنوان مبنا ذخیره شود")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="اگر فایل مبنا وجود نداشته باشد خطا برگردانده نشود (فقط اندازه‌گیری)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="درصد کندی یا افزایش حافظه مجاز")
+    parser.add_argument("--run-scenario", nargs=2, metavar=("TEMPLATE", "SCENARIO"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario[0], args.run_scenario[1], args.repeat)))
+        return 0
+
+    results = {}
+    print(f"{'scenario':<36}{'cold ms':>10}{'warm ms':>10}{'RSS MB':>9}{'alloc KB':>10}")
+    for template_name, template_path in find_templates().items():
+        for scenario in SCENARIOS:
+            name = f"{template_name}/{scenario}"
+            if args.only and args.only not in name:
+                continue
+            result = run_isolated(template_path, scenario, args.repeat)
+            results[name] = result
+            print(f"{name:<36}{result['cold_ms']:>10.1f}{result['warm_ms']:>10.1f}"
+                  f"{result['peak_rss_kb'] / 1024:>9.1f}{result['peak_traced_kb']:>10}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"مبنا در {args.baseline} ذخیره شد.")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("فایل مبنا وجود ندارد؛ با --save-baseline بسازید.")
+        # بدون مبنا بررسی کندی انجام نشده است، پس به طور پیش‌فرض خطا برگردانده می‌شود
+        return 0 if args.allow_missing_baseline else 2
+    with open(args.baseline, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"کندتر از مبنا: {regression}")
+    if not regressions:
+        print(f"همه سناریوها در محدوده {args.tolerance:.0f}% مبنا هستند.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import argparse
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render_engine import draw_text_block, _shape_text, _word_length, DEFAULT_TEXT_SETTINGS
+from text_sprites import text_sprite_cache
+from font_registry import get_font, RAQM_AVAILABLE, LAYOUT_RAQM, LAYOUT_BASIC
+
+# یک پاراگراف نمونه فارسی که برای ساخت متن‌های طولانی تکرار می‌شود
+SAMPLE_PARAGRAPH = (
+    "زبان فارسی یکی از زبان‌های هندواروپایی است که در ایران، افغانستان و تاجیکستان "
+    "به آن سخن می‌گویند. این متن برای اندازه‌گیری سرعت شکل‌دهی و چیدمان متن راست به چپ "
+    "در مسیرهای مختلف رندر استفاده می‌شود و شامل اعداد ۱۲۳۴ و کلمات English هم هست."
+)
+
+# تابع ساخت متن طولانی با تعداد خط مشخص
+def build_text(lines):
+    return "\n".join(SAMPLE_PARAGRAPH for _ in range(lines))
+
+# تابع اندازه‌گیری زمان رسم متن با یک موتور چیدمان
+def measure(layout, text, repeat, cold):
+    """
+    میانگین زمان رسم متن (میلی‌ثانیه) را برمی‌گرداند
+    در حالت cold کش شکل‌دهی، فونت‌ها، عرض کلمات و تصاویر خطوط قبل از هر تکرار خالی می‌شوند
+    """
+    canvas = Image.new('RGBA', (1080, 1920), (255, 255, 255, 255))
+    settings = {**DEFAULT_TEXT_SETTINGS, "font_size_pixels": 32, "max_text_width_percent": 100}
+    timings = []
+    for _ in range(repeat):
+        if cold:
+            _shape_text.cache_clear()
+            get_font.cache_clear()
+            _word_length.cache_clear()
+            text_sprite_cache.clear()
+        start = time.perf_counter()
+        draw_text_block(canvas, text, settings, "auto", layout=layout)
+        timings.append(time.perf_counter() - start)
+    return sum(timings) / len(timings) * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="مقایسه سرعت چیدمان RAQM با reshaper روی پاراگراف‌های طولانی فارسی")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1, 10, 40], help="تعداد خط‌های متن در هر اندازه‌گیری")
+    parser.add_argument("--repeat", type=int, default=20, help="تعداد تکرار هر اندازه‌گیری")
+    args = parser.parse_args(argv)
+
+    layouts = [LAYOUT_BASIC]
+    if RAQM_AVAILABLE:
+        layouts.append(LAYOUT_RAQM)
+    else:
+        print("RAQM در این نسخه Pillow در دسترس نیست؛ فقط مسیر reshaper اندازه‌گیری می‌شود.")
+
+    print(f"{'layout':<8}{'lines':>7}{'cold ms':>12}{'warm ms':>12}")
+    for lines in args.lines:
+        text = build_text(lines)
+        for layout in layouts:
+            cold = measure(layout, text, args.repeat, cold=True)
+            warm = measure(layout, text, args.repeat, cold=False)
+            print(f"{layout:<8}{lines:>7}{cold:>12.2f}{warm:>12.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import os
+import sys
+from fontTools import subset
+from font_registry import font_path, DEFAULT_FAMILY, DEFAULT_WEIGHT, BOLD_WEIGHT
+
+# پوشه فایل‌های ایستا که Streamlit در مسیر /app/static سرو می‌کند
+STATIC_FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "fonts")
+
+# فونت‌های رابط کاربری (فقط همین دو وزن در CSS استفاده می‌شوند)
+UI_FONTS = (
+    (DEFAULT_FAMILY, DEFAULT_WEIGHT),
+    (DEFAULT_FAMILY, BOLD_WEIGHT)
+)
+
+# محدوده حروف لازم برای رابط کاربری: لاتین، عربی/فارسی و علائم رایج
+UI_UNICODES = (
+    "U+0020-007E",  # لاتین پایه
+    "U+00A0-00FF",  # لاتین تکمیلی (شامل « »)
+    "U+0600-06FF",  # عربی و فارسی (شامل ارقام فارسی)
+    "U+200C-200F",  # نیم‌فاصله و علائم جهت
+    "U+2010-2027",  # خط تیره‌ها و نقل قول‌ها
+    "U+2030-203A",
+    "U+FB50-FDFF",  # اشکال نمایشی عربی A
+    "U+FE70-FEFF"   # اشکال نمایشی عربی B
+)
+
+# تابع ساخت نسخه WOFF2 کم‌حجم یک فونت
+def build_font(family, weight):
+    output_path = os.path.join(STATIC_FONTS_DIR, f"{family}-{weight}.woff2")
+    subset.main([
+        font_path(family, weight),
+        f"--unicodes={','.join(UI_UNICODES)}",
+        "--layout-features=*",
+        "--flavor=woff2",
+        f"--output-file={output_path}"
+    ])
+    return output_path
+
+def main():
+    os.makedirs(STATIC_FONTS_DIR, exist_ok=True)
+    for family, weight in UI_FONTS:
+        output_path = build_font(family, weight)
+        print(f"{output_path}: {os.path.getsize(font_path(family, weight)) // 1024} KB -> {os.path.getsize(output_path) // 1024} KB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import os
+import io
+import threading
+from functools import lru_cache
+from PIL import ImageFont, features
+from timing import timed
+
+# پوشه فونت‌های همراه برنامه
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+# فونت‌های موجود به تفکیک خانواده و وزن (به ترتیب وزن)
+FONT_FAMILIES = {
+    "Vazirmatn": {
+        "Thin": "Vazirmatn-Thin.ttf",
+        "ExtraLight": "Vazirmatn-ExtraLight.ttf",
+        "Light": "Vazirmatn-Light.ttf",
+        "Regular": "Vazirmatn-Regular.ttf",
+        "Medium": "Vazirmatn-Medium.ttf",
+        "SemiBold": "Vazirmatn-SemiBold.ttf",
+        "Bold": "Vazirmatn-Bold.ttf",
+        "ExtraBold": "Vazirmatn-ExtraBold.ttf",
+        "Black": "Vazirmatn-Black.ttf"
+    },
+    "Vazir": {
+        "Regular": "Vazir-Regular.ttf"
+    },
+    "IRANSans": {
+        "Regular": "IRANSans.ttf"
+    }
+}
+
+DEFAULT_FAMILY = "Vazirmatn"
+DEFAULT_WEIGHT = "Regular"
+BOLD_WEIGHT = "Bold"
+
+# وزن‌هایی که معادل حالت بولد قدیمی هستند
+BOLD_WEIGHTS = ("SemiBold", "Bold", "ExtraBold", "Black")
+
+# حداکثر تعداد شیء فونت (خانواده، وزن، سایز) که در حافظه نگه داشته می‌شود
+FONT_CACHE_SIZE = int(os.environ.get("FONT_CACHE_SIZE", "256"))
+
+# امضای ابتدای فایل‌های فونت TrueType/OpenType
+FONT_SIGNATURES = (b"\x00\x01\x00\x00", b"OTTO", b"true", b"ttcf")
+
+# موتورهای چیدمان متن: RAQM (HarfBuzz) خودش متن راست به چپ را شکل‌دهی و مرتب می‌کند
+LAYOUT_RAQM = "raqm"
+LAYOUT_BASIC = "basic"
+LAYOUT_ENGINES = {
+    LAYOUT_RAQM: ImageFont.Layout.RAQM,
+    LAYOUT_BASIC: ImageFont.Layout.BASIC
+}
+
+# پشتیبانی RAQM فقط یک بار هنگام شروع بررسی می‌شود (با TEXT_LAYOUT=basic غیرفعال می‌شود)
+RAQM_AVAILABLE = features.check("raqm") and os.environ.get("TEXT_LAYOUT", LAYOUT_RAQM) != LAYOUT_BASIC
+
+_preload_lock = threading.Lock()
+
+# تابع دریافت مسیر فایل فونت
+def font_path(family=DEFAULT_FAMILY, weight=DEFAULT_WEIGHT):
+    return os.path.join(FONTS_DIR, FONT_FAMILIES[family][weight])
+
+FONT_PATH = font_path(DEFAULT_FAMILY, DEFAULT_WEIGHT)
+FONT_BOLD_PATH = font_path(DEFAULT_FAMILY, BOLD_WEIGHT)
+
+# تابع بررسی سالم بودن فایل فونت
+def _is_font_file(path):
+    try:
+        with open(path, 'rb') as file:
+            return file.read(4) in FONT_SIGNATURES
+    except OSError:
+        return False
+
+# تابع ساخت لیست فونت‌های قابل استفاده
+def _available_families():
+    """
+    فقط فونت‌هایی که فایل معتبر دارند در لیست قرار می‌گیرند
+    """
+    available = {}
+    for family, weights in FONT_FAMILIES.items():
+        for weight, file_name in weights.items():
+            if _is_font_file(os.path.join(FONTS_DIR, file_name)):
+                available.setdefault(family, {})[weight] = file_name
+            else:
+                print(f"فایل فونت نامعتبر است و نادیده گرفته شد: {file_name}")
+    return available
+
+AVAILABLE_FAMILIES = _available_families()
+
+# تابع دریافت لیست همه فونت‌ها به صورت (خانواده، وزن)
+def font_choices():
+    return [(family, weight) for family, weights in AVAILABLE_FAMILIES.items() for weight in weights]
+
+# تابع نمایش نام فونت در رابط کاربری
+def font_label(choice):
+    family, weight = choice
+    return f"{family} {weight}"
+
+# تابع تشخیص خانواده و وزن فونت از تنظیمات متن
+def resolve_font(settings):
+    """
+    خانواده و وزن فونت را از تنظیمات برمی‌گرداند
+    برای تنظیمات قدیمی که فقط is_bold دارند، وزن از روی آن تعیین می‌شود
+    """
+    family = settings.get("font_family") or DEFAULT_FAMILY
+    weight = settings.get("font_weight")
+    if not weight:
+        weight = BOLD_WEIGHT if settings.get("is_bold") else DEFAULT_WEIGHT
+
+    # اگر فونت درخواستی موجود نباشد، به نزدیک‌ترین گزینه برمی‌گردیم
+    if family not in AVAILABLE_FAMILIES:
+        family = DEFAULT_FAMILY
+    if weight not in AVAILABLE_FAMILIES[family]:
+        weight = DEFAULT_WEIGHT if DEFAULT_WEIGHT in AVAILABLE_FAMILIES[family] else next(iter(AVAILABLE_FAMILIES[family]))
+    return family, weight
+
+# تابع ساخت تنظیمات فونت برای ذخیره در فایل تنظیمات
+def font_settings(choice):
+    family, weight = choice
+    return {
+        "font_family": family,
+        "font_weight": weight,
+        "is_bold": weight in BOLD_WEIGHTS
+    }
+
+# محتوای فایل فونت فقط یک بار از دیسک خوانده می‌شود
+@lru_cache(maxsize=None)
+def _font_bytes(family, weight):
+    with open(font_path(family, weight), 'rb') as file:
+        return file.read()
+
+# شیء فونت برای هر (خانواده، وزن، سایز، موتور چیدمان) یک بار ساخته و بین همه نشست‌ها مشترک است
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+@timed("font.load")
+def get_font(family, weight, size, layout=LAYOUT_BASIC):
+    return ImageFont.truetype(io.BytesIO(_font_bytes(family, weight)), size, layout_engine=LAYOUT_ENGINES[layout])
+
+# تابع بارگذاری اولیه فونت‌ها هنگام شروع برنامه
+def preload_fonts(sizes=()):
+    """
+    محتوای همه فونت‌ها را در حافظه بارگذاری می‌کند
+    و در صورت نیاز شیء فونت سایزهای داده شده را از قبل می‌سازد
+    """
+    with _preload_lock:
+        for family, weight in font_choices():
+            _font_bytes(family, weight)
+            for size in sizes:
+                get_font(family, weight, size)
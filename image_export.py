@@ -0,0 +1,56 @@
+import io
+import os
+from timing import timed
+
+# فرمت‌های خروجی قابل انتخاب
+EXPORT_FORMATS = {
+    "PNG": {"extension": "png", "mime": "image/png", "label": "PNG (بدون افت کیفیت)"},
+    "JPEG": {"extension": "jpg", "mime": "image/jpeg", "label": "JPEG (حجم کم، بدون شفافیت)"},
+    "WEBP": {"extension": "webp", "mime": "image/webp", "label": "WebP (حجم کم با شفافیت)"}
+}
+
+DEFAULT_EXPORT_OPTIONS = {
+    "format": "PNG",
+    "quality": 90,  # برای JPEG و WebP
+    "compress_level": 6  # برای PNG (0 سریع‌ترین، 9 کم‌حجم‌ترین)
+}
+
+# تابع تبدیل تصویر به بایت‌های فایل خروجی در حافظه
+@timed("export.encode")
+def encode_image(image, options=None):
+    """
+    تصویر را فقط یک بار در حافظه encode می‌کند و هیچ فایلی روی دیسک نمی‌نویسد
+    خروجی: (بایت‌ها، نوع mime، پسوند فایل)
+    """
+    options = {**DEFAULT_EXPORT_OPTIONS, **(options or {})}
+    image_format = options["format"].upper()
+    if image_format not in EXPORT_FORMATS:
+        raise ValueError(f"فرمت خروجی پشتیبانی نمی‌شود: {options['format']}")
+
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format="PNG", compress_level=int(options["compress_level"]))
+    elif image_format == "JPEG":
+        # JPEG کانال شفافیت ندارد
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(buffer, format="JPEG", quality=int(options["quality"]), optimize=True, progressive=True)
+    else:
+        image.save(buffer, format="WEBP", quality=int(options["quality"]), method=4)
+
+    export_format = EXPORT_FORMATS[image_format]
+    return buffer.getvalue(), export_format["mime"], export_format["extension"]
+
+# تابع تشخیص فرمت خروجی از پسوند نام فایل
+def format_from_name(file_name, default="PNG"):
+    extension = os.path.splitext(file_name)[1].lower().lstrip(".")
+    if extension == "jpeg":
+        extension = "jpg"
+    for image_format, export_format in EXPORT_FORMATS.items():
+        if export_format["extension"] == extension:
+            return image_format
+    return default
+
+# تابع جایگزینی پسوند نام فایل با پسوند فرمت خروجی
+def output_file_name(file_name, image_format):
+    return f"{os.path.splitext(file_name)[0]}.{EXPORT_FORMATS[image_format.upper()]['extension']}"
@@ -0,0 +1,187 @@
+import os
+import io
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from render_engine import Layer, render_image
+from image_export import encode_image
+from batch import render_batch_zip
+from timing import start_timeline, finish_timeline
+
+# تعداد رندرهای همزمان پس‌زمینه در کل پروسه (بقیه در صف می‌مانند)
+RENDER_JOB_WORKERS = int(os.environ.get("RENDER_JOB_WORKERS", "2"))
+
+# نتیجه‌هایی که بعد از این مدت (ثانیه) دانلود نشده‌اند حذف می‌شوند تا حافظه آزاد شود
+RENDER_JOB_TTL_SECONDS = int(os.environ.get("RENDER_JOB_TTL_SECONDS", "3600"))
+
+# وضعیت‌های یک کار
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: "در صف",
+    JOB_RUNNING: "در حال ساخت",
+    JOB_DONE: "آماده دانلود",
+    JOB_FAILED: "ناموفق"
+}
+
+# کلاس یک کار رندر پس‌زمینه
+class RenderJob:
+    def __init__(self, owner, label):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.label = label
+        self.status = JOB_QUEUED
+        self.done = 0
+        self.total = 1
+        self.data = None
+        self.mime = None
+        self.file_name = None
+        self.errors = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in (JOB_QUEUED, JOB_RUNNING)
+
+    def progress(self):
+        return self.done / self.total if self.total else 0.0
+
+# تابع ساخت نسخه جدای یک لایه (همان تصویر، با کش sprite مستقل از لایه صفحه)
+def detach_layer(layer):
+    copy = Layer(layer.name, layer.image)
+    copy.x_percent = layer.x_percent
+    copy.y_percent = layer.y_percent
+    copy.size_percent = layer.size_percent
+    copy.opacity = layer.opacity
+    copy.visible = layer.visible
+    copy.image_key = layer.image_key
+    return copy
+
+# تابع جدا کردن مشخصات رندر از وضعیت صفحه
+def snapshot_spec(spec, layer_copies=None):
+    """
+    لایه‌ها به نسخه جدا و فایل آپلود شده به بایت تبدیل می‌شوند تا ویرایش
+    صفحه در حین رندر روی کار پس‌زمینه اثری نداشته باشد
+    (تصاویر لایه‌ها فقط خوانده می‌شوند و کپی نمی‌شوند)
+    با layer_copies هر لایه فقط یک بار کپی می‌شود و همه مشخصات یک دسته
+    همان نسخه را مشترک دارند تا resize لایه بین ردیف‌ها تکرار نشود
+    """
+    if layer_copies is None:
+        layer_copies = {}
+    spec = dict(spec)
+    template = spec["template"]
+    if hasattr(template, "getvalue"):
+        spec["template"] = io.BytesIO(template.getvalue())
+    layers = []
+    for layer in spec.get("layers") or []:
+        if isinstance(layer, Layer):
+            if id(layer) not in layer_copies:
+                # خود لایه هم نگه داشته می‌شود تا id آن تا پایان کار تکراری نشود
+                layer_copies[id(layer)] = (layer, detach_layer(layer))
+            layers.append(layer_copies[id(layer)][1])
+        else:
+            layers.append(dict(layer))
+    spec["layers"] = layers
+    spec["settings"] = {section: dict(values) for section, values in (spec.get("settings") or {}).items()}
+    return spec
+
+# کلاس مدیریت کارهای رندر پس‌زمینه (یک نمونه برای کل پروسه)
+class JobManager:
+    """
+    کارها در یک ThreadPoolExecutor داخل همین پروسه اجرا می‌شوند و
+    thread اسکریپت Streamlit فقط وضعیت آنها را می‌خواند. نتیجه هر کار
+    تا دانلود (discard) یا گذشتن RENDER_JOB_TTL_SECONDS نگه داشته می‌شود.
+    """
+
+    def __init__(self, workers=RENDER_JOB_WORKERS, ttl_seconds=RENDER_JOB_TTL_SECONDS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl_seconds = ttl_seconds
+
+    def submit_image(self, owner, label, spec):
+        """
+        ساخت یک تصویر با اندازه اصلی
+        """
+        spec = snapshot_spec(spec)
+
+        def run(job):
+            # خطای یک لایه، عنوان یا متن فقط همان بخش را رد می‌کند و به عنوان هشدار کار نمایش داده می‌شود
+            image_data, mime, extension = encode_image(render_image(spec, errors=job.errors), spec.get("export"))
+            job.data, job.mime, job.file_name = image_data, mime, f"output.{extension}"
+
+        return self._submit(owner, label, run)
+
+    def submit_batch(self, owner, label, specs, workers=1):
+        """
+        ساخت دسته‌ای و قرار دادن نتیجه در یک فایل ZIP
+        """
+        layer_copies = {}
+        specs = [snapshot_spec(spec, layer_copies) for spec in specs]
+
+        def run(job):
+            job.total = len(specs)
+
+            def progress(done, total):
+                job.done, job.total = done, total
+
+            zip_data, errors = render_batch_zip(specs, progress, workers=workers)
+            job.data, job.mime, job.file_name, job.errors = zip_data, "application/zip", "images.zip", errors
+
+        return self._submit(owner, label, run)
+
+    def jobs(self, owner):
+        """
+        کارهای یک کاربر به ترتیب زمان ثبت
+        """
+        self._expire()
+        with self._lock:
+            return sorted((job for job in self._jobs.values() if job.owner == owner), key=lambda job: job.created)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _submit(self, owner, label, run):
+        job = RenderJob(owner, label)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job, run):
+        job.status = JOB_RUNNING
+        timeline = start_timeline("job")
+        try:
+            run(job)
+            job.done = job.total
+            job.status = JOB_DONE
+        except Exception as e:
+            print(f"خطا در کار رندر پس‌زمینه: {str(e)}")
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            job.finished = time.time()
+            finish_timeline(timeline, label=job.label, status=job.status)
+
+    def _expire(self):
+        limit = time.time() - self.ttl_seconds
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < limit]:
+                del self._jobs[job_id]
+
+_manager = None
+_manager_lock = threading.Lock()
+
+# تابع دریافت مدیر کارهای مشترک پروسه
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
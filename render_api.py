@@ -0,0 +1,329 @@
+import os
+import io
+import sys
+import json
+import base64
+import argparse
+import math
+import binascii
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import tornado.web
+import tornado.escape
+import tornado.ioloop
+from PIL import Image, ImageColor
+from render_engine import render_image, merge_settings
+from image_export import EXPORT_FORMATS, DEFAULT_EXPORT_OPTIONS, encode_image, output_file_name
+from settings_store import get_store
+from template_library import TEMPLATE_EXTENSIONS, settings_key
+from timing import start_timeline, finish_timeline
+
+# پوشه تمپلیت‌ها (همان پوشه‌ای که برنامه Streamlit تمپلیت‌های آپلود شده را در آن ذخیره می‌کند)
+TEMPLATES_DIR = os.environ.get("TEMPLATES_DIR", os.path.join("/tmp", "templates"))
+
+# پورت پیش‌فرض سرویس
+RENDER_API_PORT = int(os.environ.get("RENDER_API_PORT", "8502"))
+
+# تعداد پردازش‌های رندر
+RENDER_API_WORKERS = int(os.environ.get("RENDER_API_WORKERS", str(os.cpu_count() or 1)))
+
+# حداکثر تعداد درخواست در حال رندر یا در صف؛ درخواست‌های بیشتر پاسخ 503 می‌گیرند
+RENDER_API_MAX_PENDING = int(os.environ.get("RENDER_API_MAX_PENDING", str(RENDER_API_WORKERS * 8)))
+
+# حداکثر حجم بدنه درخواست (شامل تصاویر لایه‌ها)
+RENDER_API_MAX_BODY_BYTES = int(os.environ.get("RENDER_API_MAX_BODY_BYTES", str(20 * 1024 * 1024)))
+
+# توکن اختیاری؛ اگر تنظیم شود هر درخواست باید هدر Authorization: Bearer <token> داشته باشد
+RENDER_API_TOKEN = os.environ.get("RENDER_API_TOKEN", "")
+
+# بخش‌های تنظیمات قابل تغییر در درخواست (همان ساختار تنظیمات تمپلیت)
+SETTINGS_SECTIONS = ("title", "text", "layer")
+
+# فیلدهای عددی قابل تغییر در درخواست: (صحیح بودن، کمترین، بیشترین)
+TEXT_NUMBER_FIELDS = {
+    "font_size_pixels": (True, 1, None),
+    "font_size_percent": (True, 1, None),
+    "text_x_percent": (False, None, None),
+    "text_y_percent": (False, None, None),
+    "max_text_width_percent": (False, 1, None),
+    "line_spacing_percent": (False, 1, None),
+    "max_text_height_percent": (False, 1, None)
+}
+LAYER_NUMBER_FIELDS = {
+    "x_percent": (False, None, None),
+    "y_percent": (False, None, None),
+    "size_percent": (False, 1, None),
+    "opacity": (False, 0, 100)
+}
+EXPORT_NUMBER_FIELDS = {
+    "quality": (True, 1, 100),
+    "compress_level": (True, 0, 9)
+}
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# تابع پیدا کردن فایل تمپلیت از روی نام (با یا بدون پسوند)
+def find_template(name, templates_dir=TEMPLATES_DIR):
+    # فقط نام فایل پذیرفته می‌شود تا مسیرهای خارج از پوشه تمپلیت‌ها قابل دسترسی نباشند
+    name = os.path.basename(str(name or "").strip())
+    if not name:
+        raise RequestError("نام تمپلیت داده نشده است")
+    candidates = [name] if os.path.splitext(name)[1].lower() in TEMPLATE_EXTENSIONS else []
+    candidates += [f"{name}{extension}" for extension in TEMPLATE_EXTENSIONS]
+    for candidate in candidates:
+        path = os.path.join(templates_dir, candidate)
+        if os.path.isfile(path):
+            return path
+    raise RequestError(f"تمپلیت پیدا نشد: {name}", status=404)
+
+# تابع خواندن درخواست JSON یا multipart
+def parse_request(request):
+    """
+    JSON: {"template", "title_text", "text", "settings": {"title", "text", "layer"},
+           "layers": [{"image": base64, "x_percent", ...}], "export": {"format", "quality", ...}}
+    multipart: همان فیلدها؛ settings، layers و export به صورت متن JSON
+    و تصاویر لایه‌ها به ترتیب به عنوان فایل‌های layer
+    خروجی: dict با مقادیر ساده که به پردازش رندر فرستاده می‌شود
+    """
+    content_type = request.headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            raise RequestError("بدنه JSON معتبر نیست")
+        if not isinstance(body, dict):
+            raise RequestError("بدنه JSON باید یک شیء باشد")
+        layers = []
+        for layer in body.get("layers") or []:
+            if not isinstance(layer, dict):
+                raise RequestError("هر لایه باید یک شیء باشد")
+            layer = dict(layer)
+            try:
+                layer["image"] = base64.b64decode(layer.get("image") or "", validate=True)
+            except (binascii.Error, ValueError):
+                raise RequestError("تصویر لایه باید base64 باشد")
+            layers.append(layer)
+        body["layers"] = layers
+        return body
+
+    # multipart/form-data یا application/x-www-form-urlencoded
+    def field(name, default=None):
+        values = request.body_arguments.get(name)
+        return values[0].decode("utf-8") if values else default
+
+    def json_field(name, default):
+        value = field(name)
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise RequestError(f"مقدار {name} باید JSON باشد")
+
+    files = request.files.get("layer", [])
+    layer_settings = json_field("layers", [])
+    layers = []
+    for index, file in enumerate(files):
+        layer = dict(layer_settings[index]) if index < len(layer_settings) and isinstance(layer_settings[index], dict) else {}
+        layer["image"] = file["body"]
+        layers.append(layer)
+    export = json_field("export", {})
+    if field("format"):
+        export["format"] = field("format")
+    return {
+        "template": field("template"),
+        "title_text": field("title_text", ""),
+        "text": field("text", ""),
+        "settings": json_field("settings", {}),
+        "layers": layers,
+        "export": export
+    }
+
+# تابع تبدیل و بررسی فیلدهای عددی یک بخش از درخواست (عدد یا متن عددی)
+def check_numbers(values, fields, section):
+    values = dict(values)
+    for name, (integer, minimum, maximum) in fields.items():
+        if name not in values:
+            continue
+        value = values[name]
+        try:
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise ValueError
+            number = float(value)
+            if not math.isfinite(number):
+                raise ValueError
+        except ValueError:
+            raise RequestError(f"مقدار {section}.{name} باید عدد باشد")
+        if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+            raise RequestError(f"مقدار {section}.{name} خارج از بازه مجاز است")
+        values[name] = int(number) if integer else (value if isinstance(value, (int, float)) else number)
+    return values
+
+# تابع بررسی تنظیمات عنوان، متن و لایه درخواست
+def check_settings(overrides):
+    if not isinstance(overrides, dict) or not all(isinstance(overrides.get(section) or {}, dict) for section in SETTINGS_SECTIONS):
+        raise RequestError("settings و بخش‌های آن باید شیء باشند")
+    checked = {}
+    for section in SETTINGS_SECTIONS:
+        values = overrides.get(section) or {}
+        if section == "layer":
+            checked[section] = check_numbers(values, LAYER_NUMBER_FIELDS, f"settings.{section}")
+            continue
+        values = check_numbers(values, TEXT_NUMBER_FIELDS, f"settings.{section}")
+        if "text_color" in values:
+            try:
+                ImageColor.getrgb(values["text_color"])
+            except (ValueError, AttributeError, TypeError):
+                raise RequestError(f"رنگ settings.{section}.text_color معتبر نیست")
+        checked[section] = values
+    return checked
+
+# تابع بررسی تصویر و تنظیمات لایه‌های درخواست
+def check_layers(layers):
+    checked = []
+    for index, layer in enumerate(layers):
+        if not layer.get("image"):
+            continue
+        layer = check_numbers(layer, LAYER_NUMBER_FIELDS, f"layers[{index}]")
+        try:
+            # verify فقط ساختار فایل را بررسی می‌کند و تصویر را decode نمی‌کند
+            Image.open(io.BytesIO(layer["image"])).verify()
+        except Exception:
+            raise RequestError(f"تصویر لایه {index} قابل خواندن نیست")
+        checked.append(layer)
+    return checked
+
+# تابع ساخت مشخصات رندر: تنظیمات پیش‌فرض تمپلیت با تغییرات درخواست
+def build_job(body, store, templates_dir=TEMPLATES_DIR):
+    """
+    ورودی نامعتبر همین‌جا با RequestError (400) رد می‌شود تا فقط
+    خطاهای واقعی رندر در پردازش رندر به 500 برسند
+    """
+    template_path = find_template(body.get("template"), templates_dir)
+    defaults = store.get_settings(settings_key(os.path.basename(template_path))) or {}
+    overrides = check_settings(body.get("settings") or {})
+    settings = {
+        section: merge_settings(defaults.get(section) or {}, overrides.get(section))
+        for section in SETTINGS_SECTIONS
+    }
+
+    export = body.get("export") or {}
+    if not isinstance(export, dict):
+        raise RequestError("export باید شیء باشد")
+    export = check_numbers({**DEFAULT_EXPORT_OPTIONS, **export}, EXPORT_NUMBER_FIELDS, "export")
+    export["format"] = str(export["format"]).upper()
+    if export["format"] not in EXPORT_FORMATS:
+        raise RequestError(f"فرمت خروجی پشتیبانی نمی‌شود: {export['format']}")
+
+    return {
+        "template": template_path,
+        "title_text": str(body.get("title_text") or ""),
+        "text": str(body.get("text") or ""),
+        "settings": settings,
+        "layers": check_layers(body.get("layers") or []),
+        "strategy": body.get("strategy", "auto"),
+        "export": export
+    }
+
+# تابع رندر یک درخواست (در پردازش رندر اجرا می‌شود)
+def render_job(job):
+    """
+    خروجی: (بایت‌های تصویر، نوع MIME، پسوند)
+    """
+    timeline = start_timeline("api")
+    try:
+        spec = dict(job)
+        spec["layers"] = [{**layer, "image": io.BytesIO(layer["image"])} for layer in job["layers"]]
+        return encode_image(render_image(spec), job["export"])
+    finally:
+        finish_timeline(timeline, template=os.path.basename(job["template"]))
+
+class BaseHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        if RENDER_API_TOKEN and self.request.headers.get("Authorization") != f"Bearer {RENDER_API_TOKEN}":
+            self.send_error_json("توکن دسترسی نامعتبر است", 401)
+
+    def send_error_json(self, message, status):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps({"error": message}, ensure_ascii=False))
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.write({"status": "ok", "pending": self.application.pending, "workers": self.application.workers})
+
+class TemplatesHandler(BaseHandler):
+    def get(self):
+        names = sorted(
+            name for name in os.listdir(self.application.templates_dir)
+            if os.path.splitext(name)[1].lower() in TEMPLATE_EXTENSIONS
+        ) if os.path.isdir(self.application.templates_dir) else []
+        self.write({"templates": names})
+
+class RenderHandler(BaseHandler):
+    async def post(self):
+        application = self.application
+        if application.pending >= application.max_pending:
+            self.send_error_json("سرویس مشغول است؛ کمی بعد دوباره تلاش کنید", 503)
+            return
+        try:
+            job = build_job(parse_request(self.request), application.store, application.templates_dir)
+        except RequestError as e:
+            self.send_error_json(str(e), e.status)
+            return
+
+        application.pending += 1
+        try:
+            # رندر در پردازش جدا انجام می‌شود و event loop برای درخواست‌های دیگر آزاد می‌ماند
+            image_data, mime, extension = await tornado.ioloop.IOLoop.current().run_in_executor(
+                application.executor, render_job, job
+            )
+        except Exception as e:
+            print(f"خطا در رندر درخواست API: {str(e)}")
+            self.send_error_json(f"خطا در رندر: {str(e)}", 500)
+            return
+        finally:
+            application.pending -= 1
+
+        file_name = output_file_name(settings_key(os.path.basename(job["template"])), job["export"]["format"])
+        self.set_header("Content-Type", mime)
+        self.set_header("Content-Disposition", f"inline; filename*=UTF-8''{tornado.escape.url_escape(file_name, plus=False)}")
+        self.finish(image_data)
+
+class RenderApplication(tornado.web.Application):
+    def __init__(self, executor, store, workers, templates_dir=TEMPLATES_DIR, max_pending=RENDER_API_MAX_PENDING):
+        self.executor = executor
+        self.store = store
+        self.workers = workers
+        self.templates_dir = templates_dir
+        self.max_pending = max_pending
+        self.pending = 0
+        super().__init__([
+            (r"/health", HealthHandler),
+            (r"/templates", TemplatesHandler),
+            (r"/render", RenderHandler)
+        ])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="سرویس HTTP ساخت تصویر از تمپلیت‌ها")
+    parser.add_argument("--port", type=int, default=RENDER_API_PORT, help="پورت سرویس")
+    parser.add_argument("--workers", type=int, default=RENDER_API_WORKERS, help="تعداد پردازش‌های رندر")
+    parser.add_argument("--templates-dir", default=TEMPLATES_DIR, help="پوشه تمپلیت‌ها")
+    args = parser.parse_args(argv)
+
+    # از spawn استفاده می‌شود تا پردازش‌ها اتصال دیتابیس و event loop را به ارث نبرند
+    executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"))
+    application = RenderApplication(executor, get_store(), args.workers, args.templates_dir)
+    application.listen(args.port, max_body_size=RENDER_API_MAX_BODY_BYTES)
+    print(f"سرویس رندر روی پورت {args.port} با {args.workers} پردازش اجرا شد")
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,785 @@
+import os
+import sys
+import json
+import argparse
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageChops, ImageStat
+import arabic_reshaper
+from font_registry import get_font, resolve_font, RAQM_AVAILABLE, LAYOUT_RAQM, LAYOUT_BASIC
+from template_cache import get_template, get_scaled_template
+from text_sprites import text_sprite_cache
+from timing import span, timed
+from image_export import EXPORT_FORMATS, DEFAULT_EXPORT_OPTIONS, encode_image, format_from_name, output_file_name
+from settings_store import get_store
+
+# تنظیمات پیش‌فرض عنوان، متن و لایه (همان ساختار فایل تنظیمات تمپلیت)
+DEFAULT_TITLE_SETTINGS = {
+    "font_size_pixels": 60,
+    "text_color": "#000000",
+    "is_bold": True,
+    "text_x_percent": 50,
+    "text_y_percent": 10,
+    "max_text_width_percent": 80,
+    "line_spacing_percent": 120,
+    "auto_fit": False,
+    "max_text_height_percent": 15
+}
+
+DEFAULT_TEXT_SETTINGS = {
+    "font_size_pixels": 40,
+    "text_color": "#000000",
+    "is_bold": False,
+    "text_x_percent": 50,
+    "text_y_percent": 98,
+    "max_text_width_percent": 80,
+    "line_spacing_percent": 120,
+    "auto_fit": False,
+    "max_text_height_percent": 30
+}
+
+DEFAULT_LAYER_SETTINGS = {
+    "x_percent": 50,
+    "y_percent": 0,
+    "size_percent": 100,
+    "opacity": 100,
+    "visible": True
+}
+
+# عرض تصویر پیش‌نمایش (دو برابر عرض نمایش 300 پیکسلی برای صفحه‌های با تراکم بالا)
+PREVIEW_WIDTH = 600
+
+# حداکثر میانگین اختلاف مجاز (از 255) بین پیش‌نمایش و نسخه کوچک شده خروجی نهایی
+PREVIEW_TOLERANCE = 6.0
+
+# کوچکترین سایز فونت در حالت تنظیم خودکار اندازه
+MIN_FIT_FONT_SIZE = 4
+
+# حداکثر تعداد اندازه‌گیری‌های کلمه و نتیجه‌های تنظیم خودکار که در حافظه نگه داشته می‌شوند
+FIT_CACHE_SIZE = int(os.environ.get("FIT_CACHE_SIZE", "8192"))
+
+# تابع کمکی برای شکستن متن به چند خط
+def wrap_text_to_lines(draw, text, font, max_width):
+    """
+    متن را فقط بر اساس خطوط جدید (اینتر) جدا می‌کند
+    و هیچ شکستن خط خودکاری انجام نمی‌دهد
+    """
+    # فقط متن را بر اساس خطوط جدید (اینتر) جدا می‌کنیم
+    return text.split('\n')
+
+# تنظیمات reshaper (همان تنظیمات پیش‌فرض arabic_reshaper)
+RESHAPER_CONFIGURATION = {
+    "language": "Arabic",
+    "support_ligatures": True,
+    "delete_harakat": True
+}
+
+# حداکثر تعداد متن‌های پردازش شده که در حافظه نگه داشته می‌شوند
+SHAPING_CACHE_SIZE = int(os.environ.get("SHAPING_CACHE_SIZE", "1024"))
+
+# حروف فارسی/عربی برای تشخیص متن فارسی
+PERSIAN_CHARS = frozenset('آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی')
+
+# یک نمونه reshaper برای کل پروسه که فقط یک بار تنظیم می‌شود
+_reshaper = arabic_reshaper.ArabicReshaper(configuration={key: str(value) for key, value in RESHAPER_CONFIGURATION.items()})
+_reshaper_key = tuple(sorted(RESHAPER_CONFIGURATION.items()))
+
+# تابع معکوس کردن هر خط به صورت character-level
+def _reverse_lines(text):
+    return '\n'.join(line[::-1] for line in text.split('\n'))
+
+# تابع پردازش متن فارسی با مدیریت خطا برای سرور
+def process_persian_text(text, strategy="auto"):
+    """
+    پردازش متن فارسی با مدیریت خطا برای سرورها
+    استراتژی‌های مختلف fallback برای نمایش صحیح متن
+    نتیجه بر اساس (متن، استراتژی، تنظیمات reshaper) بین همه نشست‌ها کش می‌شود
+    """
+    if not text:
+        return ""
+
+    # اگر کاربر "متن اصلی" را انتخاب کرده، بدون تغییر برگردان
+    if strategy == "original":
+        return text
+
+    return _shape_text(text, strategy, _reshaper_key)
+
+# نتیجه پردازش هر متن فقط یک بار محاسبه می‌شود (reshaper_key فقط بخشی از کلید کش است)
+@lru_cache(maxsize=SHAPING_CACHE_SIZE)
+@timed("text.shape")
+def _shape_text(text, strategy, reshaper_key):
+    # اگر کاربر "اجباری معکوس" را انتخاب کرده
+    if strategy == "force_reverse":
+        return _reverse_lines(text)
+
+    # حالت خودکار (auto) - استراتژی‌های پیشین
+    # استراتژی 1: فقط از arabic_reshaper استفاده کنیم (بدون bidi)
+    try:
+        reshaped_text = _reshaper.reshape(text)
+        # حذف get_display و استفاده مستقیم از reshaped_text
+        if reshaped_text and len(reshaped_text) >= len(text):
+            return reshaped_text
+    except Exception as e:
+        print(f"استراتژی 1 ناموفق: {str(e)}")
+
+    # استراتژی 2: پردازش دستی با تشخیص حروف فارسی
+    try:
+        if not PERSIAN_CHARS.isdisjoint(text):
+            # برای متن فارسی: معکوس کردن هر خط
+            return _reverse_lines(text)
+        # برای متن انگلیسی: بدون تغییر
+        return text
+    except Exception as e:
+        print(f"استراتژی 2 ناموفق: {str(e)}")
+
+    # استراتژی 3: معکوس کردن کلمات (fallback ساده)
+    try:
+        processed_lines = []
+        for line in text.split('\n'):
+            words = line.split()
+            if len(words) > 1:
+                # معکوس کردن ترتیب کلمات در هر خط
+                processed_lines.append(' '.join(words[::-1]))
+            else:
+                # اگر فقط یک کلمه است، کل خط را معکوس کن
+                processed_lines.append(line[::-1])
+        return '\n'.join(processed_lines)
+    except Exception as e:
+        print(f"استراتژی 3 ناموفق: {str(e)}")
+
+    # استراتژی 4: در نهایت متن اصلی (worst case)
+    print("همه استراتژی‌ها ناموفق، بازگشت به متن اصلی")
+    return text
+
+# طول هر کلمه در هر سایز فونت فقط یک بار اندازه‌گیری می‌شود
+@lru_cache(maxsize=FIT_CACHE_SIZE)
+def _word_length(word, font_key, direction):
+    return get_font(*font_key).getlength(word, direction=direction)
+
+# طول کلمه همان‌طور که رسم می‌شود (پس از پردازش با استراتژی)
+def _shaped_word_length(word, font_key, direction, strategy):
+    return _word_length(process_persian_text(word, strategy), font_key, direction)
+
+# تابع شکستن متن به خطوطی که از عرض داده شده بیشتر نشوند
+def wrap_words(text, font_key, direction, max_width, strategy="original"):
+    """
+    خطوط جدید (اینتر) حفظ می‌شوند و هر خط در مرز کلمه‌ها شکسته می‌شود.
+    متن باید به ترتیب منطقی (پردازش نشده) باشد تا ترتیب خطوط درست بماند؛
+    هر کلمه با strategy پردازش و سپس اندازه‌گیری می‌شود و خطوط خروجی
+    هنوز پردازش نشده‌اند.
+    طول خط از جمع طول کلمه‌ها و فاصله‌ها تخمین زده می‌شود تا برای هر
+    سایز فقط کلمه‌های یکتا اندازه‌گیری شوند.
+    خروجی: (خطوط، عرض بزرگترین کلمه)
+    """
+    space_length = _word_length(" ", font_key, direction)
+    lines = []
+    widest_word = 0
+    for paragraph in text.split('\n'):
+        line_words = []
+        line_length = 0
+        for word in paragraph.split():
+            word_length = _shaped_word_length(word, font_key, direction, strategy)
+            widest_word = max(widest_word, word_length)
+            if line_words and line_length + space_length + word_length > max_width:
+                lines.append(' '.join(line_words))
+                line_words = []
+                line_length = 0
+            line_length += (space_length if line_words else 0) + word_length
+            line_words.append(word)
+        lines.append(' '.join(line_words))
+    return lines, widest_word
+
+# تابع پیدا کردن بزرگترین سایز فونتی که متن در کادر جا شود
+@lru_cache(maxsize=FIT_CACHE_SIZE)
+def fit_font_size(text, family, weight, layout, direction, box_width, box_height, line_spacing_factor, start_size, strategy="original"):
+    """
+    سایز با جستجوی دودویی پیدا می‌شود؛ نقطه شروع از یک اندازه‌گیری در
+    start_size و تناسب مساحت متن با مساحت کادر تخمین زده می‌شود،
+    پس برای هر متن فقط چند اندازه‌گیری لازم است
+    text به ترتیب منطقی است و کلمه‌ها با strategy پردازش می‌شوند (مانند wrap_words)
+    """
+    def fits(size):
+        lines, widest_word = wrap_words(text, (family, weight, size, layout), direction, box_width, strategy)
+        return widest_word <= box_width and int(size * line_spacing_factor) * len(lines) <= box_height
+
+    # سایزی که حتی یک خط هم از کادر بلندتر شود قابل قبول نیست
+    upper = max(MIN_FIT_FONT_SIZE, int(box_height / line_spacing_factor))
+
+    # تخمین اولیه: مساحت متن با مجذور سایز فونت رشد می‌کند
+    start_size = min(max(start_size, MIN_FIT_FONT_SIZE), upper)
+    font_key = (family, weight, start_size, layout)
+    words = text.split()
+    text_length = sum(_shaped_word_length(word, font_key, direction, strategy) for word in words)
+    text_length += _word_length(" ", font_key, direction) * max(len(words) - 1, 0)
+    text_area = text_length * start_size * line_spacing_factor
+    estimate = start_size
+    if text_area > 0:
+        estimate = int(start_size * (box_width * box_height / text_area) ** 0.5)
+    estimate = min(max(estimate, MIN_FIT_FONT_SIZE), upper)
+
+    # پیدا کردن بازه‌ای که جواب در آن است با دو برابر یا نصف کردن تخمین
+    if fits(estimate):
+        low, high = estimate, min(estimate * 2, upper + 1)
+        while high <= upper and fits(high):
+            low, high = high, min(high * 2, upper + 1)
+    else:
+        low, high = max(estimate // 2, MIN_FIT_FONT_SIZE), estimate
+        while not fits(low):
+            if low == MIN_FIT_FONT_SIZE:
+                return MIN_FIT_FONT_SIZE
+            low, high = max(low // 2, MIN_FIT_FONT_SIZE), low
+
+    # جستجوی دودویی: low همیشه جا می‌شود و high جا نمی‌شود
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+# تابع انتخاب مسیر چیدمان متن
+def layout_text(text, strategy="auto", layout=None):
+    """
+    در حالت خودکار، اگر Pillow با RAQM ساخته شده باشد متن بدون تغییر
+    به RAQM داده می‌شود تا شکل‌دهی و ترتیب راست به چپ را در یک مرحله انجام دهد؛
+    در غیر این صورت (و برای بقیه استراتژی‌ها) متن با reshaper پردازش می‌شود
+    خروجی: (متن آماده رسم، موتور چیدمان، جهت متن)
+    """
+    if layout is None:
+        layout = LAYOUT_RAQM if RAQM_AVAILABLE and strategy == "auto" else LAYOUT_BASIC
+    if layout == LAYOUT_RAQM:
+        direction = "rtl" if not PERSIAN_CHARS.isdisjoint(text) else None
+        return text, LAYOUT_RAQM, direction
+    return process_persian_text(text, strategy), LAYOUT_BASIC, None
+
+# تابع بررسی وضعیت کتابخانه‌های RTL
+def check_rtl_libraries():
+    """
+    بررسی وضعیت کتابخانه‌های پردازش متن راست به چپ
+    """
+    try:
+        # تست کتابخانه‌ها با متن نمونه
+        test_text = "تست متن فارسی"
+        reshaped = _reshaper.reshape(test_text)
+        # حذف get_display از تست
+        if reshaped and len(reshaped) > 0:
+            if RAQM_AVAILABLE:
+                return True, "کتابخانه arabic_reshaper به درستی کار می‌کند (چیدمان RAQM فعال است)"
+            return True, "کتابخانه arabic_reshaper به درستی کار می‌کند"
+        else:
+            return False, "مشکل در خروجی arabic_reshaper"
+    except ImportError as e:
+        return False, f"کتابخانه‌های RTL نصب نیستند: {str(e)}"
+    except Exception as e:
+        return False, f"خطا در کتابخانه‌های RTL: {str(e)}"
+
+# تابع باز کردن تصویر از مسیر، فایل آپلود شده یا شیء Image
+def load_image(source):
+    if isinstance(source, Image.Image):
+        return source
+    return Image.open(source)
+
+# تابع دریافت تمپلیت به صورت RGBA
+def load_template(source):
+    """
+    مسیرها از کش مشترک تمپلیت‌ها خوانده می‌شوند
+    و تصاویر آماده فقط در صورت نیاز به RGBA تبدیل می‌شوند
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return get_template(source)
+    template = load_image(source)
+    if template.mode != 'RGBA':
+        template = template.convert('RGBA')
+    return template
+
+# تابع دریافت نسخه کوچک شده تمپلیت برای پیش‌نمایش
+def load_proxy_template(source, template, preview_width):
+    """
+    اگر تمپلیت از عرض پیش‌نمایش بزرگتر باشد، نسخه کوچک شده آن
+    (برای مسیرها از کش مشترک) برگردانده می‌شود
+    """
+    if not preview_width or template.width <= preview_width:
+        return template
+    proxy_size = (preview_width, max(1, round(template.height * preview_width / template.width)))
+    if isinstance(source, (str, os.PathLike)):
+        return get_scaled_template(source, proxy_size)
+    return template.resize(proxy_size, Image.LANCZOS)
+
+# تابع تغییر مقیاس تنظیمات متن برای پیش‌نمایش
+def scale_text_settings(settings, scale):
+    if scale == 1:
+        return settings
+    settings = dict(settings)
+    settings["font_size_pixels"] = max(1, round(settings["font_size_pixels"] * scale))
+    return settings
+
+# تابع ادغام تنظیمات یک بخش با مقادیر پیش‌فرض
+def merge_settings(defaults, overrides):
+    """
+    تنظیمات ورودی را روی مقادیر پیش‌فرض اعمال می‌کند
+    کلید قدیمی font_size_percent هم پشتیبانی می‌شود
+    """
+    settings = dict(defaults)
+    if overrides:
+        settings.update(overrides)
+        # پشتیبانی از هر دو فرمت قدیم و جدید
+        if "font_size_pixels" not in overrides and "font_size_percent" in overrides:
+            settings["font_size_pixels"] = overrides["font_size_percent"]
+    return settings
+
+# تابع محاسبه ابعاد لایه بر اساس درصد کوچکترین بعد تمپلیت
+def layer_target_size(image_size, min_dimension, size_percent):
+    max_dimension = int(min_dimension * (size_percent / 100))
+
+    # تغییر سایز تصویر لایه با حفظ نسبت تصویر
+    original_width, original_height = image_size
+    aspect_ratio = original_width / original_height
+
+    if aspect_ratio >= 1:  # عرض بزرگتر یا مساوی ارتفاع است
+        new_width = max_dimension
+        new_height = int(max_dimension / aspect_ratio)
+    else:  # ارتفاع بزرگتر از عرض است
+        new_height = max_dimension
+        new_width = int(max_dimension * aspect_ratio)
+    return new_width, new_height
+
+# تابع ساخت تصویر آماده لایه (تغییر اندازه، RGBA و شفافیت)
+@timed("layer.resize")
+def make_layer_sprite(source_image, size, opacity):
+    layer_image = source_image.resize(size, Image.LANCZOS)
+
+    # تبدیل به RGBA اگر PNG است
+    if layer_image.mode != 'RGBA':
+        layer_image = layer_image.convert('RGBA')
+
+    # اعمال شفافیت
+    if opacity < 100:
+        layer_image.putalpha(int(255 * opacity / 100))
+    return layer_image
+
+# کلاس برای مدیریت لایه‌ها
+class Layer:
+    # حداکثر تعداد تصویر آماده که برای هر لایه نگه داشته می‌شود
+    # (مثلاً یکی برای پیش‌نمایش و یکی برای اندازه اصلی)
+    MAX_SPRITES = 4
+
+    def __init__(self, name, image=None):
+        self.name = name
+        self.image = image
+        self.x_percent = 50
+        self.y_percent = 0
+        self.size_percent = 100
+        self.opacity = 100
+        self.visible = True
+        self.image_key = None  # کلید یکتا برای هر تصویر
+        self._sprite_source = None
+        self._sprites = OrderedDict()
+
+    def get_sprite(self, size, opacity):
+        """
+        تصویر لایه را با اندازه و شفافیت داده شده، آماده برای paste برمی‌گرداند.
+        نتیجه بر اساس (تصویر منبع، اندازه، شفافیت) نگه داشته می‌شود؛
+        تغییر موقعیت لایه فقط paste دوباره است و resize تکرار نمی‌شود.
+        """
+        # با عوض شدن تصویر منبع، نسخه‌های قبلی دیگر معتبر نیستند
+        if self._sprite_source is not self.image:
+            self._sprites.clear()
+            self._sprite_source = self.image
+
+        key = (tuple(size), opacity)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            sprite = make_layer_sprite(self.image, key[0], opacity)
+            self._sprites[key] = sprite
+            if len(self._sprites) > self.MAX_SPRITES:
+                self._sprites.popitem(last=False)
+        else:
+            self._sprites.move_to_end(key)
+        return sprite
+
+# تابع ساخت لایه از مشخصات ساده (dict)
+def layer_from_spec(layer_spec, layer_defaults=None):
+    settings = merge_settings(DEFAULT_LAYER_SETTINGS, layer_defaults)
+    settings.update(layer_spec)
+
+    image = settings.get("image")
+    layer = Layer(settings.get("name", ""), load_image(image) if image is not None else None)
+    layer.x_percent = settings["x_percent"]
+    layer.y_percent = settings["y_percent"]
+    layer.size_percent = settings["size_percent"]
+    layer.opacity = settings["opacity"]
+    layer.visible = settings["visible"]
+    return layer
+
+# تابع قرار دادن لایه‌ها روی زمینه
+def compose_layers(base_image, layers, layer_defaults=None, errors=None):
+    """
+    لایه‌ها می‌توانند شیء Layer یا dict باشند
+    با errors (لیست) خطای هر لایه به لیست اضافه و فقط همان لایه رد می‌شود
+    """
+    template_width, template_height = base_image.size
+    min_dimension = min(template_width, template_height)
+
+    for layer in layers:
+        try:
+            if not isinstance(layer, Layer):
+                layer = layer_from_spec(layer, layer_defaults)
+            if not layer.visible or layer.image is None:
+                continue
+
+            new_width, new_height = layer_target_size(layer.image.size, min_dimension, layer.size_percent)
+            layer_image = layer.get_sprite((new_width, new_height), layer.opacity)
+
+            # محاسبه موقعیت تصویر
+            img_x = int((template_width - new_width) * (layer.x_percent / 100))
+            img_y = int((template_height - new_height) * (layer.y_percent / 100))
+
+            base_image.paste(layer_image, (img_x, img_y), layer_image)
+        except Exception as e:
+            if errors is None:
+                raise
+            layer_name = layer.name if isinstance(layer, Layer) else layer.get("name", "")
+            errors.append(f"خطا در پردازش لایه {layer_name}: {str(e)}")
+    return base_image
+
+# تابع اندازه‌گیری و رسم یک خط متن (از کش مشترک خطوط)
+def _line_sprite(line, font, font_key, color, direction):
+    """
+    طول، کادر و sprite رسم شده خط را برمی‌گرداند؛ sprite دقیقاً به اندازه
+    کادر خط است و برای خط بدون پیکسل None است
+    """
+    @timed("text.rasterize")
+    def build():
+        left, top, right, bottom = font.getbbox(line, direction=direction)
+        sprite = None
+        if right > left and bottom > top:
+            sprite = Image.new('RGBA', (right - left, bottom - top), (255, 255, 255, 0))
+            ImageDraw.Draw(sprite).text((-left, -top), line, font=font, fill=color, direction=direction)
+        return {
+            "length": font.getlength(line, direction=direction),
+            "bbox": (left, top, right, bottom),
+            "sprite": sprite
+        }
+    return text_sprite_cache.get((line, font_key, color, direction), build)
+
+# تابع رسم یک بلوک متن (عنوان یا متن اصلی) روی تصویر
+def draw_text_block(image, text, settings, strategy="auto", in_place=False, layout=None):
+    """
+    متن را با تنظیمات داده شده پردازش و روی تصویر قرار می‌دهد
+    و تصویر جدید را برمی‌گرداند؛ با in_place خود تصویر ورودی تغییر می‌کند.
+    متن در یک بافر به اندازه کادر متن رسم می‌شود و فقط همان ناحیه
+    ترکیب می‌شود، نه کل صفحه.
+    layout موتور چیدمان را مشخص می‌کند (None یعنی انتخاب خودکار).
+    """
+    template_width, template_height = image.size
+    font_size = settings["font_size_pixels"]  # استفاده مستقیم از پیکسل
+
+    font_family, font_weight = resolve_font(settings)
+    max_width = template_width * (settings["max_text_width_percent"] / 100)
+    line_spacing_factor = settings["line_spacing_percent"] / 100
+
+    if settings.get("auto_fit"):
+        # در حالت تنظیم خودکار، متن در کادر عرض × ارتفاع شکسته و بزرگترین سایز ممکن انتخاب می‌شود
+        # شکستن روی متن منطقی انجام می‌شود و هر خط جداگانه پردازش می‌شود؛
+        # شکستن متن معکوس شده ترتیب خطوط را هم برعکس می‌کرد
+        _, layout, direction = layout_text(text, strategy, layout)
+        line_strategy = "original" if layout == LAYOUT_RAQM else strategy
+        max_height = template_height * (settings.get("max_text_height_percent", 100) / 100)
+        font_size = fit_font_size(text, font_family, font_weight, layout, direction,
+                                  int(max_width), int(max_height), line_spacing_factor, font_size, line_strategy)
+        font_key = (font_family, font_weight, font_size, layout)
+        font = get_font(*font_key)
+        lines, _ = wrap_words(text, font_key, direction, max_width, line_strategy)
+        lines = [process_persian_text(line, line_strategy) for line in lines]
+    else:
+        bidi_text, layout, direction = layout_text(text, strategy, layout)
+        font_key = (font_family, font_weight, font_size, layout)
+        font = get_font(*font_key)
+        lines = wrap_text_to_lines(None, bidi_text, font, max_width)
+
+    line_height = int(font_size * line_spacing_factor)
+    total_text_height = line_height * len(lines)
+
+    start_y = int((template_height - total_text_height) * (settings["text_y_percent"] / 100))
+
+    # محاسبه موقعیت هر خط و کادر کلی متن
+    placed_lines = []
+    box = None
+    overlapping = False
+    for i, line in enumerate(lines):
+        line_entry = _line_sprite(line, font, font_key, settings["text_color"], direction)
+        line_x = int((template_width - line_entry["length"]) * (settings["text_x_percent"] / 100))
+        line_y = start_y + i * line_height
+        if line_entry["sprite"] is None:
+            continue
+        left, top, right, bottom = line_entry["bbox"]
+        line_box = (line_x + left, line_y + top, line_x + right, line_y + bottom)
+        if placed_lines and line_box[1] < placed_lines[-1][3][3]:
+            overlapping = True
+        placed_lines.append((line_x, line_y, line, line_box, line_entry["sprite"]))
+        if box is None:
+            box = line_box
+        else:
+            box = (min(box[0], line_box[0]), min(box[1], line_box[1]), max(box[2], line_box[2]), max(box[3], line_box[3]))
+
+    # محدود کردن کادر به ابعاد تصویر
+    if box is not None:
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], template_width), min(box[3], template_height))
+    if box is None or box[2] <= box[0] or box[3] <= box[1]:
+        return image
+
+    text_image = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]), (255, 255, 255, 0))
+    if overlapping:
+        # خطوطی که روی هم می‌افتند باید روی هم رسم شوند، نه جایگزین هم
+        text_draw = ImageDraw.Draw(text_image)
+        for line_x, line_y, line, _, _ in placed_lines:
+            text_draw.text((line_x - box[0], line_y - box[1]), line, font=font, fill=settings["text_color"], direction=direction)
+    else:
+        # sprite های آماده فقط در جای جدید قرار می‌گیرند
+        for _, _, _, line_box, sprite in placed_lines:
+            text_image.paste(sprite, (line_box[0] - box[0], line_box[1] - box[1]))
+
+    with span("text.composite"):
+        result = image if in_place else image.copy()
+        result.alpha_composite(text_image, dest=(box[0], box[1]))
+    return result
+
+# کلاس نگهداری نتایج میانی رندر برای ساخت تدریجی
+class RenderCache:
+    """
+    نتیجه هر مرحله رندر (لایه‌ها، تمپلیت، عنوان، متن) همراه با اثر انگشت
+    ورودی‌هایش نگه داشته می‌شود. اثر انگشت هر مرحله شامل اثر انگشت مرحله قبل
+    است، پس با هر تغییر فقط همان مرحله و مراحل بعد از آن دوباره ساخته می‌شوند.
+    تصاویر ورودی که با id در اثر انگشت آمده‌اند در refs نگه داشته می‌شوند
+    تا id آنها تا زمان وجود نتیجه به شیء دیگری نرسد.
+    هر نشست باید نمونه جداگانه خودش را داشته باشد.
+    """
+
+    def __init__(self):
+        self._stages = {}
+
+    def stage(self, name, fingerprint, build, refs=()):
+        """
+        خروجی: (تصویر، خطاهای جزئی همان مرحله)؛ خطاها همراه تصویر نگه داشته
+        می‌شوند تا با استفاده از کش هم دوباره گزارش شوند
+        """
+        entry = self._stages.get(name)
+        if entry and entry["fingerprint"] == fingerprint:
+            return entry["image"], entry["errors"]
+        errors = []
+        image = build(errors)
+        self._stages[name] = {"fingerprint": fingerprint, "image": image, "refs": refs, "errors": errors}
+        return image, errors
+
+    def clear(self):
+        self._stages.clear()
+
+# تابع اجرای یک مرحله رندر، با یا بدون کش
+def _run_stage(cache, name, fingerprint, build, refs=(), errors=None):
+    """
+    build لیست خطاهای جزئی مرحله را می‌گیرد؛ این خطاها به errors اضافه می‌شوند
+    """
+    # زمان هر مرحله فقط وقتی ثبت می‌شود که واقعاً ساخته شود (نه از کش)
+    build = timed(f"render.{name[1]}")(build)
+    if cache is None:
+        stage_errors = []
+        image = build(stage_errors)
+    else:
+        image, stage_errors = cache.stage(name, fingerprint, build, refs)
+    if errors is not None:
+        errors.extend(stage_errors)
+    return image
+
+# تابع ساخت اثر انگشت تنظیمات یک بخش
+def _settings_fingerprint(settings):
+    return tuple(sorted(settings.items()))
+
+# تابع اصلی رندر: یک مشخصات ساده را به تصویر نهایی تبدیل می‌کند
+@timed("render")
+def render_image(spec, preview_width=None, cache=None, errors=None):
+    """
+    رندر تصویر نهایی از روی یک مشخصات ساده (dict)
+    ترتیب: زمینه سفید ← لایه‌ها ← تمپلیت ← عنوان ← متن
+
+    کلیدهای spec:
+    template: مسیر یا شیء Image تمپلیت
+    title_text, text: عنوان و متن
+    settings: تنظیمات با ساختار فایل تنظیمات تمپلیت (title, text, layer)
+    layers: لیست لایه‌ها؛ شیء Layer یا dict شامل image و تنظیمات اختیاری
+    strategy: روش پردازش متن فارسی (auto, force_reverse, original)
+
+    با preview_width تصویر در عرض کوچکتر رندر می‌شود و سایز فونت‌ها
+    به همان نسبت کوچک می‌شوند (اندازه لایه‌ها و موقعیت‌ها درصدی هستند)
+
+    با cache (شیء RenderCache) فقط مراحلی که ورودی‌شان تغییر کرده دوباره
+    ساخته می‌شوند؛ در این حالت تصویر برگشتی مشترک است و نباید تغییر داده شود
+
+    با errors (لیست) خطای یک لایه، عنوان یا متن فقط همان بخش را رد می‌کند و
+    پیام آن به لیست اضافه می‌شود تا بقیه تصویر همچنان ساخته شود
+    """
+    settings = spec.get("settings") or {}
+    strategy = spec.get("strategy", "auto")
+
+    template = load_template(spec["template"])
+    full_width = template.width
+    template = load_proxy_template(spec["template"], template, preview_width)
+    template_width, template_height = template.size
+    scale = template_width / full_width
+
+    layers = []
+    for layer in spec.get("layers") or []:
+        if not isinstance(layer, Layer):
+            try:
+                layer = layer_from_spec(layer, settings.get("layer"))
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.append(f"خطا در پردازش لایه {layer.get('name', '')}: {str(e)}")
+                continue
+        layers.append(layer)
+    layer_images = tuple(layer.image for layer in layers)
+
+    # مرحله 1: زمینه سفید و لایه‌ها
+    fingerprint = ("layers", template.size, tuple(
+        (id(layer.image), layer.size_percent, layer.opacity, layer.x_percent, layer.y_percent, layer.visible)
+        for layer in layers
+    ))
+    image = _run_stage(
+        cache, (preview_width, "layers"), fingerprint,
+        lambda stage_errors: compose_layers(
+            Image.new('RGBA', (template_width, template_height), (255, 255, 255, 255)), layers,
+            errors=stage_errors if errors is not None else None
+        ),
+        layer_images, errors
+    )
+
+    # مرحله 2: اضافه کردن تمپلیت به عنوان لایه بالایی
+    base_image = image
+    fingerprint = ("template", fingerprint, id(template))
+    image = _run_stage(
+        cache, (preview_width, "template"), fingerprint,
+        lambda stage_errors: Image.alpha_composite(base_image, template),
+        (template,) + layer_images
+    )
+
+    # مرحله 3 و 4: اضافه کردن عنوان و متن
+    text_blocks = (
+        ("title", "عنوان", spec.get("title_text"), DEFAULT_TITLE_SETTINGS, settings.get("title")),
+        ("text", "متن", spec.get("text"), DEFAULT_TEXT_SETTINGS, settings.get("text"))
+    )
+    for stage_name, label, text, defaults, overrides in text_blocks:
+        if not text:
+            continue
+        block_settings = scale_text_settings(merge_settings(defaults, overrides), scale)
+        base_image = image
+        fingerprint = (stage_name, fingerprint, text, _settings_fingerprint(block_settings), strategy)
+        try:
+            image = _run_stage(
+                cache, (preview_width, stage_name), fingerprint,
+                lambda stage_errors: draw_text_block(base_image, text, block_settings, strategy, in_place=cache is None),
+                (template,) + layer_images, errors
+            )
+        except Exception as e:
+            if errors is None:
+                raise
+            # این مرحله رد می‌شود و تصویر مرحله قبل ادامه پیدا می‌کند
+            errors.append(f"خطا در رندر {label}: {str(e)}")
+
+    return image
+
+# تابع بررسی تطابق پیش‌نمایش با خروجی نهایی
+def preview_difference(spec, preview_width=PREVIEW_WIDTH):
+    """
+    پیش‌نمایش را با نسخه کوچک شده رندر کامل مقایسه می‌کند
+    و میانگین اختلاف کانال‌ها (0 تا 255) را برمی‌گرداند
+    """
+    preview = render_image(spec, preview_width=preview_width)
+    final = render_image(spec).resize(preview.size, Image.LANCZOS)
+    difference = ImageChops.difference(preview.convert('RGB'), final.convert('RGB'))
+    return sum(ImageStat.Stat(difference).mean) / 3
+
+# تابع بارگذاری مشخصات رندر از فایل JSONL
+def load_specs(specs_path):
+    specs = []
+    with open(specs_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                specs.append(json.loads(line))
+    return specs
+
+# تابع آماده‌سازی یک مشخصات خوانده شده از فایل برای رندر
+def resolve_spec(spec, templates_dir=None, settings_dir=None, store=None):
+    """
+    مسیرهای نسبی تمپلیت را کامل می‌کند و در صورت نبود settings
+    تنظیمات پیش‌فرض تمپلیت را از دیتابیس تنظیمات (store) یا پوشه تنظیمات می‌خواند
+    """
+    spec = dict(spec)
+    template_path = spec["template"]
+    if templates_dir and not os.path.isabs(template_path):
+        template_path = os.path.join(templates_dir, template_path)
+    spec["template"] = template_path
+
+    template_basename = os.path.splitext(os.path.basename(template_path))[0]
+    if "settings" not in spec and store is not None:
+        settings = store.get_settings(template_basename)
+        if settings is not None:
+            spec["settings"] = settings
+
+    if "settings" not in spec and settings_dir:
+        settings_path = os.path.join(settings_dir, f"{template_basename}.json")
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r', encoding='utf-8') as file:
+                spec["settings"] = json.load(file)
+    return spec
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="رندر دسته‌ای تصاویر از فایل مشخصات JSONL")
+    parser.add_argument("specs", help="فایل JSONL که هر خط آن یک مشخصات رندر است")
+    parser.add_argument("-o", "--output-dir", default="output", help="پوشه ذخیره تصاویر خروجی")
+    parser.add_argument("--templates-dir", default=None, help="پوشه تمپلیت‌ها برای مسیرهای نسبی")
+    parser.add_argument("--settings-dir", default=None, help="پوشه تنظیمات پیش‌فرض تمپلیت‌ها (فایل‌های JSON)")
+    parser.add_argument("--settings-db", default=None, help="دیتابیس تنظیمات برنامه (settings_store) برای تنظیمات پیش‌فرض تمپلیت‌ها")
+    parser.add_argument("--check-preview", action="store_true", help="به جای ساخت تصویر، تطابق پیش‌نمایش با خروجی نهایی بررسی شود")
+    parser.add_argument("--format", default=None, choices=list(EXPORT_FORMATS), type=str.upper,
+                        help="فرمت خروجی؛ اگر داده نشود از پسوند نام خروجی هر ردیف تشخیص داده می‌شود")
+    parser.add_argument("--quality", type=int, default=DEFAULT_EXPORT_OPTIONS["quality"], help="کیفیت JPEG و WebP (1 تا 100)")
+    parser.add_argument("--compress-level", type=int, default=DEFAULT_EXPORT_OPTIONS["compress_level"], help="سطح فشرده‌سازی PNG (0 تا 9)")
+    args = parser.parse_args(argv)
+
+    specs = load_specs(args.specs)
+    os.makedirs(args.output_dir, exist_ok=True)
+    store = get_store(args.settings_db) if args.settings_db else None
+
+    failed = 0
+    for index, spec in enumerate(specs):
+        try:
+            spec = resolve_spec(spec, args.templates_dir, args.settings_dir, store)
+            if args.check_preview:
+                difference = preview_difference(spec)
+                print(f"ردیف {index + 1}: اختلاف پیش‌نمایش {difference:.2f}")
+                if difference > PREVIEW_TOLERANCE:
+                    raise ValueError(f"اختلاف پیش‌نمایش بیشتر از حد مجاز ({PREVIEW_TOLERANCE}) است")
+                continue
+
+            output_name = spec.get("output") or f"{index + 1:04d}"
+            export_options = {
+                "format": args.format or format_from_name(output_name),
+                "quality": args.quality,
+                "compress_level": args.compress_level,
+                **(spec.get("export") or {})
+            }
+            output_name = output_file_name(output_name, export_options["format"])
+            image_data, _, _ = encode_image(render_image(spec), export_options)
+            with open(os.path.join(args.output_dir, output_name), 'wb') as file:
+                file.write(image_data)
+        except Exception as e:
+            failed += 1
+            print(f"خطا در رندر ردیف {index + 1}: {str(e)}", file=sys.stderr)
+
+    print(f"{len(specs) - failed} تصویر از {len(specs)} ساخته شد.")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
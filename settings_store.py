@@ -0,0 +1,264 @@
+import os
+import glob
+import json
+import copy
+import time
+import sqlite3
+import threading
+from types import MappingProxyType
+from contextlib import contextmanager
+
+# مسیر پیش‌فرض دیتابیس تنظیمات (تمپلیت‌ها، تنظیمات پیش‌فرض و رنگ‌ها)
+DEFAULT_DB_PATH = os.environ.get("SETTINGS_DB_PATH", os.path.join("/tmp", "settings.db"))
+
+# فاصله (ثانیه) بین بررسی‌های revision؛ در این فاصله خواندن‌ها بدون هیچ کوئری از کش انجام می‌شوند
+# (نوشتن‌های همین پروسه همیشه فوراً دیده می‌شوند)
+SETTINGS_CACHE_CHECK_SECONDS = float(os.environ.get("SETTINGS_CACHE_CHECK_SECONDS", "1.0"))
+
+# برچسب‌هایی که نسخه‌های قدیمی به نام تمپلیت در فایل تنظیمات اضافه می‌کردند
+LEGACY_NAME_MARKERS = ("⭐ ", " (دارای تنظیمات پیش‌فرض)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS template_settings (
+    template TEXT PRIMARY KEY,
+    settings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS colors (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+"""
+
+# تابع تبدیل مشخصات تمپلیت به JSON (has_settings هنگام خواندن محاسبه می‌شود و ذخیره نمی‌شود)
+def _entry_json(entry):
+    return json.dumps({key: value for key, value in entry.items() if key != "has_settings"}, ensure_ascii=False)
+
+# کلاس ذخیره‌سازی تراکنشی تنظیمات در SQLite (حالت WAL)
+class SettingsStore:
+    """
+    همه نوشتن‌ها در یک تراکنش انجام می‌شوند و شماره revision را یک واحد
+    بالا می‌برند. خواندن‌ها از کش داخل پروسه انجام می‌شوند و فقط وقتی
+    revision تغییر کرده باشد (نوشتن از نشست یا پروسه دیگر) کل داده دوباره
+    خوانده می‌شود. revision حداکثر هر check_seconds یک بار بررسی می‌شود.
+    هر thread اتصال جداگانه خودش را دارد.
+    templates() نمای فقط خواندنی کش را برمی‌گرداند و تمپلیت‌های آن نباید
+    تغییر داده شوند؛ بقیه خواندن‌ها فقط کپی مورد درخواست شده را برمی‌گردانند.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, check_seconds=SETTINGS_CACHE_CHECK_SECONDS):
+        self.db_path = db_path
+        self.check_seconds = check_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._revision = None
+        self._written_revision = 0
+        self._cache = None
+        self._checked_at = 0.0
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        # IMMEDIATE: قفل نوشتن از ابتدای تراکنش گرفته می‌شود تا دو ویرایش همزمان با هم تداخل نکنند
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+            revision = connection.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        # کش کنار گذاشته می‌شود و کشی با revision قدیمی‌تر از این نوشتن دیگر پذیرفته نمی‌شود،
+        # حتی اگر خواندنی که همزمان شروع شده بود بعد از این نقطه تمام شود
+        with self._lock:
+            self._written_revision = max(self._written_revision, revision)
+            self._cache = None
+
+    def _data(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._cache is not None and now - self._checked_at < self.check_seconds:
+                return self._cache
+
+        connection = self._connection()
+        revision = connection.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+        with self._lock:
+            if self._cache is not None and revision == self._revision and revision >= self._written_revision:
+                self._checked_at = now
+                return self._cache
+
+        # همه جدول‌ها در یک تراکنش خوانده می‌شوند تا تصویر سازگاری از داده داشته باشیم
+        connection.execute("BEGIN")
+        try:
+            revision = connection.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+            settings = {template: json.loads(value) for template, value in connection.execute("SELECT template, settings FROM template_settings")}
+            # وجود تنظیمات پیش‌فرض هر تمپلیت همین‌جا یک بار تعیین می‌شود (کلید: نام فایل بدون پسوند)
+            templates = {
+                name: {**json.loads(entry), "has_settings": os.path.splitext(name)[0] in settings}
+                for name, entry in connection.execute("SELECT name, entry FROM templates")
+            }
+            cache = {
+                "templates": MappingProxyType(templates),
+                "settings": settings,
+                "colors": [{"name": name, "value": value} for name, value in connection.execute("SELECT name, value FROM colors ORDER BY position")]
+            }
+        finally:
+            connection.execute("COMMIT")
+        with self._lock:
+            if revision >= self._written_revision:
+                self._cache = cache
+                self._revision = revision
+                self._checked_at = now
+        return cache
+
+    # ---- تمپلیت‌ها ----
+    def templates(self):
+        """
+        نمای فقط خواندنی {نام: مشخصات}؛ مشخصات تمپلیت‌ها نباید تغییر داده شوند
+        هر مشخصات کلید has_settings (وجود تنظیمات پیش‌فرض) را هم دارد
+        """
+        return self._data()["templates"]
+
+    def template(self, name):
+        entry = self._data()["templates"].get(name)
+        return copy.deepcopy(entry) if entry is not None else None
+
+    def put_template(self, entry):
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO templates (name, entry) VALUES (?, ?)",
+                (entry["name"], _entry_json(entry))
+            )
+
+    def delete_template(self, name, template_key=None):
+        """
+        تمپلیت و (در صورت داده شدن template_key) تنظیمات پیش‌فرض آن را در یک تراکنش حذف می‌کند
+        """
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM templates WHERE name = ?", (name,))
+            if template_key is not None:
+                connection.execute("DELETE FROM template_settings WHERE template = ?", (template_key,))
+
+    def replace_templates(self, entries):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM templates")
+            connection.executemany(
+                "INSERT INTO templates (name, entry) VALUES (?, ?)",
+                [(entry["name"], _entry_json(entry)) for entry in entries]
+            )
+
+    # ---- تنظیمات پیش‌فرض تمپلیت‌ها ----
+    def get_settings(self, template_key):
+        settings = self._data()["settings"].get(template_key)
+        return copy.deepcopy(settings) if settings is not None else None
+
+    def has_settings(self, template_key):
+        return template_key in self._data()["settings"]
+
+    def set_settings(self, template_key, settings):
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO template_settings (template, settings) VALUES (?, ?)",
+                (template_key, json.dumps(settings, ensure_ascii=False))
+            )
+
+    # ---- رنگ‌ها ----
+    def colors(self):
+        return copy.deepcopy(self._data()["colors"])
+
+    def set_colors(self, colors):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM colors")
+            connection.executemany(
+                "INSERT INTO colors (position, name, value) VALUES (?, ?, ?)",
+                [(position, color["name"], color["value"]) for position, color in enumerate(colors)]
+            )
+
+    # ---- انتقال داده از فایل‌های JSON قدیمی ----
+    def migrate_json(self, settings_dir=None, colors_path=None, legacy_settings_path=None):
+        """
+        داده فایل‌های JSON قبلی را یک بار وارد دیتابیس می‌کند؛ داده‌ای که از قبل
+        در دیتابیس هست بازنویسی نمی‌شود. فایل‌های قدیمی حذف نمی‌شوند.
+        خروجی: تعداد موارد وارد شده
+        """
+        data = self._data()
+        settings = {}
+
+        # فایل قدیمی data/template_settings.json با نام‌های نمایشی (نسخه‌های ⭐ اولویت دارند)
+        if legacy_settings_path and os.path.exists(legacy_settings_path):
+            try:
+                with open(legacy_settings_path, 'r', encoding='utf-8') as file:
+                    legacy = json.load(file).get("templates", {})
+                for display_name in sorted(legacy, key=lambda name: LEGACY_NAME_MARKERS[0] in name):
+                    name = display_name
+                    for marker in LEGACY_NAME_MARKERS:
+                        name = name.replace(marker, "")
+                    settings[os.path.splitext(name.strip())[0]] = legacy[display_name]
+            except Exception as e:
+                print(f"خطا در خواندن تنظیمات قدیمی: {str(e)}")
+
+        # فایل‌های تنظیمات هر تمپلیت (بر فایل قدیمی اولویت دارند)
+        if settings_dir and os.path.isdir(settings_dir):
+            for path in glob.glob(os.path.join(settings_dir, "*.json")):
+                try:
+                    with open(path, 'r', encoding='utf-8') as file:
+                        settings[os.path.splitext(os.path.basename(path))[0]] = json.load(file)
+                except Exception as e:
+                    print(f"خطا در خواندن تنظیمات {path}: {str(e)}")
+
+        colors = []
+        if not data["colors"] and colors_path and os.path.exists(colors_path):
+            try:
+                with open(colors_path, 'r', encoding='utf-8') as file:
+                    colors = json.load(file)
+            except Exception as e:
+                print(f"خطا در خواندن رنگ‌ها: {str(e)}")
+
+        new_settings = {key: value for key, value in settings.items() if key not in data["settings"]}
+        if not new_settings and not colors:
+            return 0
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO template_settings (template, settings) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in new_settings.items()]
+            )
+            if colors:
+                connection.executemany(
+                    "INSERT INTO colors (position, name, value) VALUES (?, ?, ?)",
+                    [(position, color["name"], color["value"]) for position, color in enumerate(colors)]
+                )
+        return len(new_settings) + len(colors)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+# تابع دریافت نمونه مشترک دیتابیس (یک نمونه برای هر مسیر در کل پروسه)
+def get_store(db_path=DEFAULT_DB_PATH):
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SettingsStore(key)
+        return _stores[key]
@@ -0,0 +1,163 @@
+import os
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+from timing import span
+
+# حداکثر حافظه برای نگهداری تمپلیت‌های باز شده (پیش‌فرض 512 مگابایت)
+DEFAULT_BUDGET_BYTES = int(os.environ.get("TEMPLATE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# کلاس کش مشترک تمپلیت‌های decode شده (RGBA) برای همه نشست‌ها
+class TemplateCache:
+    """
+    تمپلیت‌ها یک بار باز و به RGBA تبدیل می‌شوند و بین همه نشست‌ها مشترک هستند.
+    با تغییر mtime یا اندازه فایل، هش محتوا بررسی می‌شود و فقط در صورت
+    تغییر واقعی محتوا دوباره decode می‌شود. نسخه‌های کوچک شده برای
+    پیش‌نمایش هم در همین کش نگه داشته می‌شوند. با پر شدن بودجه حافظه،
+    قدیمی‌ترین تمپلیت استفاده شده حذف می‌شود.
+    تصویر برگشتی مشترک است و نباید مستقیماً تغییر داده شود.
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        return self._load(os.path.abspath(path))["image"]
+
+    def get_scaled(self, path, size):
+        """
+        نسخه تغییر اندازه داده شده تمپلیت را برمی‌گرداند
+        و تا زمانی که محتوای فایل تغییر نکرده دوباره resize نمی‌کند
+        """
+        path = os.path.abspath(path)
+        base = self._load(path)
+        if base["image"].size == tuple(size):
+            return base["image"]
+
+        key = (path, tuple(size))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["hash"] == base["hash"]:
+                self._entries.move_to_end(key)
+                return entry["image"]
+
+        with span("template.resize"):
+            image = base["image"].resize(size, Image.LANCZOS)
+        self._store(key, {
+            "image": image,
+            "hash": base["hash"],
+            "bytes": image.width * image.height * 4
+        })
+        return image
+
+    def _load(self, path):
+        key = (path, None)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # تمپلیت حذف شده از کش هم حذف می‌شود
+            self.invalidate(path)
+            raise
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                self._entries.move_to_end(key)
+                return entry
+
+        # خواندن فایل و decode خارج از قفل انجام می‌شود
+        with open(path, 'rb') as file:
+            data = file.read()
+        content_hash = hashlib.sha1(data).hexdigest()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["hash"] == content_hash:
+                # فقط زمان فایل تغییر کرده و محتوا همان است
+                entry["mtime"] = stat.st_mtime_ns
+                entry["size"] = stat.st_size
+                self._entries.move_to_end(key)
+                return entry
+
+        with span("template.decode"):
+            # decode از همان بایت‌هایی که برای هش خوانده شد انجام می‌شود تا فایل دو بار خوانده نشود
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            if image.mode != 'RGBA':
+                image = image.convert('RGBA')
+
+        entry = {
+            "image": image,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": content_hash,
+            "bytes": image.width * image.height * 4
+        }
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._remove(key)
+            # تمپلیتی که از کل بودجه بزرگتر است کش نمی‌شود
+            if entry["bytes"] > self.budget_bytes:
+                return
+            self._entries[key] = entry
+            self.total_bytes += entry["bytes"]
+            self._evict()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry["bytes"]
+
+    def _remove_path(self, path):
+        # حذف نسخه اصلی و همه نسخه‌های کوچک شده یک تمپلیت
+        for key in [k for k in self._entries if k[0] == path]:
+            self._remove(key)
+
+    def _evict(self):
+        while self.total_bytes > self.budget_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry["bytes"]
+
+    def invalidate(self, path):
+        with self._lock:
+            self._remove_path(os.path.abspath(path))
+
+    def drop_missing(self):
+        """
+        تمپلیت‌هایی که فایلشان حذف شده را از کش پاک می‌کند
+        """
+        with self._lock:
+            for path in {k[0] for k in self._entries if not os.path.exists(k[0])}:
+                self._remove_path(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "budget_bytes": self.budget_bytes
+            }
+
+# نمونه مشترک برای کل پروسه
+template_cache = TemplateCache()
+
+# تابع دریافت تمپلیت RGBA از کش مشترک
+def get_template(path):
+    return template_cache.get(path)
+
+# تابع دریافت نسخه کوچک شده تمپلیت از کش مشترک
+def get_scaled_template(path, size):
+    return template_cache.get_scaled(path, size)
@@ -0,0 +1,260 @@
+import os
+import io
+import json
+import glob
+import hashlib
+import threading
+from PIL import Image, ImageOps
+
+# پسوندهای قابل قبول برای فایل تمپلیت
+TEMPLATE_EXTENSIONS = (".png", ".jpg")
+
+# فایل فهرست نسخه قبلی (فقط برای انتقال thumbnail ها به دیتابیس خوانده می‌شود)
+LEGACY_MANIFEST_NAME = ".manifest.json"
+
+# پوشه تصاویر کوچک (thumbnail) داخل پوشه تمپلیت‌ها
+THUMBNAILS_DIR_NAME = ".thumbnails"
+
+# عرض تصاویر کوچکی که هنگام ذخیره تمپلیت ساخته می‌شوند (گالری و پیش‌نمایش انتخاب)
+THUMBNAIL_WIDTHS = (160, 320)
+THUMBNAIL_QUALITY = 80
+
+# حداکثر طول بزرگترین ضلع تمپلیت هنگام ذخیره (0 یعنی بدون محدودیت)
+TEMPLATE_MAX_DIMENSION = int(os.environ.get("TEMPLATE_MAX_DIMENSION", "4096"))
+
+# کلید تنظیمات پیش‌فرض یک تمپلیت در دیتابیس (نام فایل بدون پسوند)
+def settings_key(name):
+    return os.path.splitext(name)[0]
+
+# تابع تبدیل به فضای رنگ sRGB در صورت داشتن پروفایل رنگ ICC
+def _to_srgb(image):
+    icc_profile = image.info.get("icc_profile")
+    if not icc_profile:
+        return image
+    try:
+        from PIL import ImageCms
+        source_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        # شفافیت تصاویر P و L (کلید transparency) هم باید در تبدیل به RGBA حفظ شود
+        output_mode = 'RGBA' if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info else 'RGB'
+        if image.mode != output_mode:
+            image = image.convert(output_mode)
+        return ImageCms.profileToProfile(image, source_profile, ImageCms.createProfile("sRGB"), outputMode=output_mode)
+    except Exception as e:
+        # بدون lcms یا با پروفایل خراب، رنگ‌ها همان‌طور که هست می‌مانند
+        print(f"خطا در تبدیل پروفایل رنگ تمپلیت: {str(e)}")
+        return image
+
+# تابع آماده‌سازی تمپلیت آپلود شده برای رندر
+def ingest_template(data, max_dimension=TEMPLATE_MAX_DIMENSION):
+    """
+    تمپلیت یک بار هنگام ذخیره به شکل استاندارد تبدیل می‌شود تا رندرها از
+    یک فایل آماده شروع کنند: چرخش EXIF اعمال، رنگ‌ها به sRGB تبدیل،
+    تصویر RGBA و در صورت نیاز کوچک می‌شود و بدون metadata به PNG ذخیره می‌شود
+    خروجی: بایت‌های PNG
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = _to_srgb(image)
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+
+    if max_dimension and max(image.size) > max_dimension:
+        scale = max_dimension / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+
+    # تصویر جدید بدون info ذخیره می‌شود، پس EXIF، ICC و متن‌های PNG حذف می‌شوند
+    buffer = io.BytesIO()
+    Image.frombytes('RGBA', image.size, image.tobytes()).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+# تابع محاسبه نواحی شفاف و مات تمپلیت
+def template_regions(image):
+    """
+    opaque: تمپلیت هیچ پیکسل شفافی ندارد و لایه‌های زیر آن دیده نمی‌شوند
+    transparent_bbox: ناحیه‌ای که تمپلیت کاملاً مات نیست و لایه‌های زیر آن دیده می‌شوند
+    (هنگام انتخاب تمپلیت به کاربر نمایش داده می‌شود)
+    """
+    if 'A' not in image.getbands() and 'transparency' not in image.info:
+        return {"opaque": True, "transparent_bbox": None}
+    alpha = image.convert('RGBA').getchannel('A')
+    transparent_bbox = ImageOps.invert(alpha).getbbox()
+    return {
+        "opaque": transparent_bbox is None,
+        "transparent_bbox": transparent_bbox
+    }
+
+# کلاس فهرست تمپلیت‌ها (نام، ابعاد، حالت، هش محتوا، زمان و وجود تنظیمات)
+class TemplateLibrary:
+    """
+    مشخصات تمپلیت‌ها در دیتابیس تنظیمات (settings_store) نگه داشته می‌شود و
+    فقط هنگام آپلود، حذف یا بازسازی تغییر می‌کند؛ خواندن فهرست در هر rerun
+    از کش داخل پروسه دیتابیس انجام می‌شود. وجود تنظیمات پیش‌فرض هر تمپلیت
+    (has_settings) در همان کش برای همه تمپلیت‌ها با هم تعیین شده است.
+    اگر دیتابیس هنوز تمپلیتی نداشته باشد، فهرست یک بار از روی فایل‌های
+    پوشه ساخته می‌شود.
+    """
+
+    def __init__(self, templates_dir, store):
+        self.templates_dir = templates_dir
+        self.store = store
+        self.thumbnails_dir = os.path.join(templates_dir, THUMBNAILS_DIR_NAME)
+        self._checked = False
+        self._lock = threading.Lock()
+
+    def entries(self):
+        """
+        تمپلیت‌ها به ترتیب جدیدترین اول
+        """
+        entries = self._load()
+        return sorted(entries.values(), key=lambda entry: entry["mtime"], reverse=True)
+
+    def get(self, name):
+        return self._load().get(name)
+
+    def path(self, name):
+        return os.path.join(self.templates_dir, name)
+
+    def thumbnail_path(self, entry, width):
+        """
+        مسیر کوچکترین thumbnail که عرضش حداقل width باشد (یا بزرگترین موجود)
+        """
+        widths = sorted(int(key) for key in entry["thumbnails"])
+        chosen = next((w for w in widths if w >= width), widths[-1])
+        return os.path.join(self.thumbnails_dir, entry["thumbnails"][str(chosen)])
+
+    def add(self, name, data, normalize=True):
+        """
+        فایل تمپلیت را ذخیره و به فهرست اضافه می‌کند
+        با normalize تمپلیت به PNG استاندارد تبدیل می‌شود (ingest_template)
+        و پسوند نام به .png تغییر می‌کند
+        """
+        if normalize:
+            data = ingest_template(data)
+            name = f"{os.path.splitext(name)[0]}.png"
+        path = self.path(name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        entry = self._describe(name, data, os.stat(path).st_mtime)
+        self.store.put_template(entry)
+        return self.store.template(name)
+
+    def remove(self, name):
+        """
+        فایل تمپلیت و تنظیمات پیش‌فرض آن را حذف و از فهرست خارج می‌کند
+        """
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(path)
+        with self._lock:
+            entries = self.store.templates()
+            entry = entries.get(name)
+            self.store.delete_template(name, settings_key(name))
+            # thumbnail ها با هش محتوا نام‌گذاری شده‌اند و ممکن است بین چند تمپلیت مشترک باشند
+            if entry is not None and not any(
+                other["hash"] == entry["hash"] for other_name, other in entries.items() if other_name != name
+            ):
+                self._remove_thumbnails(entry)
+
+    def rebuild(self, previous=None):
+        """
+        فهرست را از روی فایل‌های پوشه دوباره می‌سازد (برای فایل‌هایی که خارج از برنامه تغییر کرده‌اند)
+        """
+        with self._lock:
+            if previous is None:
+                previous = self.store.templates()
+            entries = []
+            for extension in TEMPLATE_EXTENSIONS:
+                for path in glob.glob(os.path.join(self.templates_dir, f"*{extension}")):
+                    name = os.path.basename(path)
+                    stat = os.stat(path)
+                    entry = previous.get(name)
+                    # تمپلیتی که زمان و اندازه فایلش تغییر نکرده و thumbnail دارد دوباره خوانده نمی‌شود
+                    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size and self._has_thumbnails(entry):
+                        entries.append(entry)
+                        continue
+                    try:
+                        with open(path, 'rb') as file:
+                            entries.append(self._describe(name, file.read(), stat.st_mtime))
+                    except Exception as e:
+                        print(f"خطا در خواندن تمپلیت {name}: {str(e)}")
+            self.store.replace_templates(entries)
+            return len(entries)
+
+    def _describe(self, name, data, mtime):
+        content_hash = hashlib.sha1(data).hexdigest()
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            mode = image.mode
+            regions = template_regions(image)
+            thumbnails = self._make_thumbnails(image, content_hash)
+        return {
+            "name": name,
+            "width": width,
+            "height": height,
+            "mode": mode,
+            "hash": content_hash,
+            "size": len(data),
+            "mtime": mtime,
+            "thumbnails": thumbnails,
+            **regions
+        }
+
+    def _make_thumbnails(self, image, content_hash):
+        """
+        تصاویر کوچک WebP را از بزرگ به کوچک می‌سازد تا تمپلیت اصلی فقط یک بار decode شود
+        """
+        os.makedirs(self.thumbnails_dir, exist_ok=True)
+        # برای JPEG، decode مستقیماً در اندازه کوچکتر انجام می‌شود
+        image.draft('RGB', (max(THUMBNAIL_WIDTHS), max(THUMBNAIL_WIDTHS) * image.height // image.width))
+        thumbnail = image.convert('RGBA') if image.mode not in ('RGB', 'RGBA') else image.copy()
+
+        thumbnails = {}
+        for width in sorted(THUMBNAIL_WIDTHS, reverse=True):
+            thumbnail.thumbnail((width, max(1, width * image.height // image.width)), Image.LANCZOS)
+            file_name = f"{content_hash}-{width}.webp"
+            thumbnail.save(os.path.join(self.thumbnails_dir, file_name), format="WEBP", quality=THUMBNAIL_QUALITY)
+            thumbnails[str(width)] = file_name
+        return thumbnails
+
+    def _has_thumbnails(self, entry):
+        thumbnails = entry.get("thumbnails")
+        return bool(thumbnails) and all(
+            os.path.exists(os.path.join(self.thumbnails_dir, file_name)) for file_name in thumbnails.values()
+        )
+
+    def _remove_thumbnails(self, entry):
+        for file_name in (entry.get("thumbnails") or {}).values():
+            path = os.path.join(self.thumbnails_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load(self):
+        entries = self.store.templates()
+        if not entries and not self._checked:
+            # اولین اجرا: ساخت فهرست از فایل‌های موجود (با استفاده از فایل فهرست قدیمی در صورت وجود)
+            self._checked = True
+            self.rebuild(self._legacy_manifest())
+            entries = self.store.templates()
+        return entries
+
+    def _legacy_manifest(self):
+        manifest_path = os.path.join(self.templates_dir, LEGACY_MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                return {entry["name"]: entry for entry in json.load(file)}
+        except Exception as e:
+            print(f"خطا در خواندن فهرست قدیمی تمپلیت‌ها: {str(e)}")
+            return {}
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+# تابع دریافت فهرست مشترک یک پوشه تمپلیت (یک نمونه برای کل پروسه)
+def get_library(templates_dir, store):
+    key = (os.path.abspath(templates_dir), store.db_path)
+    with _libraries_lock:
+        if key not in _libraries:
+            _libraries[key] = TemplateLibrary(key[0], store)
+        return _libraries[key]
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render_engine
+from render_engine import Layer
+from batch import build_batch_specs
+from jobs import JobManager, JOB_DONE
+
+def test_sequential_batch_resizes_each_layer_once(monkeypatch):
+    resizes = []
+    make_layer_sprite = render_engine.make_layer_sprite
+
+    def counting_make_layer_sprite(source_image, size, opacity):
+        resizes.append(size)
+        return make_layer_sprite(source_image, size, opacity)
+
+    monkeypatch.setattr(render_engine, "make_layer_sprite", counting_make_layer_sprite)
+
+    layer = Layer("layer", Image.new("RGB", (400, 300), "blue"))
+    layer.size_percent = 50
+    base_spec = {
+        "template": Image.new("RGBA", (600, 800), (0, 0, 0, 0)),
+        "title_text": "",
+        "text": "",
+        "settings": {},
+        "layers": [layer],
+        "export": {"format": "PNG"}
+    }
+    specs = build_batch_specs([{"title_text": str(index)} for index in range(5)], base_spec)
+
+    manager = JobManager(workers=1)
+    job = manager.submit_batch("owner", "batch", specs, workers=1)
+    deadline = time.time() + 60
+    while job.active and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert job.status == JOB_DONE, job.error
+    assert job.errors == []
+    assert len(resizes) == 1
+    # لایه صفحه دست نخورده می‌ماند و کش sprite آن پر نمی‌شود
+    assert not layer._sprites
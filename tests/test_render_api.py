@@ -0,0 +1,80 @@
+import os
+import io
+import sys
+import json
+import base64
+import tempfile
+import pytest
+from PIL import Image
+from tornado.testing import AsyncHTTPTestCase
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render_api import RequestError, RenderApplication, build_job
+from settings_store import SettingsStore
+
+def png_bytes(size=(20, 20)):
+    buffer = io.BytesIO()
+    Image.new("RGBA", size, (0, 0, 255, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def templates_dir(tmp_path):
+    Image.new("RGBA", (100, 100), (0, 0, 0, 0)).save(tmp_path / "sample.png")
+    return str(tmp_path)
+
+@pytest.fixture
+def store(tmp_path):
+    return SettingsStore(str(tmp_path / "settings.db"))
+
+def test_valid_request_is_coerced(templates_dir, store):
+    job = build_job({
+        "template": "sample",
+        "settings": {"text": {"font_size_pixels": "32", "text_x_percent": "40.5"}},
+        "layers": [{"image": png_bytes(), "opacity": "50"}],
+        "export": {"format": "jpeg", "quality": "80"}
+    }, store, templates_dir)
+    assert job["settings"]["text"]["font_size_pixels"] == 32
+    assert job["settings"]["text"]["text_x_percent"] == 40.5
+    assert job["layers"][0]["opacity"] == 50
+    assert job["export"]["quality"] == 80
+    assert job["export"]["format"] == "JPEG"
+
+@pytest.mark.parametrize("body", [
+    {"settings": {"text": {"font_size_pixels": "abc"}}},
+    {"settings": {"title": {"font_size_pixels": 0}}},
+    {"settings": {"title": {"text_color": "not-a-color"}}},
+    {"settings": {"layer": {"opacity": 150}}},
+    {"export": {"quality": "x"}},
+    {"export": {"compress_level": True}},
+    {"layers": [{"image": b"this is not an image"}]},
+    {"layers": [{"image": png_bytes(), "size_percent": "big"}]}
+])
+def test_invalid_request_is_rejected(templates_dir, store, body):
+    with pytest.raises(RequestError) as error:
+        build_job({"template": "sample", **body}, store, templates_dir)
+    assert error.value.status == 400
+
+class RenderHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.templates_dir = directory.name
+        Image.new("RGBA", (100, 100), (0, 0, 0, 0)).save(os.path.join(self.templates_dir, "sample.png"))
+        store = SettingsStore(os.path.join(self.templates_dir, "settings.db"))
+        # درخواست‌های نامعتبر به پردازش رندر نمی‌رسند، پس executor لازم نیست
+        return RenderApplication(None, store, 1, self.templates_dir)
+
+    def post_json(self, body):
+        return self.fetch("/render", method="POST", headers={"Content-Type": "application/json"}, body=json.dumps(body))
+
+    def test_bad_input_returns_400(self):
+        bodies = [
+            {"template": "sample", "settings": {"text": {"font_size_pixels": "abc"}}},
+            {"template": "sample", "export": {"quality": "x"}},
+            {"template": "sample", "layers": [{"image": base64.b64encode(b"not an image").decode()}]}
+        ]
+        for body in bodies:
+            response = self.post_json(body)
+            self.assertEqual(response.code, 400, response.body)
+            self.assertIn("error", json.loads(response.body))
@@ -0,0 +1,48 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settings_store import SettingsStore
+
+# اتصالی که خواندن جدول تمپلیت‌ها را تا اجازه نوشتن همزمان نگه می‌دارد
+class PausingConnection:
+    def __init__(self, connection, reading, resume):
+        self._connection = connection
+        self._reading = reading
+        self._resume = resume
+
+    def execute(self, sql, *args):
+        if sql.startswith("SELECT name, entry FROM templates"):
+            self._reading.set()
+            self._resume.wait(10)
+        return self._connection.execute(sql, *args)
+
+def test_write_is_visible_after_concurrent_stale_read(tmp_path):
+    store = SettingsStore(str(tmp_path / "settings.db"), check_seconds=60)
+    store.put_template({"name": "first.png"})
+    store.templates()
+
+    # بعد از این نوشتن، خواننده thread دیگر کل داده را دوباره می‌خواند و وسط خواندن متوقف می‌شود
+    store.put_template({"name": "other.png"})
+    reading, resume = threading.Event(), threading.Event()
+    connection = store._connection
+    main_thread = threading.current_thread()
+
+    def paused_connection():
+        if threading.current_thread() is main_thread:
+            return connection()
+        return PausingConnection(connection(), reading, resume)
+
+    store._connection = paused_connection
+    reader = threading.Thread(target=store.templates)
+    reader.start()
+    assert reading.wait(10)
+
+    # نوشتن بعد از شروع خواندن کهنه؛ خواننده نباید کش قدیمی را برای این نشست ثبت کند
+    store.put_template({"name": "second.png"})
+    resume.set()
+    reader.join(10)
+
+    assert store.template("second.png") is not None
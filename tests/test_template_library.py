@@ -0,0 +1,22 @@
+import os
+import io
+import sys
+import pytest
+from PIL import Image, ImageCms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_library import ingest_template
+
+@pytest.mark.parametrize("mode", ["P", "L"])
+def test_ingest_keeps_transparency_with_icc_profile(mode):
+    image = Image.new(mode, (10, 10), 0)
+    image.putpixel((5, 5), 1)
+    buffer = io.BytesIO()
+    icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    image.save(buffer, format="PNG", transparency=0, icc_profile=icc_profile)
+
+    result = Image.open(io.BytesIO(ingest_template(buffer.getvalue())))
+    assert result.mode == "RGBA"
+    assert result.getpixel((0, 0))[3] == 0
+    assert result.getpixel((5, 5))[3] == 255
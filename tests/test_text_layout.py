@@ -0,0 +1,55 @@
+import os
+import sys
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render_engine
+from render_engine import DEFAULT_TEXT_SETTINGS, LAYOUT_BASIC, LAYOUT_RAQM, RAQM_AVAILABLE, draw_text_block, process_persian_text
+
+WORDS = "یک دو سه چهار پنج شش هفت هشت".split()
+
+class FailingReshaper:
+    def reshape(self, text):
+        raise ValueError("reshaper unavailable")
+
+# ترتیب کلمه‌ها در خطوط رسم شده (هر کلمه همان‌طور که رسم می‌شود جستجو می‌شود)
+def drawn_word_order(monkeypatch, strategy, layout):
+    drawn = []
+    line_sprite = render_engine._line_sprite
+
+    def recording_line_sprite(line, font, font_key, color, direction):
+        drawn.append(line)
+        return line_sprite(line, font, font_key, color, direction)
+
+    monkeypatch.setattr(render_engine, "_line_sprite", recording_line_sprite)
+    settings = {**DEFAULT_TEXT_SETTINGS, "auto_fit": True, "max_text_width_percent": 40, "max_text_height_percent": 100}
+    draw_text_block(Image.new("RGBA", (400, 400), (255, 255, 255, 0)), " ".join(WORDS), settings, strategy, layout=layout)
+
+    word_strategy = "original" if layout == LAYOUT_RAQM else strategy
+    order = []
+    for line in drawn:
+        order.append([index for index, word in enumerate(WORDS) if process_persian_text(word, word_strategy) in line.split()])
+    return order
+
+CASES = [("auto", LAYOUT_BASIC), ("force_reverse", LAYOUT_BASIC), ("original", LAYOUT_BASIC), ("fallback", LAYOUT_BASIC)]
+if RAQM_AVAILABLE:
+    CASES.append(("auto", LAYOUT_RAQM))
+
+@pytest.mark.parametrize("strategy, layout", CASES)
+def test_auto_fit_keeps_line_order(monkeypatch, strategy, layout):
+    if strategy == "fallback":
+        # خطای reshaper استراتژی 2 (معکوس کردن هر خط) را فعال می‌کند
+        monkeypatch.setattr(render_engine, "_reshaper", FailingReshaper())
+        render_engine._shape_text.cache_clear()
+        strategy = "auto"
+    try:
+        order = drawn_word_order(monkeypatch, strategy, layout)
+    finally:
+        render_engine._shape_text.cache_clear()
+
+    assert len(order) > 1
+    assert all(order)
+    # خط اول با کلمه اول شروع می‌شود و کلمه‌ها به ترتیب در خطوط پشت سر هم می‌آیند
+    assert [index for line in order for index in sorted(line)] == list(range(len(WORDS)))
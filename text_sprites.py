@@ -0,0 +1,61 @@
+import os
+import threading
+from collections import OrderedDict
+
+# حداکثر حافظه برای نگهداری خطوط رسم شده متن (پیش‌فرض 64 مگابایت)
+DEFAULT_BUDGET_BYTES = int(os.environ.get("TEXT_SPRITE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# کلاس کش مشترک خطوط رسم شده متن برای همه نشست‌ها
+class TextSpriteCache:
+    """
+    هر خط متن با کلید (متن خط، فونت، رنگ، جهت) فقط یک بار اندازه‌گیری و رسم می‌شود.
+    تغییر موقعیت متن یا ساخت دسته‌ای با عنوان تکراری فقط sprite آماده را
+    در جای جدید قرار می‌دهد. با پر شدن بودجه حافظه، قدیمی‌ترین خط حذف می‌شود.
+    sprite برگشتی مشترک است و نباید مستقیماً تغییر داده شود.
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        # رسم خط خارج از قفل انجام می‌شود
+        entry = build()
+        sprite = entry.get("sprite")
+        entry_bytes = sprite.width * sprite.height * 4 if sprite is not None else 0
+
+        with self._lock:
+            # خطی که از کل بودجه بزرگتر است کش نمی‌شود
+            if key in self._entries or entry_bytes > self.budget_bytes:
+                return entry
+            entry["bytes"] = entry_bytes
+            self._entries[key] = entry
+            self.total_bytes += entry_bytes
+            while self.total_bytes > self.budget_bytes and self._entries:
+                _, old_entry = self._entries.popitem(last=False)
+                self.total_bytes -= old_entry["bytes"]
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "budget_bytes": self.budget_bytes
+            }
+
+# نمونه مشترک برای کل پروسه
+text_sprite_cache = TextSpriteCache()
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from datetime import datetime
+from functools import wraps
+from contextlib import contextmanager
+
+# مسیر فایل JSONL زمان‌بندی‌ها (با مقدار خالی ثبت غیرفعال می‌شود)
+TIMING_LOG_PATH = os.environ.get("TIMING_LOG_PATH", os.path.join("/tmp", "render_timing.jsonl"))
+
+# با رسیدن فایل به این حجم، فایل قبلی به .1 منتقل و فایل جدید شروع می‌شود
+TIMING_LOG_MAX_BYTES = int(os.environ.get("TIMING_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+# کلاس نگهداری زمان مراحل یک اجرای کامل (مثلاً یک rerun صفحه)
+class Timeline:
+    """
+    هر span مدت زمان یک مرحله را ثبت می‌کند. spanهای تو در تو زمان
+    کامل خودشان را دارند، پس زمان مرحله بیرونی شامل مراحل داخلی است.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def totals(self):
+        """
+        مجموع زمان (میلی‌ثانیه) و تعداد اجرای هر مرحله به ترتیب اولین اجرا
+        """
+        totals = {}
+        for name, seconds in self.spans:
+            entry = totals.setdefault(name, {"count": 0, "ms": 0.0})
+            entry["count"] += 1
+            entry["ms"] += seconds * 1000
+        for entry in totals.values():
+            entry["ms"] = round(entry["ms"], 3)
+        return totals
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 3)
+
+# تابع شروع ثبت زمان‌ها برای thread فعلی
+def start_timeline(name="rerun"):
+    timeline = Timeline(name)
+    _local.timeline = timeline
+    return timeline
+
+# تابع دریافت Timeline فعال thread فعلی
+def current_timeline():
+    return getattr(_local, "timeline", None)
+
+# تابع پایان ثبت زمان‌ها و افزودن نتیجه به فایل JSONL
+def finish_timeline(timeline, log_path=None, **fields):
+    if current_timeline() is timeline:
+        _local.timeline = None
+    record = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "timeline": timeline.name,
+        "total_ms": timeline.elapsed_ms(),
+        "spans": timeline.totals(),
+        **fields
+    }
+    log_path = TIMING_LOG_PATH if log_path is None else log_path
+    if log_path:
+        try:
+            _append_record(log_path, record)
+        except OSError as e:
+            print(f"خطا در ذخیره زمان‌بندی: {str(e)}")
+    return record
+
+def _append_record(log_path, record):
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _log_lock:
+        if os.path.exists(log_path) and os.path.getsize(log_path) + len(line) > TIMING_LOG_MAX_BYTES:
+            os.replace(log_path, f"{log_path}.1")
+        with open(log_path, 'a', encoding='utf-8') as file:
+            file.write(line)
+
+# ثبت زمان یک مرحله؛ اگر Timeline فعالی نباشد هیچ کاری انجام نمی‌شود
+@contextmanager
+def span(name):
+    timeline = getattr(_local, "timeline", None)
+    if timeline is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timeline.add(name, time.perf_counter() - start)
+
+# دکوراتور ثبت زمان کل اجرای یک تابع
+def timed(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# تابع محاسبه صدک با روش nearest-rank
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+# تابع خلاصه کردن فایل JSONL به p50/p95 هر مرحله
+def summarize_log(log_path=None, last=None, timeline=None):
+    """
+    برای هر مرحله، زمان هر اجرا (مجموع spanهای آن مرحله در یک اجرا)
+    جمع‌آوری و p50، p95 و بیشترین مقدار برگردانده می‌شود
+    خروجی: {نام مرحله: {"count", "p50_ms", "p95_ms", "max_ms"}}
+    """
+    log_path = log_path or TIMING_LOG_PATH
+    if not log_path or not os.path.exists(log_path):
+        return {}
+
+    records = []
+    with open(log_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if timeline is None or record.get("timeline") == timeline:
+                records.append(record)
+    if last:
+        records = records[-last:]
+
+    samples = {}
+    for record in records:
+        samples.setdefault("total", []).append(record["total_ms"])
+        for name, entry in record.get("spans", {}).items():
+            samples.setdefault(name, []).append(entry["ms"])
+
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 50), 3),
+            "p95_ms": round(_percentile(values, 95), 3),
+            "max_ms": round(max(values), 3)
+        }
+        for name, values in samples.items()
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="خلاصه p50/p95 زمان مراحل از فایل JSONL زمان‌بندی")
+    parser.add_argument("log", nargs="?", default=None, help="فایل JSONL (پیش‌فرض TIMING_LOG_PATH)")
+    parser.add_argument("--last", type=int, default=None, help="فقط این تعداد اجرای آخر بررسی شود")
+    parser.add_argument("--timeline", default=None, help="فقط اجراهای با این نام (مثلاً rerun)")
+    args = parser.parse_args(argv)
+
+    summary = summarize_log(args.log, args.last, args.timeline)
+    if not summary:
+        print("هیچ زمان‌بندی ثبت نشده است.")
+        return 1
+    print(f"{'stage':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'max ms':>11}")
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]["p95_ms"]):
+        print(f"{name:<28}{entry['count']:>7}{entry['p50_ms']:>11.2f}{entry['p95_ms']:>11.2f}{entry['max_ms']:>11.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())